@@ -0,0 +1,147 @@
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from xai.encoding import Artifact
+
+
+# Maps behind ``/explain?output=urls`` links stay fetchable for ARTIFACT_TTL_S
+# after the response that handed the links out. With ARTIFACT_STORE_DIR they
+# are files, so every serve.py worker can answer the fetch.
+ARTIFACT_TTL_S = float(os.getenv("ARTIFACT_TTL_S", "3600"))
+ARTIFACT_STORE_MAX_BYTES = int(float(os.getenv("ARTIFACT_STORE_MAX_MB", "256")) * 1024 * 1024)
+ARTIFACT_STORE_DIR = os.getenv("ARTIFACT_STORE_DIR")
+# Without a shared directory a link may reach a worker that never stored it.
+URLS_ENABLED = bool(ARTIFACT_STORE_DIR) or int(os.getenv("SERVE_WORKERS", "1")) <= 1
+
+Maps = Dict[str, Artifact]
+
+
+class ArtifactStoreFull(RuntimeError):
+    """Raised when live artifacts leave no room; they are never evicted early."""
+
+
+class ArtifactStore:
+    """
+    Explanation maps by result key, each kept until ``ttl_seconds`` after its
+    last ``put``. Unlike the result cache nothing is evicted before then: a
+    ``put`` that would exceed ``max_bytes`` raises ``ArtifactStoreFull``.
+    """
+
+    def __init__(
+        self, max_bytes: int, ttl_seconds: float, disk_dir: Optional[Path] = None
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: Dict[str, Tuple[Maps, int, float]] = {}  # key -> (maps, size, expires)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"stored": 0, "rejected": 0, "expirations": 0}
+
+    def _path(self, key: str) -> Path:
+        assert self.disk_dir is not None
+        return self.disk_dir / f"{key}.pkl"
+
+    def _purge_memory(self, now: float) -> None:
+        for key in [k for k, (_, _, expires) in self._entries.items() if expires <= now]:
+            self._bytes -= self._entries.pop(key)[1]
+            self._counters["expirations"] += 1
+
+    def _disk_usage(self, now: float, skip: str = "") -> Tuple[int, int]:
+        """Count and bytes of live files other than ``skip``; expired ones are deleted."""
+        assert self.disk_dir is not None
+        count = total = 0
+        for path in self.disk_dir.glob("*.pkl"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_mtime + self.ttl_seconds <= now:
+                path.unlink(missing_ok=True)
+                self._counters["expirations"] += 1
+            elif path.stem != skip:
+                count += 1
+                total += st.st_size
+        return count, total
+
+    def put(self, key: str, maps: Maps) -> float:
+        """Keep ``maps`` for another ``ttl_seconds``; returns when they expire."""
+        now = time.time()
+        with self._lock:
+            if self.disk_dir is not None:
+                blob = pickle.dumps(maps, protocol=pickle.HIGHEST_PROTOCOL)
+                if self._disk_usage(now, key)[1] + len(blob) > self.max_bytes:
+                    self._counters["rejected"] += 1
+                    raise ArtifactStoreFull("Artifact store is full.")
+                path = self._path(key)
+                tmp = path.with_suffix(f".tmp{threading.get_ident()}")
+                tmp.write_bytes(blob)
+                os.replace(tmp, path)
+            else:
+                self._purge_memory(now)
+                size = sum(len(artifact.data) for artifact in maps.values())
+                old = self._entries.get(key)
+                if self._bytes - (old[1] if old else 0) + size > self.max_bytes:
+                    self._counters["rejected"] += 1
+                    raise ArtifactStoreFull("Artifact store is full.")
+                self._bytes += size - (old[1] if old else 0)
+                self._entries[key] = (maps, size, now + self.ttl_seconds)
+            self._counters["stored"] += 1
+        return now + self.ttl_seconds
+
+    def get(self, key: str, field: str) -> Tuple[Optional[Artifact], float]:
+        """The artifact and its expiry time, or ``(None, 0.0)`` once expired."""
+        now = time.time()
+        if self.disk_dir is not None:
+            path = self._path(key)
+            try:
+                expires = path.stat().st_mtime + self.ttl_seconds
+                if expires <= now:
+                    return None, 0.0
+                maps = pickle.loads(path.read_bytes())
+            except FileNotFoundError:
+                return None, 0.0
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None or entry[2] <= now:
+                return None, 0.0
+            maps, _, expires = entry
+        artifact = maps.get(field)
+        return (artifact, expires) if isinstance(artifact, Artifact) else (None, 0.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self.disk_dir is not None:
+                entries, stored = self._disk_usage(time.time())
+            else:
+                self._purge_memory(time.time())
+                entries, stored = len(self._entries), self._bytes
+            return {
+                **self._counters,
+                "entries": entries,
+                "bytes": stored,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_dir": str(self.disk_dir) if self.disk_dir is not None else None,
+            }
+
+
+_store: Optional[ArtifactStore] = None
+
+
+def get_artifact_store() -> ArtifactStore:
+    global _store
+    if _store is None:
+        _store = ArtifactStore(
+            ARTIFACT_STORE_MAX_BYTES,
+            ARTIFACT_TTL_S,
+            Path(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR else None,
+        )
+    return _store
@@ -0,0 +1,36 @@
+"""Shared helpers for the benchmark scripts."""
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from models import loader
+
+
+def use_random_weights() -> None:
+    """Serve randomly initialized classifiers; timings do not depend on the weights."""
+    loader._registry.reset(lambda name: loader._build_model(name).to(loader._device).eval())
+
+
+def random_image(size: int, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+
+
+def time_call(fn: Callable[[], object], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    """Latency percentiles (ms) of ``fn`` over ``repeats`` calls after ``warmup`` calls."""
+    for _ in range(warmup):  # engine construction, allocator, first-call overheads
+        fn()
+    samples: List[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    arr = np.array(samples)
+    return {
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+    }
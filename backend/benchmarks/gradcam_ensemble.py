@@ -0,0 +1,70 @@
+"""
+Ensemble Grad-CAM vs. four separate single-model Grad-CAM calls.
+
+Run from ``backend/``:
+
+    python -m benchmarks.gradcam_ensemble --repeats 20 --image-size 512
+
+Uses the real checkpoints when they are present, randomly initialized
+weights otherwise (or with ``--random-weights``); timings do not depend on
+the weight values.
+"""
+import argparse
+import json
+
+import torch
+
+from benchmarks.common import random_image, time_call, use_random_weights
+from models import loader
+from xai.gradcam import generate_ensemble_gradcam, generate_gradcam
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = default)")
+    parser.add_argument("--random-weights", action="store_true")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.random_weights:
+        use_random_weights()
+    else:
+        try:
+            loader.load_models()
+        except RuntimeError:
+            use_random_weights()
+
+    image = random_image(args.image_size)
+
+    models = loader.load_models()
+    tensors = loader.preprocess_image(image)
+    pred_idx = loader.CLASS_NAMES.index(loader.predict_ensemble(image, tensors=tensors)[0])
+
+    def ensemble() -> None:
+        generate_ensemble_gradcam(image, tensors=tensors, pred_idx=pred_idx)
+
+    def separate() -> None:
+        for name in models:
+            generate_gradcam(
+                image,
+                model_name=name,
+                tensor=tensors[loader.TRANSFORM_SIZES[name]],
+                pred_idx=pred_idx,
+            )
+
+    result = {
+        "models": list(models.keys()),
+        "image_size": args.image_size,
+        "threads": torch.get_num_threads(),
+        "ensemble": time_call(ensemble, args.repeats),
+        "separate_x4": time_call(separate, args.repeats),
+    }
+    result["speedup"] = result["separate_x4"]["mean_ms"] / result["ensemble"]["mean_ms"]
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
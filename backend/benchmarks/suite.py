@@ -0,0 +1,203 @@
+"""
+Component benchmarks for the inference and XAI hot paths.
+
+Run from ``backend/``:
+
+    python -m benchmarks.suite --image-sizes 224 1024 --batch-sizes 1 8 \
+        --threads 1 4 --out bench.json
+
+Classifiers are randomly initialized (``--checkpoints`` uses the real ones),
+so the suite runs offline. Every component is timed for each combination of
+image size and torch thread count; batched components also sweep the batch
+size. Results are written as JSON together with the environment, and
+``--baseline old.json`` prints the p50 change against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from benchmarks.common import random_image, time_call, use_random_weights
+from models import loader
+from xai import lime_explainer
+from xai.encoding import encode_heatmap, encode_image
+from xai.gradcam import generate_gradcam
+from xai.gradient_shap_explainer import generate_gradient_shap
+
+
+COMPONENTS = (
+    "preprocess",
+    "predict_single",
+    "predict_ensemble",
+    "predict_ensemble_batch",
+    "gradcam",
+    "lime",
+    "shap",
+    "encode",
+)
+BATCHED = {"preprocess", "predict_ensemble_batch"}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def _environment() -> Dict[str, object]:
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "device": str(loader._device),
+        "cpu_count": os.cpu_count(),
+        "precision": loader.MODEL_PRECISION,
+        "backend": loader.INFERENCE_BACKEND,
+    }
+
+
+def _cases(
+    component: str, image_size: int, batch_size: int, args: argparse.Namespace
+) -> Dict[str, Callable[[], object]]:
+    """Callables to time for one component, keyed by model (``None`` = n/a)."""
+    images = [random_image(image_size, seed=i) for i in range(batch_size)]
+    image = images[0]
+    models = loader.available_models()
+
+    if component == "preprocess":
+        return {"-": lambda: loader.preprocess_batch(images)}
+    if component == "predict_ensemble":
+        return {"ensemble": lambda: loader.predict_ensemble(image)}
+    if component == "predict_ensemble_batch":
+        return {"ensemble": lambda: loader.predict_ensemble_batch(images)}
+
+    cases: Dict[str, Callable[[], object]] = {}
+    for name in models:
+        if component == "predict_single":
+            cases[name] = lambda name=name: loader.predict_single_model(name, image)
+        elif component == "gradcam":
+            cases[name] = lambda name=name: generate_gradcam(image, model_name=name)
+        elif component == "lime":
+
+            def lime(name: str = name) -> object:
+                lime_explainer._segment_cache.clear()  # time segmentation as well
+                return lime_explainer.generate_lime_overlay(
+                    image, model_name=name, num_samples=args.lime_samples
+                )
+
+            cases[name] = lime
+        elif component == "shap":
+            cases[name] = lambda name=name: generate_gradient_shap(
+                image, model_name=name, n_samples=args.shap_samples
+            )
+    if component == "gradcam":
+        cases["ensemble"] = lambda: generate_gradcam(image, model_name="ensemble")
+    if component == "encode":
+        # overlay/heatmap encoding plus the base64 step of the JSON response
+        overlay = np.asarray(image)
+        heatmap = np.random.default_rng(0).random(image.size[::-1], dtype=np.float32)
+        cases = {
+            "overlay_png": lambda: encode_image(overlay).base64(),
+            "overlay_webp": lambda: encode_image(overlay, image_format="webp").base64(),
+            "heatmap_png": lambda: encode_heatmap(heatmap).base64(),
+        }
+    return cases
+
+
+def run_suite(args: argparse.Namespace) -> List[Dict[str, object]]:
+    results: List[Dict[str, object]] = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for image_size in args.image_sizes:
+            for component in args.components:
+                repeats = args.xai_repeats if component in ("lime", "shap") else args.repeats
+                batch_sizes = args.batch_sizes if component in BATCHED else [1]
+                for batch_size in batch_sizes:
+                    for model, fn in _cases(component, image_size, batch_size, args).items():
+                        timing = time_call(fn, repeats)
+                        entry = {
+                            "component": component,
+                            "model": model,
+                            "image_size": image_size,
+                            "batch_size": batch_size,
+                            "threads": threads,
+                            "repeats": repeats,
+                            **timing,
+                            "items_per_s": 1000.0 * batch_size / timing["mean_ms"],
+                        }
+                        results.append(entry)
+                        print(
+                            f"{component:>22} {model:>14} size={image_size:<5} "
+                            f"batch={batch_size:<3} threads={threads:<3} "
+                            f"p50={timing['p50_ms']:9.2f}ms p95={timing['p95_ms']:9.2f}ms"
+                        )
+    return results
+
+
+def _case_key(entry: Dict[str, object]) -> tuple:
+    return tuple(entry[k] for k in ("component", "model", "image_size", "batch_size", "threads"))
+
+
+def compare(baseline: Dict[str, object], results: List[Dict[str, object]]) -> None:
+    """Print the p50 change of every case that is also in ``baseline``."""
+    previous = {_case_key(e): e for e in baseline["results"]}
+    print(f"\nvs. baseline {baseline['environment'].get('commit')}:")
+    for entry in results:
+        old = previous.get(_case_key(entry))
+        if old is None:
+            continue
+        change = 100.0 * (entry["p50_ms"] / old["p50_ms"] - 1.0)
+        print(
+            f"{entry['component']:>22} {entry['model']:>14} size={entry['image_size']:<5} "
+            f"batch={entry['batch_size']:<3} threads={entry['threads']:<3} "
+            f"p50 {old['p50_ms']:9.2f} -> {entry['p50_ms']:9.2f}ms ({change:+.1f}%)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--components", nargs="+", choices=COMPONENTS, default=list(COMPONENTS))
+    parser.add_argument("--image-sizes", nargs="+", type=int, default=[224, 1024])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--threads", nargs="+", type=int, default=[torch.get_num_threads()])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--xai-repeats", type=int, default=3, help="repeats for LIME and SHAP")
+    parser.add_argument("--lime-samples", type=int, default=300)
+    parser.add_argument("--shap-samples", type=int, default=5)
+    parser.add_argument("--checkpoints", action="store_true", help="use the real checkpoints")
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    args = parser.parse_args()
+
+    if not args.checkpoints:
+        use_random_weights()
+    # timings do not depend on the int8-static calibration data
+    loader.ALLOW_RANDOM_CALIBRATION = True
+
+    report = {
+        "environment": _environment(),
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("out", "baseline")
+        },
+        "results": run_suite(args),
+    }
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        compare(json.loads(args.baseline.read_text()), report["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(digest: str, *parts: Any, **params: Any) -> str:
+    """Cache key for an image digest plus model / explanation / parameters."""
+    payload = json.dumps([digest, parts, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier content-addressed cache for prediction and explanation results.
+
+    The memory tier is an LRU bounded by total pickled size and a TTL; the
+    optional disk tier keeps pickles under ``disk_dir`` so results survive a
+    restart. Concurrent ``get_or_compute`` calls for the same key share one
+    computation.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_seconds: float,
+        disk_dir: Optional[Path] = None,
+        disk_max_bytes: int = 0,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self._disk_writes = 0
+        self._counters: Dict[str, int] = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "disk_evictions": 0,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    # -- memory tier -------------------------------------------------------
+
+    def _get_memory(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, size, stored_at = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._bytes -= size
+                self._counters["expirations"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def _set_memory(self, key: str, value: Any, size: int, stored_at: float) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, stored_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counters["evictions"] += 1
+
+    # -- disk tier ---------------------------------------------------------
+
+    def _disk_path(self, key: str) -> Path:
+        assert self.disk_dir is not None
+        return self.disk_dir / f"{key}.pkl"
+
+    def _get_disk(self, key: str) -> Tuple[bool, Any, int, float]:
+        if self.disk_dir is None:
+            return False, None, 0, 0.0
+        path = self._disk_path(key)
+        try:
+            stored_at = path.stat().st_mtime
+            if time.time() - stored_at > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                self._count("expirations")
+                return False, None, 0, 0.0
+            blob = path.read_bytes()
+            return True, pickle.loads(blob), len(blob), stored_at
+        except FileNotFoundError:
+            return False, None, 0, 0.0
+        except Exception as e:
+            print(f"Warning: dropping unreadable cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return False, None, 0, 0.0
+
+    def _set_disk(self, key: str, blob: bytes) -> None:
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp = path.with_suffix(f".tmp{threading.get_ident()}")
+        tmp.write_bytes(blob)
+        os.replace(tmp, path)
+        self._disk_writes += 1
+        if self.disk_max_bytes and self._disk_writes % 32 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        assert self.disk_dir is not None
+        files = []
+        for path in self.disk_dir.glob("*.pkl"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            self._count("disk_evictions")
+
+    # -- public API --------------------------------------------------------
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        found, value = self._get_memory(key)
+        if found:
+            self._count("hits")
+            return True, value
+        found, value, size, stored_at = self._get_disk(key)
+        if found:
+            self._count("disk_hits")
+            self._set_memory(key, value, size, stored_at)
+            return True, value
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._set_memory(key, value, len(blob), time.time())
+        self._set_disk(key, blob)
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Return the cached value for ``key`` or compute and store it.
+
+        Identical concurrent requests await the same task, so the work runs
+        once; the task is shielded so one caller disconnecting does not cancel
+        it for the others.
+        """
+        found, value = self._get_memory(key)
+        if found:
+            self._count("hits")
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count("coalesced")
+            return await asyncio.shield(task)
+
+        async def _load_or_compute() -> Any:
+            try:
+                if self.disk_dir is not None:
+                    found, value = await asyncio.to_thread(self.get, key)
+                    if found:
+                        return value
+                self._count("misses")
+                value = await compute()
+                if self.disk_dir is not None:
+                    await asyncio.to_thread(self.set, key, value)
+                else:
+                    self.set(key, value)
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.ensure_future(_load_or_compute())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            resident = self._bytes
+        lookups = counters["hits"] + counters["disk_hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": (counters["hits"] + counters["disk_hits"]) / lookups
+            if lookups
+            else 0.0,
+            "entries": entries,
+            "bytes": resident,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "inflight": len(self._inflight),
+            "disk_dir": str(self.disk_dir) if self.disk_dir is not None else None,
+        }
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        disk_dir = os.getenv("RESULT_CACHE_DIR")
+        _cache = ResultCache(
+            max_bytes=int(float(os.getenv("RESULT_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_S", "3600")),
+            disk_dir=Path(disk_dir) if disk_dir else None,
+            disk_max_bytes=int(
+                float(os.getenv("RESULT_CACHE_DISK_MAX_MB", "2048")) * 1024 * 1024
+            ),
+        )
+    return _cache
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+CHAT_SESSION_TTL_S = float(os.getenv("CHAT_SESSION_TTL_S", "3600"))
+# Estimated tokens of earlier turns resent with every message; older turns
+# beyond it are condensed into a short digest (at most a quarter of it).
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+_DIGEST_CHARS_PER_TURN = 160
+# Sessions live in one process's memory; serve.py workers share a socket, so
+# a follow-up message could reach a worker that has never seen the session.
+SESSIONS_ENABLED = int(os.getenv("SERVE_WORKERS", "1")) <= 1
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for budgeting
+    return len(text) // 4 + 1
+
+
+@dataclass
+class ChatSession:
+    """
+    Conversation state kept between ``/chat`` calls.
+
+    ``turns`` are ``(role, content)`` pairs, oldest first. ``system_prompt``
+    is built once per context. ``digest`` condenses the turns that fell out
+    of the token budget.
+    """
+
+    session_id: str
+    system_prompt: str
+    context: Optional[object] = None
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    digest: List[str] = field(default_factory=list)
+    compacted_turns: int = 0
+    last_used: float = 0.0
+
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(text) for _, text in self.turns) + sum(
+            estimate_tokens(line) for line in self.digest
+        )
+
+    def append(self, turns: List[Tuple[str, str]], budget: int) -> None:
+        """Add completed turns, then compact the oldest ones to fit ``budget``."""
+        self.turns.extend(turns)
+        tokens = [estimate_tokens(text) for _, text in self.turns]
+        total = sum(tokens)
+        dropped = 0
+        # keep the latest exchange verbatim even if it alone is over budget
+        while total > budget and len(self.turns) - dropped > 2:
+            role, text = self.turns[dropped]
+            if len(text) > _DIGEST_CHARS_PER_TURN:
+                text = text[:_DIGEST_CHARS_PER_TURN].rstrip() + "..."
+            self.digest.append(f"{role}: {' '.join(text.split())}")
+            total -= tokens[dropped]
+            dropped += 1
+        if dropped:
+            del self.turns[:dropped]
+            self.compacted_turns += dropped
+            digest_budget = max(1, budget // 4)
+            while len(self.digest) > 1 and sum(map(estimate_tokens, self.digest)) > digest_budget:
+                self.digest.pop(0)
+
+
+class ChatSessionStore:
+    """
+    In-memory chat sessions: an LRU of at most ``max_sessions``, each
+    expiring ``ttl_seconds`` after its last use.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = CHAT_MAX_SESSIONS,
+        ttl_seconds: float = CHAT_SESSION_TTL_S,
+        token_budget: int = CHAT_HISTORY_TOKEN_BUDGET,
+    ) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self.token_budget = max(1, token_budget)
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {"created": 0, "evictions": 0, "expirations": 0}
+
+    def create(self, system_prompt: str, context: Optional[object] = None) -> ChatSession:
+        session = ChatSession(
+            uuid.uuid4().hex, system_prompt, context=context, last_used=time.time()
+        )
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._counters["created"] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._counters["evictions"] += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.last_used > self.ttl_seconds:
+                del self._sessions[session_id]
+                self._counters["expirations"] += 1
+                return None
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def set_context(
+        self, session: ChatSession, context: object, build_prompt: Callable[[object], str]
+    ) -> None:
+        with self._lock:
+            session.context = context
+            session.system_prompt = build_prompt(context)
+
+    def append(self, session: ChatSession, turns: List[Tuple[str, str]]) -> None:
+        with self._lock:
+            session.append(turns, self.token_budget)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "token_budget": self.token_budget,
+                **self._counters,
+            }
+
+
+_store: Optional[ChatSessionStore] = None
+
+
+def get_session_store() -> ChatSessionStore:
+    global _store
+    if _store is None:
+        _store = ChatSessionStore()
+    return _store
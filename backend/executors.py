@@ -0,0 +1,137 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+# Workload classes and their limits. Each class gets its own bounded pool so a
+# burst of LIME requests cannot starve predictions (and vice versa). Limits can
+# be overridden with <CLASS>_WORKERS / <CLASS>_MAX_PENDING, e.g. LIME_WORKERS=2.
+WORKLOADS: Dict[str, Dict[str, int]] = {
+    "predict": {"workers": 2, "max_pending": 64},
+    "gradcam": {"workers": 2, "max_pending": 16},
+    "shap": {"workers": 1, "max_pending": 8},
+    "lime": {"workers": 1, "max_pending": 4},
+}
+
+# LIME is mostly Python/NumPy work around the forward passes; it can be moved
+# to worker processes so it does not compete for the GIL with the API workers.
+LIME_USE_PROCESSES = os.getenv("LIME_PROCESS_POOL", "0") == "1"
+
+
+class WorkerSaturated(RuntimeError):
+    """Raised when a workload class already has its maximum of queued jobs."""
+
+    def __init__(self, workload: str) -> None:
+        super().__init__(f"Workload '{workload}' is saturated, retry later.")
+        self.workload = workload
+
+
+class _Workload:
+    def __init__(
+        self, name: str, workers: int, max_pending: int, use_processes: bool = False
+    ) -> None:
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._in_flight = 0  # running + queued; only touched on the event loop
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                # spawn avoids forking a parent whose torch thread pools are live
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=f"{self.name}-worker"
+                )
+        return self._executor
+
+    def _release(
+        self, loop: asyncio.AbstractEventLoop, _: "concurrent.futures.Future[Any]"
+    ) -> None:
+        # called from the executor's thread once the work itself is done
+        try:
+            loop.call_soon_threadsafe(self._finished)
+        except RuntimeError:  # loop already closed at shutdown
+            pass
+
+    def _finished(self) -> None:
+        self._in_flight -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if self._in_flight >= self.workers + self.max_pending:
+            raise WorkerSaturated(self.name)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        if not self.use_processes:
+            # carry the request context (stage timings) into the worker thread
+            call = functools.partial(contextvars.copy_context().run, call)
+        future = self.executor.submit(call)
+        self._in_flight += 1
+        # Counted until the call itself finishes, not until the awaiting
+        # request does: a cancelled request leaves its work running, and
+        # that work still occupies the pool.
+        future.add_done_callback(functools.partial(self._release, loop))
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self._in_flight,
+            "processes": self.use_processes,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_workloads: Dict[str, _Workload] = {
+    name: _Workload(
+        name,
+        workers=_env_int(f"{name.upper()}_WORKERS", limits["workers"]),
+        max_pending=_env_int(f"{name.upper()}_MAX_PENDING", limits["max_pending"]),
+        use_processes=name == "lime" and LIME_USE_PROCESSES,
+    )
+    for name, limits in WORKLOADS.items()
+}
+
+
+async def run_in_workload(
+    workload: str, fn: Callable[..., Any], *args: Any, **kwargs: Any
+) -> Any:
+    """
+    Run blocking ``fn`` on the bounded executor of ``workload``.
+
+    Raises ``WorkerSaturated`` instead of queueing without bound, so the API
+    can answer 503 rather than piling up work behind a busy pool.
+    """
+    if workload not in _workloads:
+        raise ValueError(f"Unknown workload: {workload}")
+    return await _workloads[workload].run(fn, *args, **kwargs)
+
+
+def workload_stats() -> Dict[str, dict]:
+    return {name: workload.stats() for name, workload in _workloads.items()}
+
+
+def shutdown_workloads() -> None:
+    for workload in _workloads.values():
+        workload.shutdown()
@@ -0,0 +1,363 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from executors import WorkerSaturated
+import metrics
+
+
+# Lower value = served first. Interactive jobs always overtake queued bulk jobs.
+PRIORITIES = {"interactive": 0, "bulk": 1}
+FINISHED = ("succeeded", "failed", "cancelled")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(24 * 3600)))
+JOB_STORE_DIR = Path(
+    os.getenv("JOB_STORE_DIR", str(Path(__file__).resolve().parents[1] / "job_store"))
+)
+# Jobs of other server processes sharing the store are read from disk.
+_STORE_POLL_S = 0.5
+_JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+@dataclass
+class Job:
+    job_id: str
+    priority: str
+    payload: Dict[str, Any]  # JSON-serializable job parameters
+    status: str = "queued"  # queued | running | succeeded | failed | cancelled
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    owner: Optional[int] = None  # pid of the process that queued or runs it
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    One directory per store: ``<id>.json`` (job state), ``<id>.upload``
+    (input, removed once the job finishes), ``<id>.result.json`` and
+    ``<id>.cancel`` (a cancellation for the process owning the job).
+    Writes are atomic renames, so a crash never leaves a torn file. Several
+    server processes may share one store.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str) -> Path:
+        return self.directory / f"{job_id}{suffix}"
+
+    def _write(self, path: Path, data: bytes) -> None:
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def save_job(self, job: Job) -> None:
+        self._write(self._path(job.job_id, ".json"), json.dumps(asdict(job)).encode("utf-8"))
+
+    def load_job(self, job_id: str) -> Optional[Job]:
+        if not _JOB_ID_RE.fullmatch(job_id):
+            return None
+        try:
+            return Job(**json.loads(self._path(job_id, ".json").read_bytes()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def request_cancel(self, job_id: str) -> None:
+        self._write(self._path(job_id, ".cancel"), b"")
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return self._path(job_id, ".cancel").exists()
+
+    def save_upload(self, job_id: str, data: bytes) -> None:
+        self._write(self._path(job_id, ".upload"), data)
+
+    def load_upload(self, job_id: str) -> Optional[bytes]:
+        try:
+            return self._path(job_id, ".upload").read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def save_result(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._write(self._path(job_id, ".result.json"), json.dumps(result).encode("utf-8"))
+        self.delete_upload(job_id)
+
+    def delete_upload(self, job_id: str) -> None:
+        self._path(job_id, ".upload").unlink(missing_ok=True)
+
+    def load_result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._path(job_id, ".result.json").read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def delete(self, job_id: str) -> None:
+        for suffix in (".json", ".upload", ".result.json", ".cancel"):
+            self._path(job_id, suffix).unlink(missing_ok=True)
+
+    def load_jobs(self) -> List[Job]:
+        jobs = []
+        for path in self.directory.glob("*.json"):
+            if path.name.endswith(".result.json"):
+                continue
+            try:
+                jobs.append(Job(**json.loads(path.read_bytes())))
+            except Exception as e:
+                print(f"Warning: dropping unreadable job file {path}: {e}")
+                path.unlink(missing_ok=True)
+        return jobs
+
+
+class JobQueue:
+    """
+    In-process priority queue for long-running jobs.
+
+    ``handler(data, payload)`` does the work and returns a JSON-serializable
+    result. Jobs are persisted before they are acknowledged, so queued and
+    interrupted jobs are picked up again after a restart (``recover``), and
+    results outlive both the submitting request and the process until
+    ``retention_s`` has passed.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[bytes, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        store: JobStore,
+        workers: int = JOB_WORKERS,
+        max_queued: int = JOB_MAX_QUEUED,
+        retention_s: float = JOB_RETENTION_S,
+    ) -> None:
+        self.handler = handler
+        self.store = store
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.retention_s = retention_s
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._done: Dict[str, asyncio.Event] = {}
+        self._seq = itertools.count()
+
+    def _ensure_workers(self) -> asyncio.PriorityQueue:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._workers = [task for task in self._workers if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self.workers:
+            # a fresh context, so workers do not inherit the submitting request
+            self._workers.append(contextvars.Context().run(loop.create_task, self._work()))
+        return self._queue
+
+    def _enqueue(self, job: Job) -> None:
+        queue = self._ensure_workers()
+        queue.put_nowait((PRIORITIES[job.priority], next(self._seq), job.job_id))
+
+    def _queued(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    async def submit(self, data: bytes, payload: Dict[str, Any], priority: str) -> Job:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        await self.prune()
+        if self._queued() >= self.max_queued:
+            raise WorkerSaturated("jobs")
+        job = Job(
+            uuid.uuid4().hex, priority, payload, created_at=time.time(), owner=os.getpid()
+        )
+        await asyncio.to_thread(self.store.save_upload, job.job_id, data)
+        await asyncio.to_thread(self.store.save_job, job)
+        self._jobs[job.job_id] = job
+        self._enqueue(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """A job of this process, or of another one sharing the store."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = await asyncio.to_thread(self.store.load_job, job_id)
+        return job
+
+    async def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.get(job_id)
+        if job is None or job.status != "succeeded":
+            return None
+        return await asyncio.to_thread(self.store.load_result, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """The job once it has finished or ``timeout`` seconds have passed."""
+        job = await self.get(job_id)
+        if job is None or job.status in FINISHED or timeout <= 0:
+            return job
+        if job_id not in self._jobs:
+            # another process runs it; follow its state in the store
+            deadline = time.monotonic() + timeout
+            while job is not None and job.status not in FINISHED:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(_STORE_POLL_S, remaining))
+                job = await asyncio.to_thread(self.store.load_job, job_id)
+            return job
+        event = self._done.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a queued or running job. A running job stops at its next await;
+        work already handed to a worker thread completes (and is cached) but
+        its result is discarded. Jobs of another process are cancelled by
+        that process, within about a second.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = await asyncio.to_thread(self.store.load_job, job_id)
+            if job is not None and job.status not in FINISHED:
+                await asyncio.to_thread(self.store.request_cancel, job_id)
+            return job
+        if job.status in FINISHED:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()  # _run records the cancellation
+        else:
+            await self._finish(job, "cancelled")
+        return job
+
+    def _persist_finished(self, job: Job) -> None:
+        self.store.save_job(job)
+        if job.status != "succeeded":
+            self.store.delete_upload(job.job_id)
+
+    async def _finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        await asyncio.to_thread(self._persist_finished, job)
+        event = self._done.pop(job.job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _work(self) -> None:
+        queue = self._queue
+        assert queue is not None
+        while True:
+            _, _, job_id = await queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued":  # cancelled while queued
+                continue
+            if await asyncio.to_thread(self.store.cancel_requested, job_id):
+                await self._finish(job, "cancelled")
+                continue
+            task = asyncio.ensure_future(self._run(job))
+            self._running[job_id] = task
+            try:
+                while not task.done():
+                    await asyncio.wait([task], timeout=1.0)
+                    # cancellations sent through the store by other processes
+                    if not task.done() and await asyncio.to_thread(
+                        self.store.cancel_requested, job_id
+                    ):
+                        task.cancel()
+            finally:
+                self._running.pop(job_id, None)
+            if job.status not in FINISHED:  # cancelled before _run started
+                await self._finish(job, "cancelled")
+
+    async def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        await asyncio.to_thread(self.store.save_job, job)
+        _, token = metrics.begin_request("jobs")
+        try:
+            data = await asyncio.to_thread(self.store.load_upload, job.job_id)
+            if data is None:
+                raise RuntimeError("job input is missing from the job store")
+            result = await self.handler(data, job.payload)
+            await asyncio.to_thread(self.store.save_result, job.job_id, result)
+        except asyncio.CancelledError:
+            await self._finish(job, "cancelled")
+        except Exception as exc:
+            await self._finish(job, "failed", str(exc) or type(exc).__name__)
+        else:
+            await self._finish(job, "succeeded")
+        finally:
+            metrics.end_request(token)
+
+    def _delete_all(self, job_ids: List[str]) -> None:
+        for job_id in job_ids:
+            self.store.delete(job_id)
+
+    async def recover(self) -> None:
+        """
+        Load persisted jobs, drop expired ones and requeue unfinished ones,
+        except those a live process sharing the store still owns.
+        """
+        now = time.time()
+        pid = os.getpid()
+        expired = []
+        for job in await asyncio.to_thread(self.store.load_jobs):
+            if job.status in FINISHED and now - (job.finished_at or now) > self.retention_s:
+                expired.append(job.job_id)
+                continue
+            if job.status not in FINISHED:
+                if job.owner not in (None, pid) and _alive(job.owner):
+                    continue  # served from the store on request
+                job.status = "queued"  # interrupted while running
+                job.started_at = None
+                job.owner = pid
+                await asyncio.to_thread(self.store.save_job, job)
+                self._enqueue(job)
+            self._jobs[job.job_id] = job
+        await asyncio.to_thread(self._delete_all, expired)
+
+    async def prune(self) -> int:
+        """Forget finished jobs older than ``retention_s``; returns how many."""
+        cutoff = time.time() - self.retention_s
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in FINISHED and (job.finished_at or 0) < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired:
+            await asyncio.to_thread(self._delete_all, expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "retention_s": self.retention_s,
+            "store": str(self.store.directory),
+            "jobs": counts,
+        }
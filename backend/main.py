@@ -1,7 +1,21 @@
-from fastapi import FastAPI
+import os
+import threading
+import time
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+
+import metrics
 
-from routers import predict, xai  # type: ignore[attr-defined]
+from artifacts import get_artifact_store
+from cache import get_result_cache
+from chat_sessions import get_session_store
+from executors import WorkerSaturated, shutdown_workloads, workload_stats
+from models.loader import model_registry_stats, preload_models, readiness, skip_preload
+from routers import chat, jobs, predict, xai  # type: ignore[attr-defined]
+from uploads import UploadSizeLimit
 
 
 app = FastAPI(
@@ -14,6 +28,13 @@ app = FastAPI(
 )
 
 
+# Single-image uploads are capped while they stream in; the batch endpoint
+# spools to disk and limits each archive member instead. Added first so it is
+# the innermost middleware: its early 413 still passes through CORS and the
+# request instrumentation.
+app.add_middleware(UploadSizeLimit, exempt_paths=("/api/predict/batch",))
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # TODO: restrict to your frontend origin in production
@@ -23,13 +44,125 @@ app.add_middleware(
 )
 
 
+def _endpoint_label(request: Request) -> str:
+    # route templates, not raw paths, keep the metric label set bounded
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    endpoint = _endpoint_label(request)
+    timings, token = metrics.begin_request(endpoint)
+    metrics.REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+        metrics.REQUEST_SECONDS.labels(endpoint, request.method, str(status)).observe(elapsed)
+        metrics.end_request(token)
+    if metrics.SERVER_TIMING:
+        response.headers["Server-Timing"] = timings.server_timing(elapsed)
+    return response
+
+
+@app.exception_handler(WorkerSaturated)
+async def worker_saturated_handler(request: Request, exc: WorkerSaturated) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+
+# Load and warm up the models at startup instead of on the first request.
+# The server accepts connections meanwhile; /ready reports when it is hot.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") == "1"
+
+
+@app.on_event("startup")
+def _preload_models() -> None:
+    if PRELOAD_MODELS:
+        threading.Thread(target=preload_models, name="model-preload", daemon=True).start()
+    else:
+        skip_preload()
+
+
+# Resume jobs that were queued or running when the server last stopped.
+# serve.py turns this off in all workers but one.
+JOB_RECOVER = os.getenv("JOB_RECOVER", "1") == "1"
+
+
+@app.on_event("startup")
+async def _recover_jobs() -> None:
+    if JOB_RECOVER:
+        await jobs.get_job_queue().recover()
+
+
+@app.on_event("shutdown")
+def _shutdown_workloads() -> None:
+    shutdown_workloads()
+
+
 @app.get("/health")
 async def health_check() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def ready_check() -> JSONResponse:
+    status = readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/health/workers")
+async def worker_health() -> dict:
+    return workload_stats()
+
+
+@app.get("/health/models")
+async def model_health() -> dict:
+    return model_registry_stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics() -> Response:
+    metrics.update_gauges(workload_stats(), model_registry_stats())
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/health/cache")
+async def cache_health() -> dict:
+    return get_result_cache().stats()
+
+
+@app.get("/health/artifacts")
+async def artifact_health() -> dict:
+    return get_artifact_store().stats()
+
+
+@app.get("/health/chat")
+async def chat_health() -> dict:
+    return get_session_store().stats()
+
+
+@app.get("/health/jobs")
+async def job_health() -> dict:
+    return jobs.get_job_queue().stats()
+
+
 app.include_router(predict.router, prefix="/api")
 app.include_router(xai.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+app.include_router(chat.router, prefix="/api")
 
 
 if __name__ == "__main__":
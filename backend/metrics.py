@@ -0,0 +1,109 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+
+
+# Adds a Server-Timing header (per-stage milliseconds) to every response.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+REQUEST_SECONDS = Histogram(
+    "ccxai_request_duration_seconds",
+    "HTTP request latency (until the response headers are sent).",
+    ["endpoint", "method", "status"],
+    buckets=_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "ccxai_stage_duration_seconds",
+    "Time spent in one stage of the predict/explain paths.",
+    ["endpoint", "stage", "model", "explanation"],
+    buckets=_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "ccxai_requests_in_flight", "HTTP requests currently being handled.", ["endpoint"]
+)
+WORKLOAD_IN_FLIGHT = Gauge(
+    "ccxai_workload_in_flight", "Jobs running or queued per workload pool.", ["workload"]
+)
+MODEL_RESIDENT_BYTES = Gauge(
+    "ccxai_model_resident_bytes", "Parameter and buffer bytes of resident models.", ["model"]
+)
+MODEL_MEMORY_BUDGET_BYTES = Gauge(
+    "ccxai_model_memory_budget_bytes", "MODEL_MEMORY_BUDGET_MB in bytes (0 = unlimited)."
+)
+
+
+class RequestTimings:
+    """Per-request stage totals; shared by every thread working on the request."""
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total_seconds: float) -> str:
+        with self._lock:
+            parts = [f"{name};dur={1000.0 * s:.1f}" for name, s in self.stages.items()]
+        parts.append(f"total;dur={1000.0 * total_seconds:.1f}")
+        return ", ".join(parts)
+
+
+_current: "contextvars.ContextVar[Optional[RequestTimings]]" = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def begin_request(endpoint: str) -> Tuple[RequestTimings, contextvars.Token]:
+    timings = RequestTimings(endpoint)
+    return timings, _current.set(timings)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def stage(name: str, model: str = "-", explanation: str = "-") -> Iterator[None]:
+    """
+    Time a block as stage ``name`` of the current request.
+
+    Observed in the stage histogram (work outside a request, e.g. a batch
+    shared by several requests, is labelled ``endpoint="background"``) and
+    added to the request's Server-Timing totals.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        timings = _current.get()
+        endpoint = timings.endpoint if timings is not None else "background"
+        STAGE_SECONDS.labels(endpoint, name, model, explanation).observe(seconds)
+        if timings is not None:
+            timings.add(name, seconds)
+
+
+def update_gauges(workloads: Dict[str, dict], models: Dict[str, object]) -> None:
+    """Refresh the point-in-time gauges from ``workload_stats``/``model_registry_stats``."""
+    for name, stats in workloads.items():
+        WORKLOAD_IN_FLIGHT.labels(name).set(stats["in_flight"])
+    MODEL_RESIDENT_BYTES.clear()  # evicted models disappear from the series
+    for name, info in models["resident"].items():
+        MODEL_RESIDENT_BYTES.labels(name).set(info["bytes"])
+    MODEL_MEMORY_BUDGET_BYTES.set(models["budget_bytes"])
+
+
+def render_latest() -> Tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
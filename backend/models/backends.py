@@ -0,0 +1,133 @@
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+
+try:  # optional: only needed for INFERENCE_BACKEND=onnx
+    import onnxruntime
+except ImportError:  # pragma: no cover - depends on the deployment
+    onnxruntime = None
+
+
+BACKENDS = ("eager", "torchscript", "onnx")
+
+# A runner maps a preprocessed NxCxHxW batch to NxK logits.
+Runner = Callable[[torch.Tensor], torch.Tensor]
+
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+ONNX_OPSET = 17
+
+
+def validate_backend(backend: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+    return backend
+
+
+def _is_stale(artifact: Path, source: Optional[Path]) -> bool:
+    if not artifact.exists():
+        return True
+    return source is not None and source.exists() and source.stat().st_mtime > artifact.stat().st_mtime
+
+
+def export_torchscript(model: torch.nn.Module, size: int, path: Path) -> Path:
+    example = torch.randn(2, 3, size, size, device=next(model.parameters(), torch.empty(0)).device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+    frozen = torch.jit.freeze(traced)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.jit.save(frozen, str(path))
+    return path
+
+
+def export_onnx(model: torch.nn.Module, size: int, path: Path) -> Path:
+    example = torch.randn(2, 3, size, size)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval().cpu(),
+            example,
+            str(path),
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+    return path
+
+
+class TorchScriptRunner:
+    def __init__(self, path: Path, device: torch.device) -> None:
+        self.module = torch.jit.load(str(path), map_location=device)
+        self.module.eval()
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        return self.module(tensor)
+
+
+class OnnxRunner:
+    def __init__(self, path: Path) -> None:
+        if onnxruntime is None:
+            raise RuntimeError("INFERENCE_BACKEND=onnx requires the onnxruntime package.")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        if ONNX_INTRA_OP_THREADS:
+            options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = ONNX_INTER_OP_THREADS
+        providers = [
+            p
+            for p in ("CUDAExecutionProvider", "CPUExecutionProvider")
+            if p in onnxruntime.get_available_providers()
+        ]
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        inputs = {self.input_name: tensor.detach().cpu().numpy().astype(np.float32, copy=False)}
+        logits = self.session.run(None, inputs)[0]
+        return torch.from_numpy(logits).to(tensor.device)
+
+
+def build_runner(
+    backend: str,
+    model: torch.nn.Module,
+    size: int,
+    artifact: Path,
+    checkpoint: Optional[Path],
+    device: torch.device,
+) -> Runner:
+    """
+    Runner for ``model`` on ``backend``.
+
+    The TorchScript/ONNX artifact is exported on first use (or when the
+    checkpoint is newer than it) and reused afterwards; both keep the batch
+    axis dynamic. The exported runner is checked against the eager model and
+    a warning is printed if they disagree.
+    """
+    validate_backend(backend)
+    if backend == "eager":
+        return model
+
+    if _is_stale(artifact, checkpoint):
+        print(f"Exporting {artifact.name} ({backend})")
+        if backend == "torchscript":
+            export_torchscript(model, size, artifact)
+        else:
+            export_onnx(model, size, artifact)
+
+    runner: Runner
+    if backend == "torchscript":
+        runner = TorchScriptRunner(artifact, device)
+    else:
+        runner = OnnxRunner(artifact)
+
+    check = torch.randn(1, 3, size, size, device=device)
+    with torch.no_grad():
+        diff = (runner(check).float() - model(check).float()).abs().max().item()
+    if diff > 1e-3:
+        print(f"Warning: {artifact.name} differs from the eager model by {diff:.2e}")
+    return runner
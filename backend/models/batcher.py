@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from executors import WorkerSaturated, run_in_workload
+from metrics import stage
+from .loader import EnsembleOutput, predict_ensemble_batch
+
+
+MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("PREDICT_MAX_WAIT_MS", "5"))
+MAX_QUEUE = int(os.getenv("PREDICT_MAX_QUEUE", "256"))
+
+_STATS_WINDOW = 1024
+
+
+class PredictionBatcher:
+    """
+    Collects concurrent ensemble prediction requests into batches.
+
+    A single worker task waits for the first queued request, then keeps
+    collecting until ``max_batch_size`` requests are queued or ``max_wait_ms``
+    has passed, and runs one batched forward per model for the whole group.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+        max_queue: int = MAX_QUEUE,
+    ) -> None:
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self._batches = 0
+        self._requests = 0
+        self._errors = 0
+        self._batch_size_counts: Dict[int, int] = {}
+        self._queue_waits_ms: Deque[float] = deque(maxlen=_STATS_WINDOW)
+        self._batch_latencies_ms: Deque[float] = deque(maxlen=_STATS_WINDOW)
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            # A fresh context: the worker serves every request, so it must not
+            # inherit (and time into) the request that happened to start it.
+            self._worker = contextvars.Context().run(
+                asyncio.get_running_loop().create_task, self._run()
+            )
+        assert self._queue is not None
+        return self._queue
+
+    async def submit(self, image: Image.Image) -> EnsembleOutput:
+        queue = self._ensure_worker()
+        if queue.qsize() >= self.max_queue:
+            raise WorkerSaturated("predict")
+        future = asyncio.get_running_loop().create_future()
+        with stage("batched_predict", model="ensemble"):
+            await queue.put((image, future, time.perf_counter()))
+            return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> List[Tuple]:
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        queue = self._queue
+        assert queue is not None
+        while True:
+            batch = await self._collect(queue)
+            # Callers that went away while queued do not need a forward pass.
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self._queue_waits_ms.append((started - enqueued) * 1000.0)
+
+            images = [image for image, _, _ in batch]
+            try:
+                outputs = await run_in_workload("predict", predict_ensemble_batch, images)
+            except Exception as exc:
+                self._errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_size_counts[len(batch)] = (
+                self._batch_size_counts.get(len(batch), 0) + 1
+            )
+            self._batch_latencies_ms.append((time.perf_counter() - started) * 1000.0)
+            for (_, future, _), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+    def stats(self) -> dict:
+        def _summary(values: Deque[float]) -> Dict[str, float]:
+            if not values:
+                return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            arr = np.fromiter(values, dtype=np.float64)
+            return {
+                "mean": float(arr.mean()),
+                "p50": float(np.percentile(arr, 50)),
+                "p95": float(np.percentile(arr, 95)),
+                "max": float(arr.max()),
+            }
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_queue": self.max_queue,
+            "batches": self._batches,
+            "requests": self._requests,
+            "errors": self._errors,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+            "batch_size_counts": dict(sorted(self._batch_size_counts.items())),
+            "queue_wait_ms": _summary(self._queue_waits_ms),
+            "batch_latency_ms": _summary(self._batch_latencies_ms),
+        }
+
+
+_batcher: Optional[PredictionBatcher] = None
+
+
+def get_batcher() -> PredictionBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = PredictionBatcher()
+    return _batcher
@@ -0,0 +1,130 @@
+"""
+Pick cascade thresholds for ``ENSEMBLE_MODE=cascade``.
+
+Run from ``backend/`` on held-out patches that look like production traffic:
+
+    python -m models.calibrate_cascade --samples path/to/patches --limit 1024 \
+        --target-agreement 0.99 --out cascade.json
+
+Every model runs once on every sample (as served: ``MODEL_PRECISION`` and
+``INFERENCE_BACKEND`` apply) and is timed. The cascade is then replayed
+offline for a grid of ``CASCADE_MIN_CONFIDENCE`` / ``CASCADE_MIN_MARGIN``
+pairs. The cheapest pair whose top-1 agreement with the full ensemble meets
+the target is recommended.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import torch
+
+from . import cascade, loader
+from .precision import sample_images
+
+
+CONFIDENCE_GRID = [round(c, 3) for c in np.arange(0.5, 0.96, 0.05)] + [0.97, 0.98, 0.99, 0.995]
+MARGIN_GRID = [round(m, 3) for m in np.arange(0.0, 0.91, 0.1)]
+
+
+def _per_model_probs(
+    batches: List[Dict[int, torch.Tensor]], names: List[str]
+) -> Dict[str, object]:
+    runners = loader.get_runners(names)
+    probs = {name: [] for name in names}
+    seconds = {name: 0.0 for name in names}
+    with torch.no_grad(), loader.inference_context(loader.MODEL_PRECISION, loader._device):
+        for name in names:
+            inputs = [tensors[loader.TRANSFORM_SIZES[name]] for tensors in batches]
+            runners[name](inputs[0])  # warm-up
+            for batch in inputs:
+                started = time.perf_counter()
+                out = loader._softmax_logits(runners[name](batch)).cpu().numpy()
+                seconds[name] += time.perf_counter() - started
+                probs[name].append(out)
+    return {
+        "stacked": np.stack([np.concatenate(probs[name]) for name in names]),
+        "seconds": seconds,
+    }
+
+
+def build_report(
+    samples: Path, limit: int, batch_size: int, target_agreement: float
+) -> Dict[str, object]:
+    images = sample_images(samples, limit)
+    names = cascade.cascade_order(
+        list(loader.get_runners().keys()), loader.CASCADE_ORDER
+    )
+    if not names:
+        raise RuntimeError("No models loaded. Check MODEL_PATHS.")
+    sizes = {loader.TRANSFORM_SIZES[name] for name in names}
+    batches = [
+        loader.preprocess_batch(images[i : i + batch_size], sizes)
+        for i in range(0, len(images), batch_size)
+    ]
+
+    measured = _per_model_probs(batches, names)
+    costs = [measured["seconds"][name] / len(images) for name in names]
+    rows = cascade.thresholds_report(
+        measured["stacked"],
+        names,
+        loader.ENSEMBLE_WEIGHTS,
+        costs,
+        CONFIDENCE_GRID,
+        MARGIN_GRID,
+    )
+    passing = [row for row in rows if row["agreement"] >= target_agreement]
+    best = min(passing, key=lambda r: (r["mean_cost_ms"], -r["agreement"]), default=None)
+    full_cost_ms = 1000.0 * sum(costs)
+
+    report: Dict[str, object] = {
+        "samples": len(images),
+        "sample_source": str(samples) if samples else "random",
+        "precision": loader.MODEL_PRECISION,
+        "backend": loader.INFERENCE_BACKEND,
+        "threads": torch.get_num_threads(),
+        "cascade_order": names,
+        "ms_per_image": {name: 1000.0 * cost for name, cost in zip(names, costs)},
+        "full_ensemble_ms": full_cost_ms,
+        "target_agreement": target_agreement,
+        "recommended": None,
+        "grid": rows,
+    }
+    if best is not None:
+        report["recommended"] = {
+            **best,
+            "speedup_vs_full": full_cost_ms / best["mean_cost_ms"],
+            "env": {
+                "ENSEMBLE_MODE": "cascade",
+                "CASCADE_ORDER": ",".join(names),
+                "CASCADE_MIN_CONFIDENCE": str(best["min_confidence"]),
+                "CASCADE_MIN_MARGIN": str(best["min_margin"]),
+            },
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calibrate cascade ensemble thresholds.")
+    parser.add_argument("--samples", type=Path, default=None, help="directory of sample patches")
+    parser.add_argument("--limit", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--target-agreement", type=float, default=0.99)
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args()
+
+    report = build_report(args.samples, args.limit, args.batch_size, args.target_agreement)
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2))
+    print(json.dumps({k: v for k, v in report.items() if k != "grid"}, indent=2))
+    if report["recommended"] is None:
+        print(
+            f"No threshold pair reaches {args.target_agreement:.3f} agreement; "
+            "keep ENSEMBLE_MODE=full."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Confidence-gated cascade over the ensemble members (``ENSEMBLE_MODE=cascade``).
+
+Models run cheapest first. After each one the weighted average of the models
+run so far is checked, and an image stops collecting models once that
+running ensemble is confident enough: its top probability is at least
+``min_confidence`` and it leads the runner-up by at least ``min_margin``.
+Easy patches (EMPTY, ADIPOSE, ...) then cost one small forward pass. Hard
+ones still get the full ensemble. ``python -m models.calibrate_cascade``
+picks the thresholds.
+"""
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Roughly ascending CPU latency at 224x224; models not listed run last.
+DEFAULT_ORDER = ["MobileNetV2", "ResNet50", "DenseNet121", "EfficientNetB3"]
+
+
+def cascade_order(names: Sequence[str], order: Sequence[str]) -> List[str]:
+    rank = {name: i for i, name in enumerate(order)}
+    return sorted(names, key=lambda name: rank.get(name, len(rank)))
+
+
+def representative(used: Sequence[str], preferred: str, order: Sequence[str]) -> str:
+    """
+    Model single-model explainers should run on: ``preferred`` if it was
+    part of the prediction, else the first model of the cascade that ran.
+    """
+    if preferred in used:
+        return preferred
+    if not used:
+        raise ValueError("No model contributed to the prediction.")
+    return cascade_order(used, order)[0]
+
+
+def settled(probs: np.ndarray, min_confidence: float, min_margin: float) -> np.ndarray:
+    """Which rows of (batch, classes) ensemble probabilities may stop."""
+    top2 = np.sort(probs, axis=1)[:, -2:]
+    return (top2[:, 1] >= min_confidence) & (top2[:, 1] - top2[:, 0] >= min_margin)
+
+
+class RunningEnsemble:
+    """Weighted average of the models each row has seen so far."""
+
+    def __init__(self, batch: int, num_classes: int) -> None:
+        self._sums = np.zeros((batch, num_classes), dtype=np.float64)
+        self._weights = np.zeros(batch, dtype=np.float64)
+
+    def add(self, rows: np.ndarray, weight: float, probs: np.ndarray) -> None:
+        self._sums[rows] += weight * probs
+        self._weights[rows] += weight
+
+    def probs(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is None:
+            return self._sums / self._weights[:, None]
+        return self._sums[rows] / self._weights[rows, None]
+
+
+def simulate(
+    stacked: np.ndarray,
+    names: Sequence[str],
+    weights: Mapping[str, float],
+    min_confidence: float,
+    min_margin: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cascade outcome from precomputed per-model probabilities.
+
+    ``stacked`` is (models, batch, classes) with models in cascade order
+    (``names``). Returns the ensemble probabilities each row ends with and
+    how many models it used.
+    """
+    _, batch, num_classes = stacked.shape
+    running = RunningEnsemble(batch, num_classes)
+    used = np.zeros(batch, dtype=np.int64)
+    active = np.arange(batch)
+    for m, name in enumerate(names):
+        running.add(active, weights.get(name, 1.0), stacked[m, active])
+        used[active] += 1
+        active = active[~settled(running.probs(active), min_confidence, min_margin)]
+        if not len(active):
+            break
+    return running.probs(), used
+
+
+def thresholds_report(
+    stacked: np.ndarray,
+    names: Sequence[str],
+    weights: Mapping[str, float],
+    costs: Sequence[float],
+    confidences: Sequence[float],
+    margins: Sequence[float],
+) -> List[Dict[str, float]]:
+    """
+    Agreement with the full ensemble and mean cost for each threshold pair.
+
+    ``costs`` are per-image seconds of each model in ``names``.
+    """
+    full_weights = np.array([weights.get(name, 1.0) for name in names])
+    full = np.tensordot(full_weights, stacked, axes=1).argmax(axis=1)
+    cumulative = np.concatenate([[0.0], np.cumsum(costs)])
+    rows = []
+    for min_confidence in confidences:
+        for min_margin in margins:
+            probs, used = simulate(stacked, names, weights, min_confidence, min_margin)
+            rows.append(
+                {
+                    "min_confidence": float(min_confidence),
+                    "min_margin": float(min_margin),
+                    "agreement": float(np.mean(probs.argmax(axis=1) == full)),
+                    "mean_models": float(used.mean()),
+                    "mean_cost_ms": float(1000.0 * cumulative[used].mean()),
+                }
+            )
+    return rows
@@ -1,24 +1,30 @@
 from typing import Dict, Tuple, Optional
 
+import torch
 from PIL import Image
 
 from .loader import CLASS_NAMES, predict_single_model, predict_ensemble
 
 
 def run_prediction(
-    image: Image.Image, model_name: Optional[str] = None
+    image: Image.Image,
+    model_name: Optional[str] = None,
+    tensors: Optional[Dict[int, torch.Tensor]] = None,
 ) -> Tuple[str, float, Dict[str, float], Dict[str, Dict[str, float]]]:
     """
     Wrapper used by API and XAI modules.
 
+    ``tensors`` may carry the output of ``preprocess_image`` so callers that
+    already preprocessed the upload do not pay for it again.
+
     Returns:
         predicted_class, confidence, ensemble_probs, per_model_probs
     """
     if model_name is not None and model_name.lower() != "ensemble":
-        pred_class, conf, probs = predict_single_model(model_name, image)
+        pred_class, conf, probs = predict_single_model(model_name, image, tensors=tensors)
         return pred_class, conf, probs, {model_name: probs}
 
-    pred_class, conf, probs, per_model = predict_ensemble(image)
+    pred_class, conf, probs, per_model = predict_ensemble(image, tensors=tensors)
     return pred_class, conf, probs, per_model
 
 
@@ -0,0 +1,38 @@
+"""
+Export every model for the TorchScript or ONNX inference backend.
+
+Run from ``backend/`` before deploying with ``INFERENCE_BACKEND`` set:
+
+    python -m models.export --backend onnx
+
+Artifacts land in ``MODEL_EXPORT_DIR`` under the same names the server
+looks for, so the first request does not pay for the export.
+"""
+import argparse
+
+from . import loader
+from .backends import build_runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export models for an inference backend.")
+    parser.add_argument("--backend", choices=["torchscript", "onnx"], required=True)
+    args = parser.parse_args()
+
+    suffix = "onnx" if args.backend == "onnx" else "pt"
+    for name, model in loader.load_models().items():
+        artifact = loader.EXPORT_DIR / f"{name}-{loader.MODEL_PRECISION}.{suffix}"
+        artifact.unlink(missing_ok=True)
+        build_runner(
+            args.backend,
+            model,
+            loader.TRANSFORM_SIZES[name],
+            artifact,
+            loader.MODEL_PATHS.get(name),
+            loader._device,
+        )
+        print(f"{name}: {artifact}")
+
+
+if __name__ == "__main__":
+    main()
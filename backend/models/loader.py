@@ -1,10 +1,27 @@
+import hashlib
+import json
+import os
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
 import torch
 from PIL import Image
 from torchvision import transforms
 
+from metrics import stage
+
+from . import cascade
+from .backends import Runner, build_runner, validate_backend
+from .precision import (
+    inference_context,
+    quantize_model,
+    sample_images,
+    validate_precision,
+)
+from .registry import ModelRegistry, module_bytes
 from .classifiers import (
     ResNet50Classifier,
     MobileNetClassifier,
@@ -44,21 +61,115 @@ TRANSFORM_SIZES = {
 }
 
 
+# Relative weight of each model in the ensemble average (normalized over the
+# models that are actually loaded). Also used to fuse ensemble explanations.
+ENSEMBLE_WEIGHTS = {
+    "ResNet50": 1.0,
+    "MobileNetV2": 1.0,
+    "EfficientNetB3": 1.0,
+    "DenseNet121": 1.0,
+}
+
+
+# full | cascade. Cascade mode runs the models in CASCADE_ORDER and stops once
+# the running ensemble reaches both thresholds, see models/cascade.py.
+ENSEMBLE_MODES = ("full", "cascade")
+ENSEMBLE_MODE = os.getenv("ENSEMBLE_MODE", "full")
+if ENSEMBLE_MODE not in ENSEMBLE_MODES:
+    raise ValueError(f"Unknown ENSEMBLE_MODE: {ENSEMBLE_MODE}")
+CASCADE_ORDER = [
+    m.strip()
+    for m in os.getenv("CASCADE_ORDER", ",".join(cascade.DEFAULT_ORDER)).split(",")
+    if m.strip()
+]
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.9"))
+CASCADE_MIN_MARGIN = float(os.getenv("CASCADE_MIN_MARGIN", "0.5"))
+
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+# fp32 | bf16 | int8-dynamic | int8-static, see models/precision.py
+MODEL_PRECISION = validate_precision(os.getenv("MODEL_PRECISION", "fp32"))
+QUANT_CALIBRATION_DIR = os.getenv("QUANT_CALIBRATION_DIR")
+QUANT_CALIBRATION_SAMPLES = int(os.getenv("QUANT_CALIBRATION_SAMPLES", "64"))
+# int8-static scales calibrated on noise are useless for serving; only the
+# parity and benchmark tools set this to exercise the mode without data.
+ALLOW_RANDOM_CALIBRATION = False
+
+
+# eager | torchscript | onnx, see models/backends.py
+INFERENCE_BACKEND = validate_backend(os.getenv("INFERENCE_BACKEND", "eager"))
+EXPORT_DIR = Path(os.getenv("MODEL_EXPORT_DIR", str(BASE_DIR / "exports")))
+
+
+# Checkpoints are read and built in parallel; warmup runs one forward pass per
+# model at each of these batch sizes so kernels/allocations are hot.
+MODEL_LOAD_WORKERS = int(os.getenv("MODEL_LOAD_WORKERS", str(len(MODEL_PATHS))))
+WARMUP_BATCH_SIZES = [
+    int(b) for b in os.getenv("WARMUP_BATCH_SIZES", "1,8").split(",") if b.strip()
+]
+
+
+# Resident fp32 weights are kept under MODEL_MEMORY_BUDGET_MB (0 = unlimited)
+# by evicting the least recently used model; PINNED_MODELS are never evicted.
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+PINNED_MODELS = [m.strip() for m in os.getenv("PINNED_MODELS", "").split(",") if m.strip()]
+
+
 _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-_models: Dict[str, torch.nn.Module] = {}
+_quantized_models: Dict[Tuple[str, str], torch.nn.Module] = {}  # (precision, name)
+_calibration: Dict[int, List[torch.Tensor]] = {}
+_runners: Dict[str, Runner] = {}
+_derived_lock = threading.Lock()
+_transforms: Dict[int, transforms.Compose] = {}
+# Per-model load state for /ready: pending -> loading -> loaded -> warming ->
+# ready, evicted, or missing/failed.
+_model_status: Dict[str, Dict[str, object]] = {
+    name: {"state": "pending"} for name in MODEL_PATHS
+}
+_readiness: Dict[str, object] = {"ready": False, "state": "pending"}
 
 
 def get_transform(size: int = 224) -> transforms.Compose:
-    return transforms.Compose(
-        [
-            transforms.Resize((size, size)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ]
-    )
+    transform = _transforms.get(size)
+    if transform is None:
+        transform = transforms.Compose(
+            [
+                transforms.Resize((size, size)),
+                transforms.ToTensor(),
+                transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+            ]
+        )
+        _transforms[size] = transform
+    return transform
+
+
+def preprocess_image(
+    image: Image.Image, sizes: Optional[Iterable[int]] = None
+) -> Dict[int, torch.Tensor]:
+    """
+    Resize/normalize the image once per distinct input size.
+
+    Returns a mapping of size -> 1xCxHxW tensor on the inference device, so
+    models that share an input size also share the preprocessed tensor.
+    """
+    return preprocess_batch([image], sizes)
+
+
+def preprocess_batch(
+    images: Sequence[Image.Image], sizes: Optional[Iterable[int]] = None
+) -> Dict[int, torch.Tensor]:
+    """Like ``preprocess_image`` but stacks several images into NxCxHxW tensors."""
+    if sizes is None:
+        sizes = TRANSFORM_SIZES.values()
+    batches: Dict[int, torch.Tensor] = {}
+    with stage("preprocess"):
+        for size in sorted(set(sizes)):
+            transform = get_transform(size)
+            batches[size] = torch.stack([transform(img) for img in images]).to(_device)
+    return batches
 
 
 def _build_model(name: str) -> torch.nn.Module:
@@ -73,77 +184,476 @@ def _build_model(name: str) -> torch.nn.Module:
     raise ValueError(f"Unknown model name: {name}")
 
 
-def load_models() -> Dict[str, torch.nn.Module]:
-    global _models
-    if _models:
-        return _models
-
-    for name, path in MODEL_PATHS.items():
-        if not path.exists():
-            print(f"Warning: checkpoint not found for {name}: {path}")
-            continue
+def _calibration_batches(size: int, batch_size: int = 16) -> List[torch.Tensor]:
+    if size not in _calibration:
+        directory = Path(QUANT_CALIBRATION_DIR) if QUANT_CALIBRATION_DIR else None
+        try:
+            images = sample_images(
+                directory, QUANT_CALIBRATION_SAMPLES, allow_random=ALLOW_RANDOM_CALIBRATION
+            )
+        except ValueError as exc:
+            raise RuntimeError(
+                f"int8-static needs calibration images in QUANT_CALIBRATION_DIR: {exc}"
+            ) from exc
+        _calibration[size] = [
+            preprocess_batch(images[i : i + batch_size], [size])[size].cpu()
+            for i in range(0, len(images), batch_size)
+        ]
+    return _calibration[size]
+
+
+def _read_state_dict(path: Path) -> Dict[str, torch.Tensor]:
+    try:
+        # memory-mapped read: tensors are paged in as load_state_dict copies them
+        state = torch.load(path, map_location="cpu", mmap=True)
+    except (RuntimeError, TypeError):
+        # legacy (non-zip) checkpoints and older torch versions cannot mmap
+        state = torch.load(path, map_location="cpu")
+    if isinstance(state, dict) and "model_state_dict" in state:
+        state = state["model_state_dict"]
+    return state
+
+
+def _load_one(name: str) -> Optional[torch.nn.Module]:
+    path = MODEL_PATHS[name]
+    status = _model_status[name]
+    if not path.exists():
+        print(f"Warning: checkpoint not found for {name}: {path}")
+        status.update(state="missing", error=f"checkpoint not found: {path}")
+        return None
+    status.update(state="loading")
+    started = time.perf_counter()
+    try:
         model = _build_model(name)
-        state = torch.load(path, map_location=_device)
-        if isinstance(state, dict) and "model_state_dict" in state:
-            state = state["model_state_dict"]
-        model.load_state_dict(state, strict=False)
+        model.load_state_dict(_read_state_dict(path), strict=False)
         model.to(_device).eval()
-        _models[name] = model
-    if not _models:
+    except Exception as exc:
+        print(f"Warning: failed to load {name}: {exc}")
+        status.update(state="failed", error=str(exc))
+        return None
+    status.update(state="loaded", load_seconds=round(time.perf_counter() - started, 3))
+    status.pop("warmup_seconds", None)
+    return model
+
+
+def _drop_derived(name: str) -> None:
+    """Forget quantized copies and runners built from an evicted model."""
+    with _derived_lock:
+        _runners.pop(name, None)
+        for key in [key for key in _quantized_models if key[1] == name]:
+            del _quantized_models[key]
+    _model_status[name]["state"] = "evicted"
+
+
+_registry = ModelRegistry(
+    list(MODEL_PATHS),
+    _load_one,
+    budget_bytes=int(MODEL_MEMORY_BUDGET_MB * 2**20),
+    pinned=PINNED_MODELS,
+    max_workers=MODEL_LOAD_WORKERS,
+)
+_registry.add_evict_listener(_drop_derived)
+
+
+def on_model_evicted(listener: Callable[[str], None]) -> None:
+    """Register ``listener(name)`` to drop per-model state when a model is evicted."""
+    _registry.add_evict_listener(listener)
+
+
+def available_models() -> List[str]:
+    """Models that can be served (not known to be missing), in ensemble order."""
+    return _registry.available()
+
+
+def model_registry_stats() -> Dict[str, object]:
+    return _registry.stats()
+
+
+def _checkpoint_identity(path: Path) -> Optional[Tuple[str, int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return str(path), st.st_mtime_ns, st.st_size
+
+
+def model_fingerprint() -> str:
+    """
+    Digest of everything besides the image that changes model outputs:
+    checkpoints (path, mtime, size), precision and calibration, backend,
+    input sizes, ensemble weights and the cascade settings. Part of every
+    result-cache key, so cached results (also on disk, across restarts) are
+    not served after any of them changes.
+    """
+    config = {
+        "checkpoints": {name: _checkpoint_identity(path) for name, path in MODEL_PATHS.items()},
+        "precision": MODEL_PRECISION,
+        "calibration": [QUANT_CALIBRATION_DIR, QUANT_CALIBRATION_SAMPLES]
+        if MODEL_PRECISION == "int8-static"
+        else None,
+        "backend": INFERENCE_BACKEND,
+        "sizes": TRANSFORM_SIZES,
+        "weights": ENSEMBLE_WEIGHTS,
+        "mode": ENSEMBLE_MODE,
+        "cascade": [CASCADE_ORDER, CASCADE_MIN_CONFIDENCE, CASCADE_MIN_MARGIN]
+        if ENSEMBLE_MODE == "cascade"
+        else None,
+    }
+    payload = json.dumps(config, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def get_model(name: str, precision: Optional[str] = None) -> torch.nn.Module:
+    """
+    The model ``name`` for the given precision (default: ``MODEL_PRECISION``),
+    loading it on first use. Raises ``ValueError`` if it cannot be loaded.
+    """
+    models = load_models(precision, [name])
+    if name not in models:
+        raise ValueError(f"Model '{name}' is not loaded.")
+    return models[name]
+
+
+def load_models(
+    precision: Optional[str] = None, names: Optional[Sequence[str]] = None
+) -> Dict[str, torch.nn.Module]:
+    """
+    Models for the given precision (default: ``MODEL_PRECISION``).
+
+    ``names`` restricts the result to those models (default: every available
+    model, as the ensemble needs). fp32 and bf16 share the eager modules
+    (bf16 only changes the forward context); int8 modes are quantized copies
+    built on first use.
+    """
+    precision = validate_precision(precision or MODEL_PRECISION)
+    models = _registry.get_many(list(names) if names is not None else list(MODEL_PATHS))
+    if not models and names is None:
         raise RuntimeError("No models loaded. Check MODEL_PATHS.")
-    return _models
+    if precision in ("fp32", "bf16"):
+        return models
+
+    if _device.type != "cpu":
+        raise RuntimeError(f"Precision '{precision}' is only supported on CPU.")
+    quantized: Dict[str, torch.nn.Module] = {}
+    for name, model in models.items():
+        with _derived_lock:
+            qmodel = _quantized_models.get((precision, name))
+            if qmodel is None:
+                size = TRANSFORM_SIZES[name]
+                qmodel = quantize_model(model, precision, lambda: _calibration_batches(size))
+                _quantized_models[(precision, name)] = qmodel
+        quantized[name] = qmodel
+    return quantized
+
+
+def load_explain_models(names: Optional[Sequence[str]] = None) -> Dict[str, torch.nn.Module]:
+    """Eager fp32 models for explainers; quantized modules cannot backpropagate."""
+    return load_models("fp32", names)
+
+
+def get_runners(names: Optional[Sequence[str]] = None) -> Dict[str, Runner]:
+    """
+    Inference callables for the configured backend and precision.
+
+    ``eager`` returns the modules themselves; ``torchscript`` and ``onnx``
+    export each model once to ``EXPORT_DIR`` (dynamic batch axis) and serve
+    it through that runtime. Every runner maps NxCxHxW to NxK logits, so the
+    predict functions behave the same on any backend.
+    """
+    models = load_models(names=names)
+    if INFERENCE_BACKEND == "eager":
+        return models
+
+    if INFERENCE_BACKEND == "onnx" and MODEL_PRECISION != "fp32":
+        raise ValueError("INFERENCE_BACKEND=onnx only supports MODEL_PRECISION=fp32.")
+    suffix = "onnx" if INFERENCE_BACKEND == "onnx" else "pt"
+    runners: Dict[str, Runner] = {}
+    for name, model in models.items():
+        with _derived_lock:
+            runner = _runners.get(name)
+            if runner is None:
+                runner = build_runner(
+                    INFERENCE_BACKEND,
+                    model,
+                    TRANSFORM_SIZES[name],
+                    EXPORT_DIR / f"{name}-{MODEL_PRECISION}.{suffix}",
+                    MODEL_PATHS.get(name),
+                    _device,
+                )
+                _runners[name] = runner
+        runners[name] = runner
+    return runners
+
+
+def warmup_models(
+    names: Optional[Sequence[str]] = None, batch_sizes: Sequence[int] = WARMUP_BATCH_SIZES
+) -> None:
+    """
+    Run the served runners once per batch size at their input size.
+
+    The first forward pass pays for kernel selection, allocator growth and
+    (for exported backends) graph initialisation; doing it here keeps that
+    off the first request.
+    """
+    for name, runner in get_runners(names).items():
+        status = _model_status[name]
+        status.update(state="warming")
+        size = TRANSFORM_SIZES[name]
+        started = time.perf_counter()
+        with torch.no_grad(), inference_context(MODEL_PRECISION, _device):
+            for batch_size in batch_sizes:
+                runner(torch.zeros(batch_size, 3, size, size, device=_device))
+        if _device.type == "cuda":
+            torch.cuda.synchronize()
+        status.update(state="ready", warmup_seconds=round(time.perf_counter() - started, 3))
+
+
+def preload_models() -> None:
+    """
+    Load, export (non-eager backends) and warm up the startup models.
+
+    Without a memory budget every model is preloaded; with one, only the
+    pinned models are and the rest load on first use. Meant to run once at
+    startup; progress and failures are recorded for ``readiness()`` instead
+    of raised.
+    """
+    names = PINNED_MODELS if _registry.budget_bytes else None
+    _readiness.update(state="loading")
+    started = time.perf_counter()
+    try:
+        if names is None or names:
+            load_models(names=names)
+            get_runners(names)
+            _readiness.update(state="warming")
+            warmup_models(names)
+    except Exception as exc:
+        print(f"Warning: model preload failed: {exc}")
+        _readiness.update(state="failed", error=str(exc))
+        return
+    _readiness.update(
+        ready=True, state="ready", seconds=round(time.perf_counter() - started, 3)
+    )
+
+
+def skip_preload() -> None:
+    """
+    Report ready without preloading: models load on first use, so the
+    process can take traffic right away (state ``lazy``).
+    """
+    _readiness.update(ready=True, state="lazy")
+
+
+def share_models_for_fork() -> Dict[str, int]:
+    """
+    Load the startup models and move their weights into shared memory, for a
+    parent process that forks serving workers afterwards (see ``serve.py``).
+
+    Quantized copies (``MODEL_PRECISION=int8-*``) and TorchScript runners
+    are built here too, so workers inherit them copy-on-write instead of
+    each building a private set. ONNX Runtime sessions own their weights and
+    threads and cannot cross a fork; with ``INFERENCE_BACKEND=onnx`` every
+    worker still builds its own session, and a warning says so.
+
+    Loading, quantizing and ``share_memory()`` copy large tensors with
+    intra-op parallelism, and an OpenMP team started in the parent can hang
+    forked children that enter a parallel region. So the parent is limited
+    to one thread here; each worker sets its own thread count after the fork
+    and warms up on its own. Returns the shared fp32 bytes per model.
+    """
+    if _device.type != "cpu":
+        raise RuntimeError("Sharing weights across forked workers is only supported on CPU.")
+    torch.set_num_threads(1)
+    names = PINNED_MODELS if _registry.budget_bytes else None
+    models = load_models("fp32", names=names)
+    for model in models.values():
+        model.share_memory()
+    if INFERENCE_BACKEND == "onnx":
+        print(
+            "Warning: ONNX Runtime sessions cannot be shared across forked workers; "
+            "each worker builds its own session with a private copy of the weights."
+        )
+    else:
+        get_runners(names)
+    return {name: module_bytes(model) for name, model in models.items()}
+
+
+def readiness() -> Dict[str, object]:
+    """Overall readiness plus per-model load state and timings."""
+    return {
+        **_readiness,
+        "device": str(_device),
+        "precision": MODEL_PRECISION,
+        "backend": INFERENCE_BACKEND,
+        "models": {name: dict(status) for name, status in _model_status.items()},
+    }
 
 
 def _softmax_logits(logits: torch.Tensor) -> torch.Tensor:
-    return torch.nn.functional.softmax(logits, dim=1)
+    return torch.nn.functional.softmax(logits.float(), dim=1)
+
+
+def _probs_to_dict(probs: np.ndarray) -> Dict[str, float]:
+    return dict(zip(CLASS_NAMES, probs.tolist()))
 
 
 def predict_single_model(
-    model_name: str, image: Image.Image
+    model_name: str,
+    image: Image.Image,
+    tensors: Optional[Dict[int, torch.Tensor]] = None,
 ) -> Tuple[str, float, Dict[str, float]]:
-    models = load_models()
-    if model_name not in models:
+    runners = get_runners([model_name])
+    if model_name not in runners:
         raise ValueError(f"Model '{model_name}' is not loaded.")
 
-    model = models[model_name]
+    model = runners[model_name]
     size = TRANSFORM_SIZES[model_name]
-    transform = get_transform(size)
-    tensor = transform(image).unsqueeze(0).to(_device)
+    if tensors is None or size not in tensors:
+        tensors = preprocess_image(image, [size])
 
-    with torch.no_grad():
-        logits = model(tensor)
-        probs = _softmax_logits(logits)[0].cpu().numpy()
+    with stage("forward", model=model_name):
+        with torch.no_grad(), inference_context(MODEL_PRECISION, _device):
+            logits = model(tensors[size])
+            probs = _softmax_logits(logits)[0].cpu().numpy()
 
-    prob_dict = {cls: float(probs[i]) for i, cls in enumerate(CLASS_NAMES)}
     best_idx = int(probs.argmax())
-    return CLASS_NAMES[best_idx], float(probs[best_idx]), prob_dict
+    return CLASS_NAMES[best_idx], float(probs[best_idx]), _probs_to_dict(probs)
+
+
+EnsembleOutput = Tuple[str, float, Dict[str, float], Dict[str, Dict[str, float]]]
+
+
+def _ensemble_forward(
+    models: Dict[str, Runner],
+    tensors: Dict[int, torch.Tensor],
+    precision: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Run every model once on its (shared) input batch.
+
+    Returns a (num_models, batch, num_classes) array; probabilities are
+    gathered on-device and copied back in a single transfer.
+    """
+    probs = []
+    with torch.no_grad(), inference_context(precision or MODEL_PRECISION, _device):
+        for name, model in models.items():
+            with stage("forward", model=name):
+                probs.append(_softmax_logits(model(tensors[TRANSFORM_SIZES[name]])))
+        stacked = torch.stack(probs)
+    return stacked.cpu().numpy()
+
+
+def ensemble_weights(names: Sequence[str]) -> np.ndarray:
+    weights = np.array([ENSEMBLE_WEIGHTS.get(name, 1.0) for name in names], dtype=np.float32)
+    return weights / weights.sum()
+
+
+def _ensemble_outputs(names: List[str], stacked: np.ndarray) -> List[EnsembleOutput]:
+    ensemble_probs = np.tensordot(ensemble_weights(names), stacked, axes=1)
+    best = ensemble_probs.argmax(axis=1)
+    outputs: List[EnsembleOutput] = []
+    for b in range(stacked.shape[1]):
+        best_idx = int(best[b])
+        per_model_probs = {
+            name: _probs_to_dict(stacked[m, b]) for m, name in enumerate(names)
+        }
+        outputs.append(
+            (
+                CLASS_NAMES[best_idx],
+                float(ensemble_probs[b, best_idx]),
+                _probs_to_dict(ensemble_probs[b]),
+                per_model_probs,
+            )
+        )
+    return outputs
+
+
+def _cascade_outputs(
+    models: Dict[str, Runner],
+    tensors: Dict[int, torch.Tensor],
+    min_confidence: float = CASCADE_MIN_CONFIDENCE,
+    min_margin: float = CASCADE_MIN_MARGIN,
+) -> List[EnsembleOutput]:
+    """
+    Cascade-mode ensemble outputs for a batch.
+
+    Each model only sees the images the models before it left undecided.
+    The confidence and probabilities are those of the models an image
+    actually used, and only those models appear in its per-model scores.
+    """
+    batch = next(iter(tensors.values())).shape[0]
+    running = cascade.RunningEnsemble(batch, len(CLASS_NAMES))
+    per_model_probs: List[Dict[str, Dict[str, float]]] = [{} for _ in range(batch)]
+    active = np.arange(batch)
+    with torch.no_grad(), inference_context(MODEL_PRECISION, _device):
+        for name in cascade.cascade_order(list(models), CASCADE_ORDER):
+            inputs = tensors[TRANSFORM_SIZES[name]]
+            if len(active) < batch:
+                inputs = inputs[torch.as_tensor(active, device=inputs.device)]
+            with stage("forward", model=name):
+                probs = _softmax_logits(models[name](inputs)).cpu().numpy()
+            running.add(active, ENSEMBLE_WEIGHTS.get(name, 1.0), probs)
+            for row, image_probs in zip(active, probs):
+                per_model_probs[row][name] = _probs_to_dict(image_probs)
+            active = active[~cascade.settled(running.probs(active), min_confidence, min_margin)]
+            if not len(active):
+                break
+
+    ensemble_probs = running.probs()
+    outputs: List[EnsembleOutput] = []
+    for b in range(batch):
+        best_idx = int(ensemble_probs[b].argmax())
+        outputs.append(
+            (
+                CLASS_NAMES[best_idx],
+                float(ensemble_probs[b, best_idx]),
+                _probs_to_dict(ensemble_probs[b]),
+                per_model_probs[b],
+            )
+        )
+    return outputs
+
+
+def _ensemble_predict(
+    models: Dict[str, Runner], tensors: Dict[int, torch.Tensor]
+) -> List[EnsembleOutput]:
+    if ENSEMBLE_MODE == "cascade":
+        return _cascade_outputs(models, tensors)
+    return _ensemble_outputs(list(models.keys()), _ensemble_forward(models, tensors))
 
 
 def predict_ensemble(
     image: Image.Image,
-) -> Tuple[str, float, Dict[str, float], Dict[str, Dict[str, float]]]:
-    models = load_models()
+    tensors: Optional[Dict[int, torch.Tensor]] = None,
+) -> EnsembleOutput:
+    models = get_runners()
     if not models:
         raise RuntimeError("No models loaded. Check MODEL_PATHS.")
 
-    per_model_probs: Dict[str, Dict[str, float]] = {}
-    accum = torch.zeros(len(CLASS_NAMES), dtype=torch.float32)
+    sizes = {TRANSFORM_SIZES[name] for name in models}
+    if tensors is None or not sizes <= set(tensors):
+        tensors = preprocess_image(image, sizes)
 
-    with torch.no_grad():
-        for name, model in models.items():
-            size = TRANSFORM_SIZES[name]
-            transform = get_transform(size)
-            tensor = transform(image).unsqueeze(0).to(_device)
-            logits = model(tensor)
-            probs = _softmax_logits(logits)[0].cpu()
-            per_model_probs[name] = {
-                cls: float(probs[i]) for i, cls in enumerate(CLASS_NAMES)
-            }
-            accum += probs
+    return _ensemble_predict(models, tensors)[0]
 
-    ensemble_probs = (accum / len(models)).numpy()
-    prob_dict = {cls: float(ensemble_probs[i]) for i, cls in enumerate(CLASS_NAMES)}
-    best_idx = int(ensemble_probs.argmax())
-    return CLASS_NAMES[best_idx], float(ensemble_probs[best_idx]), prob_dict, per_model_probs
 
+def predict_ensemble_probs(images: Sequence[Image.Image]) -> np.ndarray:
+    """Weighted ensemble probabilities as a (batch, num_classes) array."""
+    models = get_runners()
+    if not models:
+        raise RuntimeError("No models loaded. Check MODEL_PATHS.")
+
+    tensors = preprocess_batch(images, {TRANSFORM_SIZES[name] for name in models})
+    stacked = _ensemble_forward(models, tensors)
+    return np.tensordot(ensemble_weights(list(models.keys())), stacked, axes=1)
+
+
+def predict_ensemble_batch(images: Sequence[Image.Image]) -> List[EnsembleOutput]:
+    """Ensemble prediction for several images with one batched forward per model."""
+    models = get_runners()
+    if not models:
+        raise RuntimeError("No models loaded. Check MODEL_PATHS.")
+    if not images:
+        return []
 
+    tensors = preprocess_batch(images, {TRANSFORM_SIZES[name] for name in models})
+    return _ensemble_predict(models, tensors)
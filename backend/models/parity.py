@@ -0,0 +1,126 @@
+"""
+Parity report for reduced-precision inference modes.
+
+Run from ``backend/``:
+
+    python -m models.parity --samples path/to/patches --limit 256 \
+        --modes bf16 int8-dynamic int8-static --out parity.json
+
+Every mode is compared against fp32 on the same preprocessed samples:
+top-1 agreement and probability drift per model and for the ensemble, plus
+per-image latency, so the accuracy cost of each throughput gain is explicit.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import torch
+
+from . import loader
+from .precision import PRECISIONS, sample_images
+
+
+def _run_mode(precision: str, batches: List[Dict[int, torch.Tensor]]) -> Dict[str, object]:
+    started = time.perf_counter()
+    models = loader.load_models(precision)
+    load_seconds = time.perf_counter() - started
+
+    loader._ensemble_forward(models, batches[0], precision)  # warm-up
+    outputs = []
+    started = time.perf_counter()
+    for tensors in batches:
+        outputs.append(loader._ensemble_forward(models, tensors, precision))
+    seconds = time.perf_counter() - started
+    return {
+        "names": list(models.keys()),
+        "probs": np.concatenate(outputs, axis=1),  # (models, samples, classes)
+        "load_seconds": load_seconds,
+        "seconds": seconds,
+    }
+
+
+def _compare(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    drift = np.abs(reference - candidate)
+    return {
+        "top1_agreement": float(np.mean(reference.argmax(-1) == candidate.argmax(-1))),
+        "mean_abs_drift": float(drift.mean()),
+        "max_abs_drift": float(drift.max()),
+        "mean_top1_prob_drift": float(
+            np.mean(
+                np.abs(
+                    np.take_along_axis(reference, reference.argmax(-1)[..., None], -1)
+                    - np.take_along_axis(candidate, reference.argmax(-1)[..., None], -1)
+                )
+            )
+        ),
+    }
+
+
+def build_report(
+    modes: List[str], samples: Path, limit: int, batch_size: int
+) -> Dict[str, object]:
+    images = sample_images(samples, limit)
+    sizes = set(loader.TRANSFORM_SIZES.values())
+    batches = [
+        {size: t.cpu() for size, t in loader.preprocess_batch(images[i : i + batch_size], sizes).items()}
+        for i in range(0, len(images), batch_size)
+    ]
+
+    reference = _run_mode("fp32", batches)
+    names = reference["names"]
+    weights = loader.ensemble_weights(names)
+    ref_ensemble = np.tensordot(weights, reference["probs"], axes=1)
+
+    report: Dict[str, object] = {
+        "samples": len(images),
+        "sample_source": str(samples) if samples else "random",
+        "batch_size": batch_size,
+        "threads": torch.get_num_threads(),
+        "modes": {
+            "fp32": {
+                "ms_per_image": 1000.0 * reference["seconds"] / len(images),
+                "load_seconds": reference["load_seconds"],
+            }
+        },
+    }
+    for mode in modes:
+        if mode == "fp32":
+            continue
+        result = _run_mode(mode, batches)
+        probs = result["probs"]
+        entry: Dict[str, object] = {
+            "ms_per_image": 1000.0 * result["seconds"] / len(images),
+            "load_seconds": result["load_seconds"],
+            "speedup_vs_fp32": reference["seconds"] / result["seconds"],
+            "ensemble": _compare(ref_ensemble, np.tensordot(weights, probs, axes=1)),
+            "per_model": {
+                name: _compare(reference["probs"][m], probs[m]) for m, name in enumerate(names)
+            },
+        }
+        report["modes"][mode] = entry
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare precision modes against fp32.")
+    parser.add_argument("--samples", type=Path, default=None, help="directory of sample patches")
+    parser.add_argument("--limit", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--modes", nargs="+", default=[m for m in PRECISIONS if m != "fp32"])
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args()
+
+    # without QUANT_CALIBRATION_DIR, int8-static is calibrated on noise here
+    loader.ALLOW_RANDOM_CALIBRATION = True
+    report = build_report(args.modes, args.samples, args.limit, args.batch_size)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import contextlib
+import copy
+from pathlib import Path
+from typing import Callable, ContextManager, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+PRECISIONS = ("fp32", "bf16", "int8-dynamic", "int8-static")
+
+_IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+
+
+def validate_precision(precision: str) -> str:
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    return precision
+
+
+def inference_context(precision: str, device: torch.device) -> ContextManager:
+    """bf16 runs the fp32 modules under autocast; other modes need no context."""
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def _quantized_engine() -> str:
+    engines = torch.backends.quantized.supported_engines
+    return "x86" if "x86" in engines else "fbgemm"
+
+
+def sample_images(
+    directory: Optional[Path], limit: int, seed: int = 0, allow_random: bool = True
+) -> List[Image.Image]:
+    """
+    Up to ``limit`` RGB images from ``directory`` (recursively).
+
+    Falls back to random noise patches when no directory is given or it holds
+    no images; that is enough to exercise the code paths but a poor
+    calibration/parity set. With ``allow_random=False`` that case raises
+    ``ValueError`` instead.
+    """
+    if directory is not None:
+        paths = sorted(p for p in directory.rglob("*") if p.suffix.lower() in _IMAGE_SUFFIXES)
+        if paths:
+            return [Image.open(p).convert("RGB") for p in paths[:limit]]
+        if not allow_random:
+            raise ValueError(f"No images found in {directory}.")
+        print(f"Warning: no images found in {directory}, using random patches")
+    else:
+        if not allow_random:
+            raise ValueError("No sample directory given.")
+        print("Warning: no sample directory given, using random patches")
+    rng = np.random.default_rng(seed)
+    return [
+        Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8))
+        for _ in range(limit)
+    ]
+
+
+def quantize_model(
+    model: torch.nn.Module,
+    precision: str,
+    calibration: Callable[[], List[torch.Tensor]],
+) -> torch.nn.Module:
+    """
+    Return an int8 copy of an eval-mode fp32 model (CPU only).
+
+    ``int8-dynamic`` quantizes the Linear classifier heads with dynamic
+    activation scales. ``int8-static`` quantizes the whole network (backbone
+    convolutions included) with FX graph mode, observing activation ranges on
+    the batches returned by ``calibration``.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    model = copy.deepcopy(model).cpu().eval()
+    if precision == "int8-dynamic":
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == "int8-static":
+        engine = _quantized_engine()
+        torch.backends.quantized.engine = engine
+        batches = calibration()
+        prepared = prepare_fx(
+            model, get_default_qconfig_mapping(engine), example_inputs=(batches[0],)
+        )
+        with torch.no_grad():
+            for batch in batches:
+                prepared(batch)
+        return convert_fx(prepared)
+    raise ValueError(f"Precision '{precision}' is not an int8 mode")
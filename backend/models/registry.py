@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Set
+
+import torch
+
+
+def module_bytes(module: torch.nn.Module) -> int:
+    """Bytes held by a module's parameters and buffers."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    """
+    Loads models on first use and keeps them within a memory budget.
+
+    ``load_fn(name)`` returns the module, or ``None`` if it cannot be loaded
+    (the name is then reported as unavailable and not retried). Once resident
+    bytes exceed ``budget_bytes`` (0 = unlimited) the least recently used
+    models are evicted, except pinned ones and the ones the current call asked
+    for. Callers keep whatever references they were handed, so an eviction
+    never pulls a model out from under a running request; memory is released
+    once those references are gone.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        load_fn: Callable[[str], Optional[torch.nn.Module]],
+        budget_bytes: int = 0,
+        pinned: Iterable[str] = (),
+        max_workers: int = 4,
+        max_events: int = 100,
+    ) -> None:
+        self.names = list(names)
+        self.load_fn = load_fn
+        self.budget_bytes = max(0, budget_bytes)
+        self.pinned: Set[str] = set(pinned)
+        self.max_workers = max(1, max_workers)
+        self._resident: "OrderedDict[str, torch.nn.Module]" = OrderedDict()
+        self._bytes: Dict[str, int] = {}
+        self._unavailable: Set[str] = set()
+        self._lock = threading.Lock()
+        self._name_locks = {name: threading.Lock() for name in self.names}
+        self._evict_listeners: List[Callable[[str], None]] = []
+        self._events: Deque[Dict[str, object]] = deque(maxlen=max_events)
+        self.loads = 0
+        self.evictions = 0
+
+        unknown = self.pinned - set(self.names)
+        if unknown:
+            raise ValueError(f"Unknown pinned models: {sorted(unknown)}")
+
+    def available(self) -> List[str]:
+        """Models that are loaded or may still be loaded, in declaration order."""
+        return [name for name in self.names if name not in self._unavailable]
+
+    def resident(self) -> List[str]:
+        with self._lock:
+            return [name for name in self.names if name in self._resident]
+
+    def add_evict_listener(self, listener: Callable[[str], None]) -> None:
+        """``listener(name)`` runs after a model is evicted, to drop derived state."""
+        self._evict_listeners.append(listener)
+
+    def get(self, name: str) -> Optional[torch.nn.Module]:
+        return self.get_many([name]).get(name)
+
+    def get_many(self, names: Sequence[str]) -> Dict[str, torch.nn.Module]:
+        """
+        The requested models that are available, loading missing ones in
+        parallel. The result keeps the order of ``names``.
+        """
+        with self._lock:
+            for name in names:
+                if name in self._resident:
+                    self._resident.move_to_end(name)
+            missing = [
+                n for n in names if n not in self._resident and n not in self._unavailable
+            ]
+            found = {n: self._resident[n] for n in names if n in self._resident}
+
+        if len(missing) == 1:
+            found.update(self._load(missing[0]))
+        elif missing:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(missing)), thread_name_prefix="model-load"
+            ) as pool:
+                for loaded in pool.map(self._load, missing):
+                    found.update(loaded)
+
+        if missing:
+            self._enforce_budget(protect=set(names))
+        return {name: found[name] for name in names if name in found}
+
+    def _load(self, name: str) -> Dict[str, torch.nn.Module]:
+        if name not in self._name_locks:
+            raise ValueError(f"Unknown model name: {name}")
+        with self._name_locks[name]:
+            with self._lock:
+                if name in self._resident:  # loaded by a concurrent caller
+                    return {name: self._resident[name]}
+                if name in self._unavailable:
+                    return {}
+            started = time.perf_counter()
+            model = self.load_fn(name)
+            if model is None:
+                with self._lock:
+                    self._unavailable.add(name)
+                return {}
+            size = module_bytes(model)
+            with self._lock:
+                self._resident[name] = model
+                self._bytes[name] = size
+                self.loads += 1
+                self._record("load", name, size, seconds=time.perf_counter() - started)
+            return {name: model}
+
+    def _enforce_budget(self, protect: Set[str]) -> None:
+        if not self.budget_bytes:
+            return
+        evicted: List[str] = []
+        with self._lock:
+            for name in list(self._resident):  # least recently used first
+                if sum(self._bytes.values()) <= self.budget_bytes:
+                    break
+                if name in self.pinned or name in protect:
+                    continue
+                del self._resident[name]
+                size = self._bytes.pop(name)
+                self.evictions += 1
+                self._record("evict", name, size)
+                evicted.append(name)
+            over = sum(self._bytes.values()) - self.budget_bytes
+        if over > 0:
+            print(
+                f"Warning: resident models exceed MODEL_MEMORY_BUDGET_MB by "
+                f"{over / 2**20:.1f} MB (pinned or in use)"
+            )
+        for name in evicted:
+            for listener in self._evict_listeners:
+                listener(name)
+
+    def _record(self, event: str, name: str, size: int, **extra: float) -> None:
+        entry: Dict[str, object] = {"event": event, "model": name, "bytes": size, "at": time.time()}
+        entry.update({k: round(v, 3) for k, v in extra.items()})
+        self._events.append(entry)
+
+    def reset(self, load_fn: Optional[Callable[[str], Optional[torch.nn.Module]]] = None) -> None:
+        """Drop every resident model (and optionally swap the loader)."""
+        with self._lock:
+            dropped = list(self._resident)
+            self._resident.clear()
+            self._bytes.clear()
+            self._unavailable.clear()
+            if load_fn is not None:
+                self.load_fn = load_fn
+        for name in dropped:
+            for listener in self._evict_listeners:
+                listener(name)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": sum(self._bytes.values()),
+                "pinned": sorted(self.pinned),
+                "resident": {
+                    name: {"bytes": self._bytes[name], "pinned": name in self.pinned}
+                    for name in self._resident  # least recently used first
+                },
+                "unavailable": sorted(self._unavailable),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "events": list(self._events),
+            }
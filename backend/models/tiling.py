@@ -0,0 +1,282 @@
+"""
+Tiled ensemble inference for large histology images.
+
+Run from ``backend/``:
+
+    python -m models.tiling region.tif out/ --tile-size 224 --stride 224
+
+Writes ``out/probabilities.npy`` (a rows x cols x classes float32 array,
+memory-mapped while it is filled; background tiles are NaN),
+``out/overlay.png`` (tissue-class colours over a thumbnail) and
+``out/tiling.json`` (grid geometry and counters).
+"""
+import argparse
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .loader import CLASS_NAMES, predict_ensemble_probs
+
+try:  # optional: true region reads for pyramidal slide formats
+    import openslide
+except (ImportError, OSError):  # pragma: no cover - package or system library missing
+    openslide = None
+
+
+# Without OpenSlide the whole image is decoded into memory (3 bytes per
+# pixel); larger sources are refused instead of exhausting RAM.
+PILLOW_MAX_PIXELS = int(os.getenv("TILING_PILLOW_MAX_PIXELS", str(16384 * 16384)))
+
+
+# RGB colour per class for the overlay, in CLASS_NAMES order.
+CLASS_COLORS = np.array(
+    [
+        [220, 20, 60],  # 01_TUMOR
+        [255, 165, 0],  # 02_STROMA
+        [148, 0, 211],  # 03_COMPLEX
+        [30, 144, 255],  # 04_LYMPHO
+        [139, 69, 19],  # 05_DEBRIS
+        [50, 205, 50],  # 06_MUCOSA
+        [255, 215, 0],  # 07_ADIPOSE
+        [211, 211, 211],  # 08_EMPTY
+        [105, 105, 105],  # UNKNOWN
+    ],
+    dtype=np.uint8,
+)
+
+
+class TileSource:
+    """Reads RGB regions of a large image; backed by OpenSlide when available."""
+
+    def __init__(self, path: Path, pillow_max_pixels: int = PILLOW_MAX_PIXELS) -> None:
+        self.path = path
+        self._slide = None
+        self._image: Optional[Image.Image] = None
+        if openslide is not None:
+            try:
+                self._slide = openslide.OpenSlide(str(path))
+            except openslide.OpenSlideError:
+                self._slide = None
+        if self._slide is not None:
+            self.width, self.height = self._slide.dimensions
+        else:
+            # PIL decodes the full image on the first region read; install
+            # openslide for region-wise reads of pyramidal TIFF/SVS files.
+            self._image = Image.open(path)
+            self.width, self.height = self._image.size
+            if self.width * self.height > pillow_max_pixels:
+                self._image.close()
+                raise ValueError(
+                    f"Image {self.width}x{self.height} is too large to decode with Pillow "
+                    f"(limit {pillow_max_pixels} pixels); install openslide-python to "
+                    "read it region by region."
+                )
+
+    def read_region(self, x: int, y: int, size: int) -> Image.Image:
+        if self._slide is not None:
+            return self._slide.read_region((x, y), 0, (size, size)).convert("RGB")
+        assert self._image is not None
+        return self._image.crop((x, y, x + size, y + size)).convert("RGB")
+
+    def thumbnail(self, max_side: int) -> Image.Image:
+        if self._slide is not None:
+            return self._slide.get_thumbnail((max_side, max_side)).convert("RGB")
+        assert self._image is not None
+        scale = min(1.0, max_side / max(self.width, self.height))
+        size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+        return self._image.convert("RGB").resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    def close(self) -> None:
+        if self._slide is not None:
+            self._slide.close()
+        if self._image is not None:
+            self._image.close()
+
+
+def tissue_fraction(tile: Image.Image, sample_size: int = 32) -> float:
+    """Share of pixels that look like stained tissue (saturated, not white)."""
+    hsv = np.asarray(tile.resize((sample_size, sample_size), Image.BILINEAR).convert("HSV"))
+    saturation = hsv[..., 1].astype(np.float32) / 255.0
+    value = hsv[..., 2].astype(np.float32) / 255.0
+    return float(np.mean((saturation > 0.07) & (value < 0.92) & (value > 0.08)))
+
+
+@dataclass
+class TilingResult:
+    width: int
+    height: int
+    tile_size: int
+    stride: int
+    rows: int
+    cols: int
+    tiles_classified: int
+    tiles_skipped: int
+    seconds: float
+    probabilities_path: str
+    overlay_path: str
+    class_names: List[str]
+
+
+def _grid_positions(rows: int, cols: int, stride: int) -> Iterator[Tuple[int, int, int, int]]:
+    for r in range(rows):
+        for c in range(cols):
+            yield r, c, c * stride, r * stride
+
+
+def render_overlay(
+    probabilities: np.ndarray,
+    thumbnail: Image.Image,
+    covered: Tuple[int, int],
+    full_size: Tuple[int, int],
+    alpha: float = 0.45,
+) -> Image.Image:
+    """
+    Colour each tile by its top class and blend over the slide thumbnail.
+
+    ``covered`` is the (width, height) in source pixels spanned by the tile
+    grid and ``full_size`` the source size, used to place the grid on the
+    thumbnail.
+    """
+    rows, cols = probabilities.shape[:2]
+    class_map = np.full((rows, cols), -1, dtype=np.int64)
+    for r in range(rows):  # row by row keeps the memmap access sequential
+        row = probabilities[r]
+        valid = ~np.isnan(row[:, 0])
+        class_map[r, valid] = np.argmax(row[valid], axis=1)
+
+    scale = thumbnail.width / full_size[0]
+    grid_px = (max(1, round(covered[0] * scale)), max(1, round(covered[1] * scale)))
+
+    colors = np.zeros((rows, cols, 3), dtype=np.uint8)
+    colors[class_map >= 0] = CLASS_COLORS[class_map[class_map >= 0]]
+    color_img = Image.new("RGB", thumbnail.size)
+    color_img.paste(Image.fromarray(colors).resize(grid_px, Image.NEAREST), (0, 0))
+    mask = Image.new("L", thumbnail.size, 0)
+    tissue = ((class_map >= 0) * int(255 * alpha)).astype(np.uint8)
+    mask.paste(Image.fromarray(tissue).resize(grid_px, Image.NEAREST), (0, 0))
+    return Image.composite(color_img, thumbnail, mask)
+
+
+def predict_tiles(
+    source_path: Path,
+    out_dir: Path,
+    tile_size: int = 224,
+    stride: Optional[int] = None,
+    batch_size: int = 32,
+    min_tissue: float = 0.1,
+    overlay_max_side: int = 2048,
+) -> TilingResult:
+    """
+    Classify every ``tile_size`` tile of a large image with the ensemble.
+
+    Tiles are read one at a time, tiles whose tissue fraction is below
+    ``min_tissue`` are skipped, and the rest are classified in batches of
+    ``batch_size``. Probabilities go straight into a memory-mapped array, so
+    memory use does not grow with the image size.
+    """
+    stride = stride or tile_size
+    out_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    source = TileSource(source_path)
+    try:
+        if source.width < tile_size or source.height < tile_size:
+            raise ValueError(
+                f"Image {source.width}x{source.height} is smaller than one {tile_size}px tile."
+            )
+        rows = (source.height - tile_size) // stride + 1
+        cols = (source.width - tile_size) // stride + 1
+
+        probs_path = out_dir / "probabilities.npy"
+        probabilities = np.lib.format.open_memmap(
+            probs_path, mode="w+", dtype=np.float32, shape=(rows, cols, len(CLASS_NAMES))
+        )
+        probabilities[:] = np.nan
+
+        classified = skipped = 0
+        pending: List[Tuple[int, int, Image.Image]] = []
+
+        def _flush() -> None:
+            nonlocal classified
+            if not pending:
+                return
+            batch_probs = predict_ensemble_probs([tile for _, _, tile in pending])
+            for (r, c, _), p in zip(pending, batch_probs):
+                probabilities[r, c] = p
+            classified += len(pending)
+            pending.clear()
+
+        for r, c, x, y in _grid_positions(rows, cols, stride):
+            tile = source.read_region(x, y, tile_size)
+            if tissue_fraction(tile) < min_tissue:
+                skipped += 1
+                continue
+            pending.append((r, c, tile))
+            if len(pending) >= batch_size:
+                _flush()
+        _flush()
+        probabilities.flush()
+
+        overlay_path = out_dir / "overlay.png"
+        covered = ((cols - 1) * stride + tile_size, (rows - 1) * stride + tile_size)
+        render_overlay(
+            probabilities,
+            source.thumbnail(overlay_max_side),
+            covered,
+            (source.width, source.height),
+        ).save(overlay_path)
+        del probabilities
+    finally:
+        source.close()
+
+    result = TilingResult(
+        width=source.width,
+        height=source.height,
+        tile_size=tile_size,
+        stride=stride,
+        rows=rows,
+        cols=cols,
+        tiles_classified=classified,
+        tiles_skipped=skipped,
+        seconds=time.perf_counter() - started,
+        probabilities_path=str(probs_path),
+        overlay_path=str(overlay_path),
+        class_names=list(CLASS_NAMES),
+    )
+    (out_dir / "tiling.json").write_text(json.dumps(asdict(result), indent=2))
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tiled ensemble inference for large images.")
+    parser.add_argument("image", type=Path)
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--tile-size", type=int, default=224)
+    parser.add_argument("--stride", type=int, default=None, help="defaults to the tile size")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-tissue", type=float, default=0.1)
+    parser.add_argument("--overlay-max-side", type=int, default=2048)
+    args = parser.parse_args()
+
+    # large regions are expected here; PILLOW_MAX_PIXELS is the guard instead
+    Image.MAX_IMAGE_PIXELS = None
+    result = predict_tiles(
+        args.image,
+        args.out_dir,
+        tile_size=args.tile_size,
+        stride=args.stride,
+        batch_size=args.batch_size,
+        min_tissue=args.min_tissue,
+        overlay_max_side=args.overlay_max_side,
+    )
+    print(json.dumps(asdict(result), indent=2))
+
+
+if __name__ == "__main__":
+    main()
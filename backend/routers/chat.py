@@ -1,23 +1,49 @@
+import asyncio
+import json
 import os
-from typing import Optional
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 import google.generativeai as genai
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 
-from schemas import ChatRequest, ChatResponse, PredictionResult
+from chat_sessions import SESSIONS_ENABLED, ChatSession, get_session_store
+from schemas import (
+    ChatMessage,
+    ChatRequest,
+    ChatResponse,
+    ChatSessionCreate,
+    ChatSessionInfo,
+    PredictionResult,
+)
 
 load_dotenv()
 
-router = APIRouter()
+router = APIRouter(tags=["chat"])
 
 # Initialize Gemini API
 api_key = os.getenv("GOOGLE_API_KEY")
+# Base URL of a Gemini-compatible server to use instead of Google's, e.g. a
+# local stand-in for development and tests ("http://127.0.0.1:8081").
+api_endpoint = os.getenv("GEMINI_API_ENDPOINT")
 if api_key:
-    genai.configure(api_key=api_key)
+    if api_endpoint:
+        genai.configure(
+            api_key=api_key, transport="rest", client_options={"api_endpoint": api_endpoint}
+        )
+    else:
+        genai.configure(api_key=api_key)
 else:
     print("Warning: GOOGLE_API_KEY not found in environment variables")
 
+# Fixed model name; skips model discovery entirely.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+# How long a discovered model name is reused before list_models() is asked again.
+MODEL_DISCOVERY_TTL_S = float(os.getenv("GEMINI_MODEL_TTL_S", "3600"))
+
 # List of model names to try (in order of preference)
 MODEL_NAMES = [
     'gemini-1.5-flash',
@@ -27,7 +53,17 @@ MODEL_NAMES = [
     'models/gemini-1.5-pro',
 ]
 
-def get_available_model():
+INTRO_MESSAGE = "Please introduce yourself and explain how you can help."
+
+_discovery_lock = threading.Lock()
+_discovered: Optional[str] = None
+_discovered_at = 0.0
+
+_clients: Dict[str, genai.GenerativeModel] = {}
+_clients_lock = threading.Lock()
+
+
+def discover_model():
     """Try to find an available model by listing available models."""
     if not api_key:
         return None
@@ -64,6 +100,32 @@ def get_available_model():
     return None
 
 
+def get_available_model() -> Optional[str]:
+    """
+    The model to chat with: ``GEMINI_MODEL`` if set, else the result of
+    ``discover_model()``, reused for ``MODEL_DISCOVERY_TTL_S`` seconds.
+    Blocking; concurrent callers share one discovery round trip.
+    """
+    global _discovered, _discovered_at
+    if GEMINI_MODEL:
+        return GEMINI_MODEL
+    with _discovery_lock:
+        if _discovered is None or time.monotonic() - _discovered_at > MODEL_DISCOVERY_TTL_S:
+            # failures are not cached, the next request tries again
+            _discovered = discover_model()
+            _discovered_at = time.monotonic()
+        return _discovered
+
+
+def get_client(model_name: str) -> genai.GenerativeModel:
+    """One reusable ``GenerativeModel`` per model name."""
+    with _clients_lock:
+        client = _clients.get(model_name)
+        if client is None:
+            client = _clients[model_name] = genai.GenerativeModel(model_name)
+        return client
+
+
 def format_prediction_context(context: Optional[PredictionResult]) -> str:
     """Format prediction context for the chatbot."""
     if not context:
@@ -116,112 +178,254 @@ Always be accurate, helpful, and professional. If you're unsure about medical in
     return base_prompt
 
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest) -> ChatResponse:
-    """Chat endpoint using Google Gemini API."""
+def _to_content(role: str, text: str) -> dict:
+    return {"role": "user" if role == "user" else "model", "parts": [text]}
+
+
+def build_history(request: ChatRequest, system_prompt: str) -> List[dict]:
+    """
+    Gemini chat history (list of dicts with 'role' and 'parts') for every
+    message except the last, which is sent separately.
+    """
+    history = []
+    
+    # Add system instructions
+    if request.context:
+        # If context exists, start with a setup message
+        history.append(_to_content("user", system_prompt))
+        history.append(
+            _to_content("model", "I understand. I have the classification context and I'm ready to help.")
+        )
+    
+    # Convert previous messages (excluding the last one which we'll send separately)
+    previous_messages = request.messages[:-1]
+    
+    # If no context and we have previous messages, prepend system prompt to first user message
+    if not request.context and previous_messages:
+        first_msg = previous_messages[0]
+        if first_msg.role == "user":
+            history.append(_to_content("user", system_prompt + "\n\nUser: " + first_msg.content))
+            previous_messages = previous_messages[1:]
+        else:
+            # First message is assistant, add system prompt as separate user message
+            history.append(_to_content("user", system_prompt))
+    
+    for msg in previous_messages:
+        history.append(_to_content(msg.role, msg.content))
+    return history
+
+
+def stateless_turn(request: ChatRequest) -> Tuple[List[dict], str]:
+    """History and message to send for a request carrying the whole conversation."""
+    system_prompt = create_system_prompt(request.context)
+    
+    # Handle empty messages case
+    if not request.messages:
+        return [], system_prompt + "\n\n" + INTRO_MESSAGE
+    
+    return build_history(request, system_prompt), request.messages[-1].content
+
+
+def session_turn(session: ChatSession, messages: List[ChatMessage]) -> Tuple[List[dict], str]:
+    """
+    History and message to send for new ``messages`` in a server-side session:
+    the cached system prompt (plus the digest of compacted turns), the kept
+    turns, then the new messages.
+    """
+    setup = session.system_prompt
+    if session.digest:
+        setup += "\n\nEarlier in this conversation (condensed):\n" + "\n".join(session.digest)
+    if session.context:
+        ack = "I understand. I have the classification context and I'm ready to help."
+    else:
+        ack = "I understand. I'm ready to help."
+    history = [_to_content("user", setup), _to_content("model", ack)]
+    history.extend(_to_content(role, text) for role, text in list(session.turns))
+    
+    if not messages:
+        return history, INTRO_MESSAGE
+    
+    history.extend(_to_content(msg.role, msg.content) for msg in messages[:-1])
+    return history, messages[-1].content
+
+
+def _require_sessions() -> None:
+    if not SESSIONS_ENABLED:
+        raise HTTPException(
+            status_code=501,
+            detail="Chat sessions need a single server worker; send the full conversation instead."
+        )
+
+
+def _prepare(request: ChatRequest) -> Tuple[Optional[ChatSession], List[dict], str]:
+    if request.session_id is None:
+        history, message = stateless_turn(request)
+        return None, history, message
+    
+    _require_sessions()
+    store = get_session_store()
+    session = store.get(request.session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired chat session.")
+    if request.context is not None:
+        store.set_context(session, request.context, create_system_prompt)
+    history, message = session_turn(session, request.messages)
+    return session, history, message
+
+
+def _commit(session: Optional[ChatSession], request: ChatRequest, reply: str) -> None:
+    """Record a completed exchange in its session (failed turns leave no trace)."""
+    if session is None:
+        return
+    sent = [(msg.role, msg.content) for msg in request.messages] or [("user", INTRO_MESSAGE)]
+    get_session_store().append(session, sent + [("assistant", reply)])
+
+
+def _send(model_name: str, history: List[dict], message: str, stream: bool):
+    """Blocking Gemini call; run it in a thread."""
+    chat_session = get_client(model_name).start_chat(history=history)
+    try:
+        return chat_session.send_message(message, stream=stream)
+    except StopIteration:
+        # the SDK raises it for an empty stream, and it cannot cross into the
+        # awaiting asyncio future (the request would hang)
+        raise RuntimeError("the model returned an empty response") from None
+
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:  # no text parts, e.g. a chunk only carrying finish metadata
+        return ""
+
+
+async def _resolve_model() -> str:
     if not api_key:
         raise HTTPException(
             status_code=500,
             detail="Google API key not configured. Please set GOOGLE_API_KEY in environment variables."
         )
+    model_name = await asyncio.to_thread(get_available_model)
+    if not model_name:
+        raise HTTPException(
+            status_code=500,
+            detail="No available Gemini model found. Please check your API key and model availability."
+        )
+    return model_name
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest) -> ChatResponse:
+    """
+    Chat endpoint using Google Gemini API.
+
+    Without ``session_id`` the request carries the whole conversation; with
+    one (see ``/chat/sessions``) only the new message is sent.
+    """
+    model_name = await _resolve_model()
+    session, history, message = _prepare(request)
     
     try:
-        # Create system prompt with context if available
-        system_prompt = create_system_prompt(request.context)
-        
-        # Get available model
-        model_name = get_available_model()
-        if not model_name:
-            raise HTTPException(
-                status_code=500,
-                detail="No available Gemini model found. Please check your API key and model availability."
-            )
-        
-        # Initialize the model
-        model = genai.GenerativeModel(model_name)
-        
-        # Handle empty messages case
-        if not request.messages:
-            response = model.generate_content(
-                system_prompt + "\n\nPlease introduce yourself and explain how you can help."
-            )
-            if not response or not response.text:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to generate response from AI model"
-                )
-            return ChatResponse(message=response.text.strip())
-        
-        # Build conversation history for Gemini
-        # Gemini expects a list of dicts with 'role' and 'parts'
-        history = []
-        
-        # Add system instructions
-        if request.context:
-            # If context exists, start with a setup message
-            history.append({
-                "role": "user",
-                "parts": [system_prompt]
-            })
-            history.append({
-                "role": "model",
-                "parts": ["I understand. I have the classification context and I'm ready to help."]
-            })
-        
-        # Convert previous messages (excluding the last one which we'll send separately)
-        previous_messages = request.messages[:-1]
-        
-        # If no context and we have previous messages, prepend system prompt to first user message
-        if not request.context and previous_messages:
-            first_msg = previous_messages[0]
-            if first_msg.role == "user":
-                enhanced_first = {
-                    "role": "user",
-                    "parts": [system_prompt + "\n\nUser: " + first_msg.content]
-                }
-                history.append(enhanced_first)
-                # Add remaining previous messages
-                for msg in previous_messages[1:]:
-                    history.append({
-                        "role": "user" if msg.role == "user" else "model",
-                        "parts": [msg.content]
-                    })
-            else:
-                # First message is assistant, add system prompt as separate user message
-                history.append({
-                    "role": "user",
-                    "parts": [system_prompt]
-                })
-                for msg in previous_messages:
-                    history.append({
-                        "role": "user" if msg.role == "user" else "model",
-                        "parts": [msg.content]
-                    })
-        else:
-            # With context or no previous messages, just add previous messages as-is
-            for msg in previous_messages:
-                history.append({
-                    "role": "user" if msg.role == "user" else "model",
-                    "parts": [msg.content]
-                })
-        
-        # Start chat with history
-        chat_session = model.start_chat(history=history)
-        
-        # Send the last message (current user message)
-        last_message = request.messages[-1].content
-        response = chat_session.send_message(last_message)
-        
-        if not response or not response.text:
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to generate response from AI model"
-            )
-        
-        return ChatResponse(message=response.text.strip())
+        response = await asyncio.to_thread(_send, model_name, history, message, False)
+        text = _chunk_text(response) if response else ""
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing chat request: {str(e)}"
+        )
+    
+    if not text:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to generate response from AI model"
+        )
+    
+    reply = text.strip()
+    _commit(session, request, reply)
+    return ChatResponse(message=reply, session_id=request.session_id)
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest) -> StreamingResponse:
+    """
+    ``/chat`` as Server-Sent Events: ``token`` events carry ``{"text": ...}``
+    deltas as Gemini produces them, then a ``done`` event with the full
+    ``message`` (and ``session_id``). Failures after the first byte arrive as an ``error`` event.
+    """
+    model_name = await _resolve_model()
+    session, history, message = _prepare(request)
     
+    try:
+        response = await asyncio.to_thread(_send, model_name, history, message, True)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing chat request: {str(e)}"
         )
+    
+    async def _events() -> AsyncIterator[bytes]:
+        chunks = iter(response)
+        parts = []
+        try:
+            while True:
+                # the SDK stream is blocking, pull each chunk off the event loop
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                text = _chunk_text(chunk)
+                if text:
+                    parts.append(text)
+                    yield _sse("token", {"text": text})
+        except Exception as e:
+            yield _sse("error", {"detail": f"Error processing chat request: {str(e)}"})
+            return
+        reply = "".join(parts).strip()
+        if not reply:
+            yield _sse("error", {"detail": "Failed to generate response from AI model"})
+            return
+        _commit(session, request, reply)
+        yield _sse("done", {"message": reply, "session_id": request.session_id})
+    
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _session_info(session: ChatSession) -> ChatSessionInfo:
+    return ChatSessionInfo(
+        session_id=session.session_id,
+        turns=len(session.turns),
+        compacted_turns=session.compacted_turns,
+        history_tokens=session.history_tokens(),
+    )
+
+
+@router.post("/chat/sessions", response_model=ChatSessionInfo, status_code=201)
+async def create_chat_session(body: ChatSessionCreate) -> ChatSessionInfo:
+    """Start a server-side conversation, optionally about a classification."""
+    _require_sessions()
+    session = get_session_store().create(create_system_prompt(body.context), body.context)
+    return _session_info(session)
+
+
+@router.get("/chat/sessions/{session_id}", response_model=ChatSessionInfo)
+async def get_chat_session(session_id: str) -> ChatSessionInfo:
+    _require_sessions()
+    session = get_session_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired chat session.")
+    return _session_info(session)
+
+
+@router.delete("/chat/sessions/{session_id}", status_code=204)
+async def delete_chat_session(session_id: str) -> Response:
+    _require_sessions()
+    if not get_session_store().delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired chat session.")
+    return Response(status_code=204)
@@ -0,0 +1,108 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+
+from executors import WorkerSaturated
+from jobs import JOB_STORE_DIR, Job, JobQueue, JobStore
+from routers.xai import build_result, explain_options, run_explain
+from schemas import ExplainOptions, ExplainResult, JobInfo, JobPriority
+from uploads import read_upload
+
+
+router = APIRouter(tags=["jobs"])
+
+# Saturated workload pools are retried rather than failing a queued job.
+_SATURATED_RETRY_S = (0.5, 1.0, 2.0, 4.0, 8.0)
+
+_queue: Optional[JobQueue] = None
+
+
+async def _explain_job(data: bytes, payload: Dict[str, Any]) -> Dict[str, Any]:
+    opts = ExplainOptions(**payload)
+    for delay in _SATURATED_RETRY_S:
+        try:
+            explained, _ = await run_explain(data, opts)
+            break
+        except WorkerSaturated:
+            await asyncio.sleep(delay)
+    else:
+        explained, _ = await run_explain(data, opts)
+    # stored results are self-contained: maps are always inline base64
+    return build_result(explained).dict()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(_explain_job, JobStore(JOB_STORE_DIR))
+    return _queue
+
+
+def _info(job: Job) -> JobInfo:
+    return JobInfo(
+        job_id=job.job_id,
+        status=job.status,
+        priority=job.priority,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+    )
+
+
+async def _get_job(job_id: str) -> Job:
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job
+
+
+@router.post("/jobs", response_model=JobInfo, status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    opts: ExplainOptions = Depends(explain_options),
+    priority: JobPriority = Query(default="interactive"),
+) -> JobInfo:
+    """
+    Queue an explanation and return its job id immediately.
+
+    Takes the same settings as ``/explain``. ``interactive`` jobs are always
+    started before queued ``bulk`` jobs. Poll ``/jobs/{job_id}`` (optionally
+    long-polling with ``wait``) and fetch ``/jobs/{job_id}/result`` once it
+    has succeeded.
+    """
+    data = await read_upload(file)
+    job = await get_job_queue().submit(data, opts.dict(), priority)
+    return _info(job)
+
+
+@router.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str, wait: float = Query(default=0.0, ge=0.0, le=60.0)) -> JobInfo:
+    """Job status; with ``wait`` blocks up to that many seconds for it to finish."""
+    await _get_job(job_id)
+    job = await get_job_queue().wait(job_id, wait)
+    if job is None:  # pruned while waiting
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return _info(job)
+
+
+@router.get("/jobs/{job_id}/result", response_model=ExplainResult)
+async def get_job_result(job_id: str) -> Dict[str, Any]:
+    job = await _get_job(job_id)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}.")
+    result = await get_job_queue().result(job_id)
+    if result is None:
+        raise HTTPException(status_code=410, detail="Job result is no longer stored.")
+    return result
+
+
+@router.delete("/jobs/{job_id}", response_model=JobInfo)
+async def cancel_job(job_id: str) -> JobInfo:
+    """
+    Cancel a queued or running job; finished jobs are returned unchanged.
+    A running job reports ``cancelled`` once it reaches its next await.
+    """
+    await _get_job(job_id)
+    return _info(await get_job_queue().cancel(job_id))
@@ -1,34 +1,224 @@
-from io import BytesIO
+import asyncio
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from typing import IO, Any, AsyncIterator, Callable, Iterator, List, Tuple
 
 from fastapi import APIRouter, File, UploadFile
+from fastapi.responses import StreamingResponse
 from PIL import Image
 
-from models.ensemble import run_prediction
-from schemas import ModelScore, PredictionResult
+from cache import content_hash, get_result_cache, make_key
+from executors import WorkerSaturated, run_in_workload
+from metrics import stage
+from models.batcher import get_batcher
+from models.loader import EnsembleOutput, model_fingerprint, predict_ensemble_batch
+from schemas import BatchPredictionItem, BatchSummary, ModelScore, PredictionResult
+from uploads import decode_image, decode_upload, read_upload
 
 
 router = APIRouter(tags=["prediction"])
 
+BATCH_CHUNK_SIZE = int(os.getenv("PREDICT_BATCH_CHUNK", "16"))
+MAX_MEMBER_BYTES = int(float(os.getenv("PREDICT_BATCH_MAX_MEMBER_MB", "50")) * 1024 * 1024)
+# A saturated predict pool pauses a batch stream instead of ending it; retries
+# back off up to the last delay and continue until the pool has room.
+_SATURATED_BACKOFF_S = (0.1, 0.25, 0.5, 1.0, 2.0)
+
+
+def _to_prediction_result(output: EnsembleOutput) -> PredictionResult:
+    pred_class, conf, probs, per_model = output
+    return PredictionResult(
+        predicted_class=pred_class,
+        confidence=conf,
+        class_probabilities=probs,
+        per_model_scores=[
+            ModelScore(model_name=name, probabilities=prob)
+            for name, prob in per_model.items()
+        ],
+    )
+
+
+def _decode(data: bytes) -> Image.Image:
+    with stage("decode"):
+        return decode_upload(data)[0]
+
 
 @router.post("/predict", response_model=PredictionResult)
 async def predict(
     file: UploadFile = File(...),
 ) -> PredictionResult:
-    contents = await file.read()
-    image = Image.open(BytesIO(contents)).convert("RGB")
-
-    pred_class, conf, probs, per_model = run_prediction(image, model_name=None)
+    contents = await read_upload(file)
 
-    per_model_scores = [
-        ModelScore(model_name=name, probabilities=prob)
-        for name, prob in per_model.items()
-    ]
+    async def _compute() -> PredictionResult:
+        image = await run_in_workload("predict", _decode, contents)
+        # Concurrent requests are grouped into one batched forward per model.
+        output = await get_batcher().submit(image)
+        return _to_prediction_result(output)
 
-    return PredictionResult(
-        predicted_class=pred_class,
-        confidence=conf,
-        class_probabilities=probs,
-        per_model_scores=per_model_scores,
+    return await get_result_cache().get_or_compute(
+        make_key(content_hash(contents), "ensemble", "predict", models=model_fingerprint()),
+        _compute,
     )
 
 
+@router.get("/predict/stats")
+async def predict_stats() -> dict:
+    """Batch-size and queue-wait statistics of the prediction batcher."""
+    return get_batcher().stats()
+
+
+# An entry is either (filename, raw image bytes) or (filename, error message).
+_Entry = Tuple[str, bytes, str]
+
+
+def _skip_member(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base or base.startswith(".") or name.startswith("__MACOSX/")
+
+
+def _iter_upload(filename: str, fh: IO[bytes]) -> Iterator[_Entry]:
+    """Yield the image bytes of a single upload, one archive member at a time."""
+    if zipfile.is_zipfile(fh):
+        fh.seek(0)
+        with zipfile.ZipFile(fh) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skip_member(info.filename):
+                    continue
+                if info.file_size > MAX_MEMBER_BYTES:
+                    yield info.filename, b"", "archive member exceeds size limit"
+                    continue
+                yield info.filename, archive.read(info), ""
+        return
+
+    fh.seek(0)
+    try:
+        # "r|*" reads the tar sequentially, so members are never all resident.
+        archive = tarfile.open(fileobj=fh, mode="r|*")
+    except tarfile.TarError:
+        archive = None
+    if archive is not None:
+        with archive:
+            for member in archive:
+                if not member.isfile() or _skip_member(member.name):
+                    continue
+                if member.size > MAX_MEMBER_BYTES:
+                    yield member.name, b"", "archive member exceeds size limit"
+                    continue
+                extracted = archive.extractfile(member)
+                yield member.name, extracted.read() if extracted else b"", ""
+        return
+
+    fh.seek(0)
+    data = fh.read(MAX_MEMBER_BYTES + 1)
+    if len(data) > MAX_MEMBER_BYTES:
+        yield filename, b"", "file exceeds size limit"
+    else:
+        yield filename, data, ""
+
+
+def _iter_entries(spooled: List[Tuple[str, IO[bytes]]]) -> Iterator[_Entry]:
+    for filename, fh in spooled:
+        yield from _iter_upload(filename, fh)
+
+
+def _next_chunk(
+    entries: Iterator[_Entry], size: int
+) -> Tuple[List[Tuple[str, Image.Image]], List[BatchPredictionItem], bool]:
+    """Decode up to ``size`` images; returns (images, error items, exhausted)."""
+    images: List[Tuple[str, Image.Image]] = []
+    errors: List[BatchPredictionItem] = []
+    for name, data, error in entries:
+        if error:
+            errors.append(BatchPredictionItem(filename=name, error=error))
+        else:
+            try:
+                with stage("decode"):
+                    images.append((name, decode_image(data)[0]))
+            except ValueError as exc:
+                errors.append(BatchPredictionItem(filename=name, error=str(exc)))
+        if len(images) >= size:
+            return images, errors, False
+    return images, errors, True
+
+
+async def _run_batch_step(fn: Callable[..., Any], *args: Any) -> Any:
+    """``run_in_workload("predict", ...)`` that waits out a saturated pool."""
+    attempt = 0
+    while True:
+        try:
+            return await run_in_workload("predict", fn, *args)
+        except WorkerSaturated:
+            await asyncio.sleep(_SATURATED_BACKOFF_S[min(attempt, len(_SATURATED_BACKOFF_S) - 1)])
+            attempt += 1
+
+
+async def _stream_predictions(
+    spooled: List[Tuple[str, IO[bytes]]]
+) -> AsyncIterator[bytes]:
+    entries = _iter_entries(spooled)
+    summary = BatchSummary()
+    try:
+        exhausted = False
+        while not exhausted:
+            try:
+                images, items, exhausted = await _run_batch_step(
+                    _next_chunk, entries, BATCH_CHUNK_SIZE
+                )
+            except Exception as exc:
+                # an unreadable archive ends the entry iterator for good
+                summary.error = f"cannot read upload: {exc}"
+                break
+            if images:
+                try:
+                    outputs = await _run_batch_step(
+                        predict_ensemble_batch, [image for _, image in images]
+                    )
+                except Exception as exc:
+                    items += [
+                        BatchPredictionItem(filename=name, error=f"prediction failed: {exc}")
+                        for name, _ in images
+                    ]
+                else:
+                    items += [
+                        BatchPredictionItem(
+                            filename=name, prediction=_to_prediction_result(output)
+                        )
+                        for (name, _), output in zip(images, outputs)
+                    ]
+            for item in items:
+                summary.total += 1
+                summary.failed += item.error is not None
+                yield (item.json() + "\n").encode("utf-8")
+        summary.complete = summary.error is None
+        yield (summary.json() + "\n").encode("utf-8")
+    finally:
+        for _, fh in spooled:
+            fh.close()
+
+
+@router.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+) -> StreamingResponse:
+    """
+    Classify many images in one request.
+
+    Accepts any number of image files and/or zip/tar archives of patches and
+    streams one ``BatchPredictionItem`` per image as newline-delimited JSON,
+    as soon as each fixed-size batch has been classified. A ``BatchSummary``
+    line always ends the stream; failed predictions are reported per item.
+    """
+    # Copy uploads to our own disk-backed temp files: the stream outlives the
+    # request handler, and the framework may close its upload files first.
+    spooled: List[Tuple[str, IO[bytes]]] = []
+    for upload in files:
+        fh = tempfile.TemporaryFile()
+        await run_in_workload("predict", shutil.copyfileobj, upload.file, fh)
+        spooled.append((upload.filename or "upload", fh))
+
+    return StreamingResponse(
+        _stream_predictions(spooled), media_type="application/x-ndjson"
+    )
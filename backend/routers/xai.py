@@ -1,81 +1,490 @@
-import base64
-from io import BytesIO
-from typing import List, Optional
+import asyncio
+import functools
+import json
+import re
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, File, UploadFile, Query
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import Response, StreamingResponse
 from PIL import Image
 
-from models.ensemble import run_prediction
-from schemas import ExplainResult, ExplanationType, GradCamMap, LimeMap, ShapMap
-from xai.gradcam import generate_gradcam
-from xai.gradient_shap_explainer import generate_gradient_shap
-from xai.lime_explainer import generate_lime_overlay
+from artifacts import URLS_ENABLED, ArtifactStoreFull, get_artifact_store
+from cache import content_hash, get_result_cache, make_key
+from executors import run_in_workload
+from metrics import stage
+from models.loader import model_fingerprint
+from uploads import decode_upload, read_upload
+from schemas import (
+    ExplainOptions,
+    ExplainResult,
+    ExplanationType,
+    ImageFormat,
+    LimeSegmenter,
+    OutputMode,
+    OverlayResolution,
+    ShapBaseline,
+    GradCamMap,
+    LimeMap,
+    ModelScore,
+    PredictionResult,
+    ShapMap,
+)
+from xai.encoding import Artifact, encode_grid, encode_heatmap, encode_image
+from xai.gradcam import generate_ensemble_gradcam, generate_gradcam
+from xai.gradient_shap_explainer import (
+    DEFAULT_N_SAMPLES as SHAP_DEFAULT_N_SAMPLES,
+    MAX_N_SAMPLES as SHAP_MAX_N_SAMPLES,
+    generate_gradient_shap,
+)
+from xai.lime_explainer import DEFAULT_SEGMENTER, MAX_NUM_SAMPLES, generate_lime_overlay
+from xai.pipeline import ExplainContext, prepare_context
 
 
 router = APIRouter(tags=["xai"])
 
+# Encoded maps of one explanation, keyed by field ("heatmap", "overlay",
+# "grid"); this is what the result cache stores for explainers.
+Maps = Dict[str, Artifact]
 
-def _encode_image_to_base64(img) -> str:
-    buf = BytesIO()
-    Image.fromarray(img).save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+_MAP_MODELS = {"gradcam": GradCamMap, "lime": LimeMap, "shap": ShapMap}
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
 
 
-def _encode_heatmap_to_base64(heatmap) -> str:
-    # heatmap is HxW float in [0,1]; convert to grayscale PNG
-    arr = (heatmap * 255).astype("uint8")
-    img = Image.fromarray(arr, mode="L")
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+def _gradcam_map(
+    ctx: ExplainContext, resolution: str, grid_size: Optional[int], image_opts: dict
+) -> Maps:
+    if ctx.model_name is None:
+        grad_img = generate_ensemble_gradcam(
+            ctx.overlay_image,
+            tensors=ctx.tensors,
+            pred_idx=ctx.class_idx,
+            resolution=resolution,
+            grid_size=grid_size,
+            names=list(ctx.per_model_probabilities),
+        )
+    else:
+        grad_img = generate_gradcam(
+            ctx.overlay_image,
+            model_name=ctx.explainer_model,
+            tensor=ctx.tensor,
+            pred_idx=ctx.pred_idx,
+            resolution=resolution,
+            grid_size=grid_size,
+        )
+    with stage("encode", explanation="gradcam"):
+        if grid_size is not None:
+            return {"grid": encode_grid(grad_img)}
+        return {"heatmap": encode_image(grad_img, **image_opts)}
 
 
-@router.post("/explain", response_model=ExplainResult)
-async def explain(
-    file: UploadFile = File(...),
-    model_name: Optional[str] = Query(default="ensemble"),
-    explanation_types: List[ExplanationType] = Query(
-        default=["gradcam", "lime", "shap"]
-    ),
-) -> ExplainResult:
-    raw = await file.read()
-    image = Image.open(BytesIO(raw)).convert("RGB")
+def _lime_map(
+    image: Image.Image,
+    model_name: str,
+    pred_idx: int,
+    num_samples: int,
+    segmenter: str,
+    resolution: str,
+    image_opts: dict,
+) -> Maps:
+    # Takes plain arguments rather than the context so it can be shipped to
+    # the LIME process pool without pickling tensors.
+    lime_img = generate_lime_overlay(
+        image,
+        model_name=model_name,
+        pred_idx=pred_idx,
+        num_samples=num_samples,
+        segmenter=segmenter,
+        resolution=resolution,
+    )
+    with stage("encode", explanation="lime"):
+        return {"overlay": encode_image(lime_img, **image_opts)}
+
 
-    pred_class, conf, probs, per_model = run_prediction(
-        image, model_name=None if model_name == "ensemble" else model_name
+def _shap_map(
+    ctx: ExplainContext,
+    baseline: str,
+    n_samples: int,
+    grid_size: Optional[int],
+    image_opts: dict,
+) -> Maps:
+    shap_map = generate_gradient_shap(
+        ctx.image,
+        model_name=ctx.explainer_model,
+        tensor=ctx.tensor,
+        pred_idx=ctx.pred_idx,
+        baseline=baseline,
+        n_samples=n_samples,
+        grid_size=grid_size,
     )
+    with stage("encode", explanation="shap"):
+        if grid_size is not None:
+            return {"grid": encode_grid(shap_map)}
+        return {"heatmap": encode_heatmap(shap_map, **image_opts)}
+
+
+def _map_model(kind: str, maps: Maps, urls: Optional[Dict[str, str]] = None):
+    """Response model for ``maps``: inline base64, or references from ``urls``."""
+    fields: Dict[str, object] = {}
+    for field, artifact in maps.items():
+        if urls is None:
+            fields[f"{field}_base64"] = artifact.base64()
+        else:
+            fields[f"{field}_url"] = urls[field]
+        if artifact.shape is not None:
+            fields["grid_shape"] = artifact.shape
+        else:
+            fields["media_type"] = artifact.media_type
+    return _MAP_MODELS[kind](**fields)
+
 
-    from schemas import ModelScore, PredictionResult
+def _multipart_response(
+    result: ExplainResult, parts: List[Tuple[str, Artifact]]
+) -> Response:
+    """
+    ``multipart/mixed`` body: the JSON result first (maps reference the
+    other parts as ``cid:<kind>.<field>``), then one binary part per map.
+    """
+    boundary = uuid.uuid4().hex
+    chunks = [
+        f"--{boundary}\r\nContent-Type: application/json\r\n"
+        f"Content-ID: <result>\r\n\r\n".encode("ascii"),
+        result.json().encode("utf-8"),
+        b"\r\n",
+    ]
+    for content_id, artifact in parts:
+        chunks.append(
+            f"--{boundary}\r\nContent-Type: {artifact.media_type}\r\n"
+            f"Content-ID: <{content_id}>\r\n\r\n".encode("ascii")
+        )
+        chunks.append(artifact.data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+    return Response(b"".join(chunks), media_type=f"multipart/mixed; boundary={boundary}")
 
-    prediction = PredictionResult(
-        predicted_class=pred_class,
-        confidence=conf,
-        class_probabilities=probs,
+
+def _prediction(ctx: ExplainContext) -> PredictionResult:
+    return PredictionResult(
+        predicted_class=ctx.predicted_class,
+        confidence=ctx.confidence,
+        class_probabilities=ctx.class_probabilities,
         per_model_scores=[
             ModelScore(model_name=name, probabilities=pp)
-            for name, pp in per_model.items()
+            for name, pp in ctx.per_model_probabilities.items()
         ],
     )
 
-    gradcam = lime = shap = None
 
-    if "gradcam" in explanation_types:
-        grad_img = generate_gradcam(image, model_name=model_name)
-        gradcam = GradCamMap(heatmap_base64=_encode_image_to_base64(grad_img))
+def explain_options(
+    model_name: Optional[str] = Query(default="ensemble"),
+    explanation_types: List[ExplanationType] = Query(
+        default=["gradcam", "lime", "shap"]
+    ),
+    lime_num_samples: int = Query(default=300, ge=1, le=MAX_NUM_SAMPLES),
+    lime_segmenter: LimeSegmenter = Query(default=DEFAULT_SEGMENTER),
+    resolution: OverlayResolution = Query(default="model"),
+    shap_baseline: ShapBaseline = Query(default="imagenet-mean"),
+    shap_n_samples: int = Query(default=SHAP_DEFAULT_N_SAMPLES, ge=1, le=SHAP_MAX_N_SAMPLES),
+    shap_grid: Optional[int] = Query(default=None, ge=4, le=224),
+    gradcam_grid: Optional[int] = Query(default=None, ge=4, le=224),
+    image_format: ImageFormat = Query(default="png"),
+    png_compression: int = Query(default=6, ge=0, le=9),
+    webp_quality: int = Query(default=80, ge=1, le=100),
+) -> ExplainOptions:
+    """Explanation settings shared by ``/explain`` and the job API."""
+    return ExplainOptions(
+        model_name=model_name,
+        explanation_types=explanation_types,
+        lime_num_samples=lime_num_samples,
+        lime_segmenter=lime_segmenter,
+        resolution=resolution,
+        shap_baseline=shap_baseline,
+        shap_n_samples=shap_n_samples,
+        shap_grid=shap_grid,
+        gradcam_grid=gradcam_grid,
+        image_format=image_format,
+        png_compression=png_compression,
+        webp_quality=webp_quality,
+    )
+
+
+# Per explanation kind: PredictionResult for "predict", Maps for explainers.
+Explained = Dict[str, object]
+
+
+def explain_steps(
+    raw: bytes, opts: ExplainOptions
+) -> Tuple[Dict[str, Callable[[], Awaitable[object]]], Dict[str, str]]:
+    """
+    One cached step per kind ("predict" first, then the requested
+    explainers) and the cache keys; awaiting a step yields its result.
+    Steps share the decoded image and prediction, so they can run in any
+    order or concurrently.
+    """
+    # Results are content-addressed: re-opening the same patch with the same
+    # model and explanation settings is served from the cache.
+    cache = get_result_cache()
+    digest = content_hash(raw)
+    image_opts = {
+        "image_format": opts.image_format,
+        "png_compression": opts.png_compression,
+        "webp_quality": opts.webp_quality,
+    }
+
+    # Decoding, the preprocessed tensor and the prediction are computed at
+    # most once and only if something actually misses the cache.
+    context_task: Optional["asyncio.Task[ExplainContext]"] = None
+
+    def _decode_and_prepare() -> ExplainContext:
+        with stage("decode"):
+            # full resolution is only kept when an overlay is drawn at it
+            image, full_image = decode_upload(raw, keep_full=opts.resolution == "full")
+        return prepare_context(image, opts.model_name, full_image)
+
+    async def _context() -> ExplainContext:
+        nonlocal context_task
+        if context_task is None:
+            context_task = asyncio.ensure_future(
+                run_in_workload("predict", _decode_and_prepare)
+            )
+        return await context_task
 
-    if "lime" in explanation_types:
-        lime_img = generate_lime_overlay(image, model_name=model_name)
-        lime = LimeMap(overlay_base64=_encode_image_to_base64(lime_img))
+    async def _run_prediction() -> PredictionResult:
+        return _prediction(await _context())
 
-    if "shap" in explanation_types:
-        shap_map = generate_gradient_shap(image, model_name=model_name)
-        shap = ShapMap(heatmap_base64=_encode_heatmap_to_base64(shap_map))
+    async def _run_gradcam() -> Maps:
+        ctx = await _context()
+        with stage("explain", model=ctx.model_name or "ensemble", explanation="gradcam"):
+            return await run_in_workload(
+                "gradcam", _gradcam_map, ctx, opts.resolution, opts.gradcam_grid, image_opts
+            )
 
-    return ExplainResult(
-        prediction=prediction,
-        gradcam=gradcam,
-        lime=lime,
-        shap=shap,
+    async def _run_lime() -> Maps:
+        ctx = await _context()
+        with stage("explain", model=ctx.model_name or "ensemble", explanation="lime"):
+            return await run_in_workload(
+                "lime",
+                _lime_map,
+                ctx.overlay_image,
+                ctx.explainer_model,
+                ctx.pred_idx,
+                opts.lime_num_samples,
+                opts.lime_segmenter,
+                opts.resolution,
+                image_opts,
+            )
+
+    async def _run_shap() -> Maps:
+        ctx = await _context()
+        with stage("explain", model=ctx.model_name or "ensemble", explanation="shap"):
+            return await run_in_workload(
+                "shap",
+                _shap_map,
+                ctx,
+                opts.shap_baseline,
+                opts.shap_n_samples,
+                opts.shap_grid,
+                image_opts,
+            )
+
+    runners = {"gradcam": _run_gradcam, "lime": _run_lime, "shap": _run_shap}
+    kinds = ["predict"] + [kind for kind in runners if kind in opts.explanation_types]
+    computes = {"predict": _run_prediction, **runners}
+    # grids skip image encoding, so their keys leave the image options out
+    params = {
+        "gradcam": {
+            "resolution": opts.resolution,
+            "grid": opts.gradcam_grid,
+            **(image_opts if opts.gradcam_grid is None else {}),
+        },
+        "lime": {
+            "num_samples": opts.lime_num_samples,
+            "segmenter": opts.lime_segmenter,
+            "resolution": opts.resolution,
+            **image_opts,
+        },
+        "shap": {
+            "baseline": opts.shap_baseline,
+            "n_samples": opts.shap_n_samples,
+            "grid": opts.shap_grid,
+            **(image_opts if opts.shap_grid is None else {}),
+        },
+    }
+    # every kind depends on the predicted class, so on the whole model config
+    models = model_fingerprint()
+    keys = {
+        kind: make_key(digest, opts.model_name, kind, models=models, **params.get(kind, {}))
+        for kind in kinds
+    }
+
+    steps = {
+        kind: functools.partial(cache.get_or_compute, keys[kind], computes[kind])
+        for kind in kinds
+    }
+    return steps, keys
+
+
+async def run_explain(raw: bytes, opts: ExplainOptions) -> Tuple[Explained, Dict[str, str]]:
+    """
+    Prediction and requested maps for an uploaded image, through the result
+    cache. Returns the results per kind and their cache keys.
+    """
+    steps, keys = explain_steps(raw, opts)
+    # Independent explainers run concurrently on their own workload pools.
+    results = await asyncio.gather(*(step() for step in steps.values()))
+    return dict(zip(steps, results)), keys
+
+
+def build_result(
+    explained: Explained, urls: Optional[Callable[[str, str], str]] = None
+) -> ExplainResult:
+    """``ExplainResult`` with inline maps, or map references from ``urls(kind, field)``."""
+    maps = {}
+    for kind in _MAP_MODELS:
+        if kind in explained:
+            refs = None
+            if urls is not None:
+                refs = {field: urls(kind, field) for field in explained[kind]}
+            maps[kind] = _map_model(kind, explained[kind], refs)
+    return ExplainResult(prediction=explained["predict"], **maps)
+
+
+@router.post("/explain", response_model=ExplainResult)
+async def explain(
+    request: Request,
+    file: UploadFile = File(...),
+    opts: ExplainOptions = Depends(explain_options),
+    output: OutputMode = Query(default="json"),
+):
+    """
+    Prediction plus the requested explanation maps.
+
+    ``output`` selects how maps are returned: ``json`` (default) embeds them
+    as base64, ``multipart`` sends them as binary parts after the JSON
+    result, and ``urls`` returns links to ``/explain/artifacts/...`` that
+    serve the raw bytes until ``urls_expire_at``. Images are PNG or WebP (``image_format``,
+    ``png_compression``, ``webp_quality``); ``gradcam_grid``/``shap_grid``
+    return a low-resolution float16 grid instead, for client-side colouring.
+    """
+    if output == "urls" and not URLS_ENABLED:
+        raise HTTPException(
+            status_code=501,
+            detail="output=urls with several server workers needs ARTIFACT_STORE_DIR.",
+        )
+    raw = await read_upload(file)
+    explained, keys = await run_explain(raw, opts)
+
+    if output == "json":
+        return build_result(explained)
+    if output == "urls":
+        # the result cache may evict maps at any time; the links need them
+        # for the advertised lifetime
+        store = get_artifact_store()
+        expires = []
+        try:
+            for kind in _MAP_MODELS:
+                if kind in explained:
+                    expires.append(await asyncio.to_thread(store.put, keys[kind], explained[kind]))
+        except ArtifactStoreFull as exc:
+            raise HTTPException(
+                status_code=503,
+                detail=f"{exc} Retry later or use output=json.",
+                headers={"Retry-After": "60"},
+            )
+        result = build_result(
+            explained,
+            lambda kind, field: str(
+                request.url_for("get_explain_artifact", key=keys[kind], field=field)
+            ),
+        )
+        result.urls_expire_at = min(expires, default=None)
+        return result
+    result = build_result(explained, lambda kind, field: f"cid:{kind}.{field}")
+    parts = [
+        (f"{kind}.{field}", artifact)
+        for kind in _MAP_MODELS
+        if kind in explained
+        for field, artifact in explained[kind].items()
+    ]
+    return _multipart_response(result, parts)
+
+
+def _sse(event: str, data: str) -> bytes:
+    return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+
+
+@router.post("/explain/stream")
+async def explain_stream(
+    file: UploadFile = File(...),
+    opts: ExplainOptions = Depends(explain_options),
+) -> StreamingResponse:
+    """
+    ``/explain`` as Server-Sent Events, each map sent as soon as it is ready.
+
+    The ``prediction`` event (a ``PredictionResult``) comes first, then one
+    ``gradcam``/``lime``/``shap`` event per requested map in completion
+    order, with the same payload as the matching ``ExplainResult`` field.
+    A failed explainer sends an ``error`` event instead; the stream ends with
+    a ``done`` event. Maps are always inline base64.
+    """
+    raw = await read_upload(file)
+    steps, _ = explain_steps(raw, opts)
+    tasks = {kind: asyncio.ensure_future(step()) for kind, step in steps.items()}
+    try:
+        # undecodable uploads and saturated pools still get a proper status
+        prediction = await tasks["predict"]
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+    async def _settled(kind: str) -> Tuple[str, object, Optional[Exception]]:
+        try:
+            return kind, await tasks[kind], None
+        except Exception as exc:
+            return kind, None, exc
+
+    async def _events() -> AsyncIterator[bytes]:
+        try:
+            yield _sse("prediction", prediction.json())
+            explainers = [_settled(kind) for kind in tasks if kind != "predict"]
+            for next_done in asyncio.as_completed(explainers):
+                kind, maps, exc = await next_done
+                if exc is None:
+                    yield _sse(kind, _map_model(kind, maps).json())
+                else:
+                    detail = getattr(exc, "detail", None) or str(exc) or type(exc).__name__
+                    yield _sse("error", json.dumps({"explanation": kind, "detail": detail}))
+            yield _sse("done", "{}")
+        finally:
+            # on disconnect results still land in the cache, nobody waits
+            for task in tasks.values():
+                task.cancel()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+@router.get("/explain/artifacts/{key}/{field}", name="get_explain_artifact")
+async def get_explain_artifact(key: str, field: str) -> Response:
+    """
+    Raw bytes of one explanation map returned with ``output=urls``.
+
+    Links stay valid until the ``urls_expire_at`` of the response that
+    returned them (``ARTIFACT_TTL_S``); after that the explanation has to be
+    requested again.
+    """
+    if not _KEY_RE.fullmatch(key):
+        raise HTTPException(status_code=404, detail="Unknown artifact.")
+    artifact, expires = await asyncio.to_thread(get_artifact_store().get, key, field)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact expired or unknown.")
+    max_age = max(0, int(expires - time.time()))
+    headers = {"Cache-Control": f"private, max-age={max_age}"}
+    if artifact.shape is not None:
+        headers["X-Grid-Shape"] = ",".join(str(n) for n in artifact.shape)
+    return Response(artifact.data, media_type=artifact.media_type, headers=headers)
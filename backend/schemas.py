@@ -15,7 +15,45 @@ class PredictionResult(BaseModel):
     per_model_scores: List[ModelScore]
 
 
+class BatchPredictionItem(BaseModel):
+    filename: str
+    prediction: Optional[PredictionResult] = None
+    error: Optional[str] = None
+
+
+class BatchSummary(BaseModel):
+    """Last line of a ``/predict/batch`` stream; a stream without one was cut off."""
+
+    summary: bool = True
+    total: int = 0
+    failed: int = 0
+    complete: bool = False
+    error: Optional[str] = None
+
+
 ExplanationType = Literal["gradcam", "lime", "shap"]
+LimeSegmenter = Literal["quickshift", "slic", "grid"]
+OverlayResolution = Literal["model", "full"]
+ShapBaseline = Literal["imagenet-mean", "black", "blurred"]
+OutputMode = Literal["json", "multipart", "urls"]
+ImageFormat = Literal["png", "webp"]
+
+
+class ExplainOptions(BaseModel):
+    """Explanation settings (the ``/explain`` query parameters)."""
+
+    model_name: Optional[str] = "ensemble"
+    explanation_types: List[ExplanationType] = ["gradcam", "lime", "shap"]
+    lime_num_samples: int = 300
+    lime_segmenter: LimeSegmenter = "quickshift"
+    resolution: OverlayResolution = "model"
+    shap_baseline: ShapBaseline = "imagenet-mean"
+    shap_n_samples: int = 5
+    shap_grid: Optional[int] = None
+    gradcam_grid: Optional[int] = None
+    image_format: ImageFormat = "png"
+    png_compression: int = 6
+    webp_quality: int = 80
 
 
 class ExplainRequest(BaseModel):
@@ -23,16 +61,36 @@ class ExplainRequest(BaseModel):
     model_name: Optional[str] = None  # None => use ensemble
 
 
+# Each map is returned in exactly one way: inline as ``*_base64`` (default),
+# or as ``*_url`` (an artifact link, or ``cid:`` part of a multipart reply).
+# ``media_type`` tells how images are encoded (PNG or WebP).
+
+
 class GradCamMap(BaseModel):
-    heatmap_base64: str
+    heatmap_base64: Optional[str] = None
+    heatmap_url: Optional[str] = None
+    # Raw CAM alternative (``gradcam_grid``), same encoding as ``ShapMap.grid``.
+    grid_base64: Optional[str] = None
+    grid_url: Optional[str] = None
+    grid_shape: Optional[List[int]] = None
+    media_type: Optional[str] = None
 
 
 class LimeMap(BaseModel):
-    overlay_base64: str
+    overlay_base64: Optional[str] = None
+    overlay_url: Optional[str] = None
+    media_type: Optional[str] = None
 
 
 class ShapMap(BaseModel):
-    heatmap_base64: str
+    heatmap_base64: Optional[str] = None
+    heatmap_url: Optional[str] = None
+    # Low-resolution alternative to the PNG heatmap: little-endian float16
+    # values in [0, 1], row-major with shape ``grid_shape``.
+    grid_base64: Optional[str] = None
+    grid_url: Optional[str] = None
+    grid_shape: Optional[List[int]] = None
+    media_type: Optional[str] = None
 
 
 class ExplainResult(BaseModel):
@@ -40,7 +98,48 @@ class ExplainResult(BaseModel):
     gradcam: Optional[GradCamMap] = None
     lime: Optional[LimeMap] = None
     shap: Optional[ShapMap] = None
+    # With ``output=urls``: Unix time until which the ``*_url`` links work.
+    urls_expire_at: Optional[float] = None
+
+
+JobPriority = Literal["interactive", "bulk"]
+JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+
+class JobInfo(BaseModel):
+    job_id: str
+    status: JobStatus
+    priority: JobPriority
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
+
+class ChatRequest(BaseModel):
+    messages: List[ChatMessage] = []
+    context: Optional[PredictionResult] = None  # the classification being discussed
+    # With a session, ``messages`` holds only the new message(s) and
+    # ``context`` is only sent when it changes.
+    session_id: Optional[str] = None
+
+
+class ChatResponse(BaseModel):
+    message: str
+    session_id: Optional[str] = None
 
 
+class ChatSessionCreate(BaseModel):
+    context: Optional[PredictionResult] = None
 
 
+class ChatSessionInfo(BaseModel):
+    session_id: str
+    turns: int  # messages kept verbatim
+    compacted_turns: int  # older messages condensed to fit the token budget
+    history_tokens: int  # estimated
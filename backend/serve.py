@@ -0,0 +1,234 @@
+"""
+Multi-worker server whose workers share one copy of the model weights.
+
+Run from ``backend/`` instead of ``uvicorn --workers``:
+
+    python serve.py --workers 4 --port 8000 --memory-report
+
+The parent loads the checkpoints once and moves the weights into shared
+memory, builds the quantized copies or TorchScript runners the configured
+precision and backend need, then forks the workers. Each worker runs the
+normal app on the same listening socket and warms up on its own. ONNX
+Runtime sessions cannot be shared, so with ``INFERENCE_BACKEND=onnx`` each
+worker holds its own copy of the weights. The parent stays
+single-threaded so no OpenMP team exists at fork time, and
+``torch.set_num_threads`` is split so the workers together use the CPUs
+available to the process.
+A worker that dies is replaced. SIGTERM/SIGINT stop all workers.
+
+``--memory-report`` prints each worker's resident (RSS), proportional (PSS)
+and private memory from ``/proc/<pid>/smaps_rollup`` once the workers have
+started; send SIGUSR1 to the parent for a fresh report. CPU only, Linux only.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import uvicorn
+
+from models.loader import share_models_for_fork
+
+
+_SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        return os.cpu_count() or 1
+
+
+def threads_per_worker(workers: int, cpus: Optional[int] = None) -> int:
+    return max(1, (cpus or available_cpus()) // max(1, workers))
+
+
+def read_smaps_rollup(pid: int) -> Optional[Dict[str, float]]:
+    """Memory counters of ``pid`` in MiB, or None where smaps_rollup is unavailable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    values: Dict[str, float] = {}
+    for line in lines:
+        key, _, rest = line.partition(":")
+        if key in _SMAPS_FIELDS:
+            values[key] = int(rest.split()[0]) / 1024.0  # kB -> MiB
+    return {
+        "rss_mb": round(values.get("Rss", 0.0), 1),
+        "pss_mb": round(values.get("Pss", 0.0), 1),
+        "shared_mb": round(values.get("Shared_Clean", 0.0) + values.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(
+            values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0), 1
+        ),
+    }
+
+
+def memory_report(
+    parent_pid: int, worker_pids: List[int], baseline: Optional[Dict[str, float]], model_mb: float
+) -> Dict[str, object]:
+    """
+    Per-process memory next to the single-process baseline.
+
+    ``baseline`` is the parent right after loading the models, i.e. what a
+    single process holding them costs. Without sharing, N workers would
+    need about the sum of their RSS. With sharing, the real total is the sum
+    of PSS, since shared pages are split between the processes using them.
+    """
+    workers = {pid: read_smaps_rollup(pid) for pid in worker_pids}
+    parent = read_smaps_rollup(parent_pid)
+    measured = [info for info in workers.values() if info is not None]
+    report: Dict[str, object] = {
+        "model_weights_mb": round(model_mb, 1),
+        "single_process_baseline": baseline,
+        "parent": parent,
+        "workers": {str(pid): info for pid, info in workers.items()},
+    }
+    if measured and parent is not None:
+        report["unshared_estimate_mb"] = round(sum(info["rss_mb"] for info in measured), 1)
+        report["shared_total_pss_mb"] = round(
+            parent["pss_mb"] + sum(info["pss_mb"] for info in measured), 1
+        )
+    return report
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, args: argparse.Namespace, threads: int) -> None:
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(max(1, min(threads, 4)))
+    except RuntimeError:  # already fixed in this process
+        pass
+    config = uvicorn.Config(
+        "main:app", host=args.host, port=args.port, log_level=args.log_level, lifespan="on"
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks ``workers`` children serving ``sock`` and keeps them running."""
+
+    def __init__(self, sock: socket.socket, args: argparse.Namespace, threads: int) -> None:
+        self.sock = sock
+        self.args = args
+        self.threads = threads
+        self.children: Dict[int, Tuple[int, float]] = {}  # pid -> (slot, start time)
+        self.stopping = False
+        self.baseline: Optional[Dict[str, float]] = None
+        self.model_mb = 0.0
+
+    def spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            # only one worker resumes persisted jobs (those no live worker owns)
+            os.environ["JOB_RECOVER"] = "1" if slot == 0 else "0"
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+                signal.signal(signal.SIGALRM, signal.SIG_DFL)
+                _run_worker(self.sock, self.args, self.threads)
+            except BaseException as exc:
+                print(f"Worker {os.getpid()} crashed: {exc}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = (slot, time.monotonic())
+        print(f"Started worker {pid} ({self.threads} threads)")
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(self, signum=None, frame=None) -> None:
+        report = memory_report(os.getpid(), list(self.children), self.baseline, self.model_mb)
+        print(json.dumps({"memory_report": report}, indent=2), flush=True)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.report)
+        for slot in range(self.args.workers):
+            self.spawn(slot)
+        if self.args.memory_report:
+            signal.signal(signal.SIGALRM, self.report)
+            signal.alarm(self.args.report_after)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            child = self.children.pop(pid, None)
+            if child is None or self.stopping:
+                continue
+            slot, started = child
+            print(f"Worker {pid} exited with status {status}; restarting")
+            if time.monotonic() - started < 5.0:
+                time.sleep(1.0)  # do not spin on a worker that fails at startup
+            if not self.stopping:
+                self.spawn(slot)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the API from forked workers sharing model weights.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=0,
+        help="torch intra-op threads per worker (default: available CPUs / workers)",
+    )
+    parser.add_argument("--memory-report", action="store_true")
+    parser.add_argument(
+        "--report-after", type=int, default=60, help="seconds before the memory report"
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs fork(); use uvicorn directly on this platform.")
+
+    # read by the app: server-side chat sessions need a single worker
+    os.environ["SERVE_WORKERS"] = str(args.workers)
+
+    started = time.perf_counter()
+    shared = share_models_for_fork()
+    model_mb = sum(shared.values()) / 2**20
+    print(
+        f"Loaded {len(shared)} models ({model_mb:.0f} MiB) into shared memory "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+    threads = args.threads_per_worker or threads_per_worker(args.workers)
+    supervisor = Supervisor(_bind(args.host, args.port), args, threads)
+    supervisor.baseline = read_smaps_rollup(os.getpid())
+    supervisor.model_mb = model_mb
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
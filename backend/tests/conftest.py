@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the backend runs with backend/ as its working directory and import root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,144 @@
+"""
+Local stand-in for the Gemini REST API, enough for ``routers/chat.py``.
+
+Serves model listing, ``generateContent`` and ``streamGenerateContent``
+(a JSON array sent in chunks) and counts the calls. Point the backend at it
+with ``GEMINI_API_ENDPOINT``; it also runs on its own for development:
+
+    python -m tests.fake_gemini --port 8081
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class FakeGemini:
+    """
+    Replies with ``reply_tokens`` (one stream chunk each). ``fail_status``
+    answers every generate call with that HTTP error; ``cut_stream`` drops
+    the connection after the first stream chunk.
+    """
+
+    def __init__(self, model: str = "gemini-1.5-flash", port: int = 0) -> None:
+        self.model = model
+        self.reply_tokens: List[str] = ["Tumour ", "tissue ", "explained."]
+        self.fail_status: Optional[int] = None
+        self.cut_stream = False
+        self.calls: Dict[str, int] = {"list": 0, "generate": 0, "stream": 0}
+        self.requests: List[dict] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "FakeGemini":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, kind: str, body: Optional[dict] = None) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+            if body is not None:
+                self.requests.append(body)
+
+    def _candidate(self, text: str) -> dict:
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _json(self, status: int, payload: object) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, data: bytes) -> None:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self) -> None:
+                if not self.path.startswith("/v1beta/models"):
+                    self._json(404, {"error": {"code": 404, "message": "not found"}})
+                    return
+                fake._count("list")
+                self._json(
+                    200,
+                    {
+                        "models": [
+                            {
+                                "name": f"models/{fake.model}",
+                                "supportedGenerationMethods": ["generateContent"],
+                            }
+                        ]
+                    },
+                )
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+                stream = path.endswith(":streamGenerateContent")
+                fake._count("stream" if stream else "generate", body)
+
+                if fake.fail_status is not None:
+                    self._json(
+                        fake.fail_status,
+                        {"error": {"code": fake.fail_status, "message": "upstream unavailable"}},
+                    )
+                    return
+                if not stream:
+                    self._json(200, fake._candidate("".join(fake.reply_tokens)))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self._chunk(b"[")
+                for i, token in enumerate(fake.reply_tokens):
+                    prefix = b",\r\n" if i else b""
+                    self._chunk(prefix + json.dumps(fake._candidate(token)).encode("utf-8"))
+                    if fake.cut_stream:
+                        self.close_connection = True
+                        return  # no terminating chunk: the client sees a broken body
+                self._chunk(b"]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in Gemini server.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--model", default="gemini-1.5-flash")
+    args = parser.parse_args()
+    fake = FakeGemini(args.model, args.port)
+    print(f"Fake Gemini listening on {fake.endpoint}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
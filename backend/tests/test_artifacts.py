@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+import artifacts
+from artifacts import ArtifactStore, ArtifactStoreFull
+from xai.encoding import Artifact
+
+
+KEY_A = "a" * 64
+KEY_B = "b" * 64
+
+
+def _maps(payload: bytes):
+    return {"heatmap": Artifact(payload, "image/png")}
+
+
+def test_full_store_rejects_instead_of_evicting():
+    store = ArtifactStore(max_bytes=10, ttl_seconds=60)
+    store.put(KEY_A, _maps(b"12345678"))
+
+    with pytest.raises(ArtifactStoreFull):
+        store.put(KEY_B, _maps(b"12345678"))
+
+    # links already handed out keep working, and re-storing them fits
+    assert store.get(KEY_A, "heatmap")[0].data == b"12345678"
+    store.put(KEY_A, _maps(b"12345678"))
+    assert store.stats()["rejected"] == 1
+
+
+def test_entries_expire_after_ttl():
+    store = ArtifactStore(max_bytes=10, ttl_seconds=0.05)
+    expires = store.put(KEY_A, _maps(b"12345678"))
+    artifact, reported = store.get(KEY_A, "heatmap")
+    assert artifact is not None and reported == expires
+
+    time.sleep(0.1)
+    assert store.get(KEY_A, "heatmap") == (None, 0.0)
+    store.put(KEY_B, _maps(b"12345678"))  # the expired entry no longer takes room
+
+
+def test_disk_store_is_shared_between_processes(tmp_path):
+    writer = ArtifactStore(max_bytes=1 << 20, ttl_seconds=60, disk_dir=tmp_path)
+    reader = ArtifactStore(max_bytes=1 << 20, ttl_seconds=60, disk_dir=tmp_path)
+    writer.put(KEY_A, _maps(b"png bytes"))
+
+    artifact, _ = reader.get(KEY_A, "heatmap")
+    assert artifact.data == b"png bytes"
+    assert reader.get(KEY_A, "overlay") == (None, 0.0)
+    assert reader.stats()["entries"] == 1
+
+
+def test_returned_url_can_be_fetched(monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("captum")
+    pytest.importorskip("lime")
+    pytest.importorskip("httpx")  # TestClient
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    import cache
+    from routers import xai
+    from schemas import PredictionResult
+
+    prediction = PredictionResult(
+        predicted_class="01_TUMOR",
+        confidence=0.9,
+        class_probabilities={"01_TUMOR": 0.9},
+        per_model_scores=[],
+    )
+
+    async def fake_explain(raw, opts):
+        return {"predict": prediction, "gradcam": _maps(b"gradcam png")}, {
+            "predict": KEY_B,
+            "gradcam": KEY_A,
+        }
+
+    monkeypatch.setattr(xai, "run_explain", fake_explain)
+    monkeypatch.setattr(artifacts, "_store", ArtifactStore(1 << 20, 60))
+    # a result cache that keeps nothing: the links must not depend on it
+    monkeypatch.setattr(cache, "_cache", cache.ResultCache(max_bytes=0, ttl_seconds=60))
+    app = FastAPI()
+    app.include_router(xai.router, prefix="/api")
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/explain",
+            params={"output": "urls", "explanation_types": "gradcam"},
+            files={"file": ("patch.png", b"not decoded here", "image/png")},
+        )
+        assert response.status_code == 200
+        body = response.json()
+        assert body["urls_expire_at"] > time.time()
+
+        fetched = client.get(body["gradcam"]["heatmap_url"])
+        assert fetched.status_code == 200
+        assert fetched.content == b"gradcam png"
+        assert fetched.headers["content-type"] == "image/png"
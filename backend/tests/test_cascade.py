@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from models import cascade
+
+
+ORDER = ["MobileNetV2", "ResNet50", "DenseNet121", "EfficientNetB3"]
+WEIGHTS = {name: 1.0 for name in ORDER}
+
+
+def _stacked(*per_model_rows):
+    """(models, batch, classes) from one list of probability rows per model."""
+    return np.array(per_model_rows, dtype=np.float64)
+
+
+def test_confident_row_stops_after_first_model():
+    confident = [0.97, 0.01, 0.01, 0.01]
+    unsure = [0.40, 0.35, 0.15, 0.10]
+    stacked = _stacked(
+        [confident, unsure],
+        [[0.25] * 4, [0.70, 0.10, 0.10, 0.10]],
+        [[0.25] * 4, [0.80, 0.10, 0.05, 0.05]],
+        [[0.25] * 4, [0.90, 0.05, 0.03, 0.02]],
+    )
+    probs, used = cascade.simulate(stacked, ORDER, WEIGHTS, 0.9, 0.5)
+
+    assert used.tolist() == [1, 4]
+    np.testing.assert_allclose(probs[0], confident)
+    np.testing.assert_allclose(probs[1], stacked[:, 1].mean(axis=0))
+
+
+def test_unreachable_thresholds_match_full_ensemble():
+    rng = np.random.default_rng(0)
+    stacked = rng.dirichlet(np.ones(9), size=(4, 16))
+    probs, used = cascade.simulate(stacked, ORDER, WEIGHTS, 1.1, 1.1)
+
+    assert (used == 4).all()
+    np.testing.assert_allclose(probs, stacked.mean(axis=0))
+
+
+def test_representative_falls_back_to_first_model_that_ran():
+    # a confident patch stops after MobileNetV2, so the default explainer
+    # model (the first available one, ResNet50) has no scores
+    assert cascade.representative(["MobileNetV2"], "ResNet50", ORDER) == "MobileNetV2"
+    assert cascade.representative(
+        ["DenseNet121", "MobileNetV2"], "ResNet50", ORDER
+    ) == "MobileNetV2"
+    assert cascade.representative(ORDER, "ResNet50", ORDER) == "ResNet50"
+
+
+def test_representative_requires_a_model():
+    with pytest.raises(ValueError):
+        cascade.representative([], "ResNet50", ORDER)
+
+
+def test_cascade_order_puts_unlisted_models_last():
+    assert cascade.cascade_order(["Other", "ResNet50", "MobileNetV2"], ORDER) == [
+        "MobileNetV2",
+        "ResNet50",
+        "Other",
+    ]
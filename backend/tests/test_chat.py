@@ -0,0 +1,128 @@
+import importlib
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("google.generativeai")
+pytest.importorskip("httpx")  # TestClient
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tests.fake_gemini import FakeGemini
+
+
+MESSAGES = {"messages": [{"role": "user", "content": "What does TUMOR mean?"}]}
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    fake = FakeGemini().start()
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-key")
+    monkeypatch.setenv("GEMINI_API_ENDPOINT", fake.endpoint)
+    monkeypatch.setenv("GEMINI_MODEL", "")  # empty: discover, and keep .env out
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def chat(gemini):
+    # the module configures the SDK from the environment at import time
+    import routers.chat
+
+    return importlib.reload(routers.chat)
+
+
+@pytest.fixture
+def client(chat):
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+    with TestClient(app) as client:
+        yield client
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_replies_through_the_stand_in(client, gemini):
+    response = client.post("/api/chat", json=MESSAGES)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Tumour tissue explained."
+    sent = gemini.requests[-1]["contents"]
+    assert sent[-1]["parts"][0]["text"] == "What does TUMOR mean?"
+
+
+def test_model_discovery_is_cached(client, chat, gemini, monkeypatch):
+    for _ in range(3):
+        assert client.post("/api/chat", json=MESSAGES).status_code == 200
+    assert gemini.calls["list"] == 1
+    assert gemini.calls["generate"] == 3
+
+    monkeypatch.setattr(chat, "MODEL_DISCOVERY_TTL_S", 0.0)
+    assert client.post("/api/chat", json=MESSAGES).status_code == 200
+    assert gemini.calls["list"] == 2
+
+
+def test_client_is_reused_across_requests(client, chat):
+    client.post("/api/chat", json=MESSAGES)
+    first = chat._clients["gemini-1.5-flash"]
+    client.post("/api/chat/stream", json=MESSAGES)
+
+    assert list(chat._clients) == ["gemini-1.5-flash"]
+    assert chat.get_client("gemini-1.5-flash") is first
+
+
+def test_stream_sends_tokens_then_done(client, gemini):
+    response = client.post("/api/chat/stream", json=MESSAGES)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [data["text"] for kind, data in events if kind == "token"] == gemini.reply_tokens
+    assert events[-1] == ("done", {"message": "Tumour tissue explained.", "session_id": None})
+    assert gemini.calls["stream"] == 1
+
+
+def test_upstream_error_becomes_500(client, gemini):
+    gemini.fail_status = 400
+
+    response = client.post("/api/chat", json=MESSAGES)
+    assert response.status_code == 500
+    assert "Error processing chat request" in response.json()["detail"]
+
+    # fails before the first byte, so the stream endpoint can still answer 500
+    assert client.post("/api/chat/stream", json=MESSAGES).status_code == 500
+
+
+def test_broken_stream_ends_with_error_event(client, gemini):
+    gemini.cut_stream = True
+
+    events = _events(client.post("/api/chat/stream", json=MESSAGES).text)
+
+    assert events[0] == ("token", {"text": gemini.reply_tokens[0]})
+    assert events[-1][0] == "error"
+    assert all(kind != "done" for kind, _ in events)
+
+
+def test_empty_stream_is_an_error(client, gemini):
+    gemini.reply_tokens = []
+
+    response = client.post("/api/chat/stream", json=MESSAGES)
+
+    assert response.status_code == 500
+    assert "empty response" in response.json()["detail"]
+
+
+def test_stream_without_text_ends_with_error_event(client, gemini):
+    gemini.reply_tokens = [""]
+
+    events = _events(client.post("/api/chat/stream", json=MESSAGES).text)
+
+    assert events == [("error", {"detail": "Failed to generate response from AI model"})]
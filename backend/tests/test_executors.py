@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+import pytest
+
+from executors import WorkerSaturated, _Workload
+
+
+def test_cancelled_call_counts_until_its_work_finishes():
+    async def scenario():
+        workload = _Workload("test", workers=1, max_pending=0)
+        release = threading.Event()
+        task = asyncio.ensure_future(workload.run(release.wait))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.01)
+
+        # the request is gone but its work still occupies the only worker
+        assert workload.stats()["in_flight"] == 1
+        with pytest.raises(WorkerSaturated):
+            await workload.run(lambda: None)
+
+        release.set()
+        for _ in range(100):
+            if workload.stats()["in_flight"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert workload.stats()["in_flight"] == 0
+        assert await workload.run(lambda: 42) == 42
+        workload.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+import os
+from io import BytesIO
+from typing import Iterable, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image, UnidentifiedImageError
+
+from models.loader import TRANSFORM_SIZES
+
+
+# Largest accepted single-image upload; enforced while the body streams in.
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+_READ_CHUNK = 1024 * 1024
+
+# Uploads are decoded to roughly this many pixels on the short side (at least
+# twice the largest model input) instead of at full resolution; the model
+# transforms do the final resize.
+DECODE_MIN_SIDE = int(os.getenv("UPLOAD_DECODE_MIN_SIDE", str(2 * max(TRANSFORM_SIZES.values()))))
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413, detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit."
+    )
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware rejecting request bodies above ``max_bytes`` with 413.
+
+    A declared Content-Length is checked before anything is read; otherwise
+    the body is counted as it streams and the request fails as soon as it
+    crosses the limit, before the multipart parser has spooled all of it.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, exempt_paths: Iterable[str] = ()):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.exempt_paths = set(exempt_paths)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            detail = _too_large(self.max_bytes).detail
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # surfaces as a 413 response through the framework
+                    raise _too_large(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in chunks, failing with 413 once it exceeds ``max_bytes``."""
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(_READ_CHUNK)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise _too_large(max_bytes)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _reduce_to(image: Image.Image, min_side: int) -> Image.Image:
+    factor = min(image.width, image.height) // min_side
+    if factor >= 2:
+        return image.reduce(factor)  # box filter, much cheaper than resize()
+    return image
+
+
+def decode_image(
+    data: bytes, keep_full: bool = False, min_side: int = DECODE_MIN_SIDE
+) -> Tuple[Image.Image, Optional[Image.Image]]:
+    """
+    Decode an upload for inference.
+
+    Returns ``(image, full)``: ``image`` is RGB with a short side of about
+    ``min_side`` (never upscaled). JPEGs are decoded straight to that scale
+    via DCT scaling (``draft``); other formats are box-reduced right after
+    decoding. ``full`` is the full-resolution RGB image when ``keep_full``
+    is set (needed for full-resolution overlays), else ``None``. It is
+    decoded separately, so ``image`` is the same either way and cached
+    predictions do not depend on which request decoded the upload first.
+
+    Raises ``ValueError`` for data that is not a decodable image.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        if image.format == "JPEG":
+            image.draft("RGB", (min_side, min_side))
+        reduced = _reduce_to(image.convert("RGB"), min_side)
+        full = Image.open(BytesIO(data)).convert("RGB") if keep_full else None
+        return reduced, full
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        raise ValueError(f"cannot decode image: {exc}") from exc
+
+
+def decode_upload(
+    data: bytes, keep_full: bool = False
+) -> Tuple[Image.Image, Optional[Image.Image]]:
+    """``decode_image`` for request handlers: undecodable data becomes a 400."""
+    try:
+        return decode_image(data, keep_full)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
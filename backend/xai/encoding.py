@@ -0,0 +1,58 @@
+"""Encoders turning explanation maps into transferable artifacts."""
+import base64
+from dataclasses import dataclass
+from io import BytesIO
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+IMAGE_FORMATS = ("png", "webp")
+
+
+@dataclass
+class Artifact:
+    """One encoded map: raw bytes plus what a client needs to interpret them."""
+
+    data: bytes
+    media_type: str
+    shape: Optional[List[int]] = None  # for raw float16 grids
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+def encode_image(
+    img: np.ndarray,
+    image_format: str = "png",
+    png_compression: int = 6,
+    webp_quality: int = 80,
+) -> Artifact:
+    """
+    Encode an RGB (HxWx3) or grayscale (HxW) uint8 array.
+
+    ``png_compression`` is zlib's level (0 = fastest, 9 = smallest);
+    ``webp_quality`` 100 selects lossless WebP, lower values lossy.
+    """
+    buf = BytesIO()
+    image = Image.fromarray(img)
+    if image_format == "png":
+        image.save(buf, format="PNG", compress_level=png_compression)
+    elif image_format == "webp":
+        image.save(buf, format="WEBP", quality=webp_quality, lossless=webp_quality >= 100)
+    else:
+        raise ValueError(f"Unknown image format: {image_format}")
+    return Artifact(buf.getvalue(), f"image/{image_format}")
+
+
+def encode_heatmap(heatmap: np.ndarray, **kwargs) -> Artifact:
+    """HxW float heatmap in [0, 1] as a grayscale image."""
+    return encode_image((heatmap * 255).astype(np.uint8), **kwargs)
+
+
+def encode_grid(grid: np.ndarray) -> Artifact:
+    """Little-endian float16 values, row-major, with the grid's shape."""
+    return Artifact(
+        grid.astype("<f2").tobytes(), "application/octet-stream", list(grid.shape)
+    )
@@ -1,69 +1,278 @@
-from typing import Dict, List, Optional
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
-from pytorch_grad_cam import GradCAM
-from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
-from pytorch_grad_cam.utils.image import show_cam_on_image
-from scipy.ndimage import zoom
 
-from models.loader import load_models, get_transform, TRANSFORM_SIZES
+from metrics import stage
+from models.loader import (
+    CLASS_NAMES,
+    TRANSFORM_SIZES,
+    ensemble_weights,
+    available_models,
+    get_transform,
+    load_explain_models,
+    on_model_evicted,
+    predict_ensemble,
+    preprocess_image,
+)
 
 
-_TARGET_LAYERS: Dict[str, List[torch.nn.Module]] = {}
+_LAYER_GETTERS = {
+    "EfficientNetB3": lambda m: [m.backbone.features[-1]],
+    "DenseNet121": lambda m: [m.backbone.features.denseblock4],
+    "MobileNetV2": lambda m: [m.backbone.features[-1]],
+    "ResNet50": lambda m: [m.backbone.layer4[-1]],
+}
 
 
-def _get_target_layers() -> Dict[str, List[torch.nn.Module]]:
-    global _TARGET_LAYERS
-    if _TARGET_LAYERS:
-        return _TARGET_LAYERS
+def _scale_cam(cam: torch.Tensor) -> torch.Tensor:
+    """Min-max scale each map of an NxHxW batch to [0, 1]."""
+    flat = cam.flatten(1)
+    low = flat.min(dim=1).values.view(-1, 1, 1)
+    high = flat.max(dim=1).values.view(-1, 1, 1)
+    return (cam - low) / (high - low + 1e-7)
 
-    models = load_models()
-    _TARGET_LAYERS = {
-        "EfficientNetB3": [models["EfficientNetB3"].backbone.features[-1]],
-        "DenseNet121": [models["DenseNet121"].backbone.features.denseblock4],
-        "MobileNetV2": [models["MobileNetV2"].backbone.features[-1]],
-        "ResNet50": [models["ResNet50"].backbone.layer4[-1]],
-    }
-    return _TARGET_LAYERS
 
+class GradCamEngine:
+    """
+    Long-lived Grad-CAM for one model.
 
-def generate_gradcam(image: Image.Image, model_name: Optional[str] = None) -> np.ndarray:
-    models = load_models()
-    if not models:
+    Forward hooks are registered once and stay in place, but only record
+    activations for the thread that is currently computing a CAM, so plain
+    inference and other explainers on the same model are unaffected.
+    Gradients come from ``torch.autograd.grad`` on the recorded activations,
+    which keeps concurrent CAM computations on one model independent.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        target_layers: Sequence[torch.nn.Module],
+        name: str = "-",
+    ) -> None:
+        self.model = model
+        self.name = name
+        self._local = threading.local()
+        self._handles = [
+            layer.register_forward_hook(self._save_activation) for layer in target_layers
+        ]
+
+    def _save_activation(self, module, inputs, output) -> None:
+        recorded = getattr(self._local, "activations", None)
+        if recorded is not None:
+            recorded.append(output)
+
+    def forward(self, tensor: torch.Tensor) -> Tuple[torch.Tensor, List[torch.Tensor]]:
+        """Run the model with gradients, returning logits and target activations."""
+        self._local.activations = []
+        try:
+            with torch.enable_grad():
+                logits = self.model(tensor)
+            return logits, self._local.activations
+        finally:
+            self._local.activations = None
+
+    @staticmethod
+    def cams(
+        activations: Sequence[torch.Tensor],
+        grads: Sequence[torch.Tensor],
+        out_size: Tuple[int, int],
+    ) -> torch.Tensor:
+        """Grad-CAM maps (NxHxW, [0, 1]) from target activations and their gradients."""
+        cams = []
+        for act, grad in zip(activations, grads):
+            weights = grad.mean(dim=(2, 3), keepdim=True)
+            cam = torch.relu((weights * act).sum(dim=1, keepdim=True))
+            cam = F.interpolate(cam, size=out_size, mode="bilinear", align_corners=False)
+            cams.append(_scale_cam(cam[:, 0]))
+        return _scale_cam(torch.stack(cams).mean(dim=0)).detach()
+
+    def compute(self, tensor: torch.Tensor, target_indices: Sequence[int]) -> torch.Tensor:
+        """Returns NxHxW CAMs in [0, 1] at the input tensor's resolution."""
+        with stage("gradcam_forward", model=self.name):
+            logits, activations = self.forward(tensor)
+        with stage("gradcam_backward", model=self.name):
+            targets = torch.as_tensor(list(target_indices), device=logits.device)
+            score = logits.gather(1, targets.view(-1, 1)).sum()
+            grads = torch.autograd.grad(score, activations)
+        return self.cams(activations, grads, tuple(tensor.shape[-2:]))
+
+    def close(self) -> None:
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+_engines: Dict[str, GradCamEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_gradcam_engine(model_name: str) -> GradCamEngine:
+    model = load_explain_models([model_name])[model_name]
+    with _engines_lock:
+        engine = _engines.get(model_name)
+        if engine is None or engine.model is not model:
+            engine = GradCamEngine(model, _LAYER_GETTERS[model_name](model), model_name)
+            _engines[model_name] = engine
+        return engine
+
+
+def _drop_engine(model_name: str) -> None:
+    # The hooks stay on the evicted model so in-flight CAMs finish; engine and
+    # model are freed together once nothing references them.
+    with _engines_lock:
+        _engines.pop(model_name, None)
+
+
+on_model_evicted(_drop_engine)
+
+
+def render_cam_overlay(rgb: np.ndarray, cam: np.ndarray, image_weight: float = 0.5) -> np.ndarray:
+    """Blend a [0, 1] CAM (already at the image's size) onto an RGB uint8 image."""
+    heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
+    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
+    return cv2.addWeighted(heatmap, 1.0 - image_weight, rgb, image_weight, 0.0)
+
+
+def generate_gradcam(
+    image: Image.Image,
+    model_name: Optional[str] = None,
+    tensor: Optional[torch.Tensor] = None,
+    pred_idx: Optional[int] = None,
+    resolution: str = "model",
+    grid_size: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Returns an RGB uint8 Grad-CAM overlay for the predicted class.
+
+    ``tensor`` (1xCxHxW, already preprocessed) and ``pred_idx`` can be passed
+    in when the caller has them, which skips the transform and the extra
+    forward pass used to find the target class.
+
+    ``model_name`` of ``None``/``"ensemble"`` produces the fused ensemble CAM
+    (see ``generate_ensemble_gradcam``).
+
+    With ``resolution="model"`` the overlay is rendered at the model's input
+    size; ``"full"`` resizes the CAM to the uploaded image instead. With
+    ``grid_size`` no overlay is rendered: the raw CAM is average-pooled to a
+    ``grid_size x grid_size`` float16 grid in [0, 1].
+    """
+    names = available_models()
+    if not names:
         raise RuntimeError("No models loaded for Grad-CAM.")
 
     if model_name is None or model_name.lower() == "ensemble":
-        # use first model as representative for Grad-CAM
-        model_name = next(iter(models.keys()))
+        tensors = {TRANSFORM_SIZES[names[0]]: tensor} if tensor is not None else None
+        return generate_ensemble_gradcam(
+            image,
+            tensors=tensors,
+            pred_idx=pred_idx,
+            resolution=resolution,
+            grid_size=grid_size,
+        )
 
+    models = load_explain_models([model_name]) if model_name in names else {}
     if model_name not in models:
         raise ValueError(f"Model '{model_name}' not loaded for Grad-CAM")
 
     model = models[model_name]
     size = TRANSFORM_SIZES[model_name]
-    transform = get_transform(size)
-    device = next(model.parameters()).device
+    if tensor is None:
+        transform = get_transform(size)
+        device = next(model.parameters()).device
+        tensor = transform(image).unsqueeze(0).to(device)
+
+    if pred_idx is None:
+        with torch.no_grad():
+            logits = model(tensor)
+            pred_idx = int(torch.argmax(logits, dim=1).item())
+
+    cam = get_gradcam_engine(model_name).compute(tensor, [pred_idx])[0]
+    if grid_size is not None:
+        return _pool_grid(cam, grid_size)
+    return _render(image, cam.cpu().numpy(), resolution)
+
+
+def generate_ensemble_gradcam(
+    image: Image.Image,
+    tensors: Optional[Dict[int, torch.Tensor]] = None,
+    pred_idx: Optional[int] = None,
+    resolution: str = "model",
+    grid_size: Optional[int] = None,
+    names: Optional[Sequence[str]] = None,
+) -> np.ndarray:
+    """
+    Grad-CAM for the ensemble prediction.
+
+    Every loaded backbone runs on the shared preprocessed input (one tensor
+    per distinct input size); the target-class logits of all models are
+    summed so a single ``autograd.grad`` call yields the gradients for every
+    model's target layers. The per-model maps are fused with the ensemble
+    weights. ``pred_idx`` should be the ensemble's predicted class;
+    ``grid_size`` works as in ``generate_gradcam``. ``names`` restricts the
+    fusion to the models behind the prediction (cascade mode runs only some).
+    """
+    models = load_explain_models(names)
+    if not models:
+        raise RuntimeError("No models loaded for Grad-CAM.")
+
+    names = list(models.keys())
+    sizes = {TRANSFORM_SIZES[name] for name in names}
+    if tensors is None or not sizes <= set(tensors):
+        tensors = preprocess_image(image, sizes)
+
+    if pred_idx is None:
+        pred_class = predict_ensemble(image, tensors=tensors)[0]
+        pred_idx = CLASS_NAMES.index(pred_class)
+
+    engines = [get_gradcam_engine(name) for name in names]
+    forwards = []
+    for name, engine in zip(names, engines):
+        with stage("gradcam_forward", model=name):
+            forwards.append(engine.forward(tensors[TRANSFORM_SIZES[name]]))
+    with stage("gradcam_backward", model="ensemble"):
+        score = sum(logits[:, pred_idx].sum() for logits, _ in forwards)
+        all_activations = [act for _, acts in forwards for act in acts]
+        all_grads = torch.autograd.grad(score, all_activations)
+
+    out_size = (max(sizes), max(sizes))
+    weights = ensemble_weights(names)
+    fused = None
+    offset = 0
+    for weight, (_, acts) in zip(weights, forwards):
+        grads = all_grads[offset : offset + len(acts)]
+        offset += len(acts)
+        cam = GradCamEngine.cams(acts, grads, out_size)[0] * float(weight)
+        fused = cam if fused is None else fused + cam
+
+    cam = _scale_cam(fused.unsqueeze(0))[0]
+    if grid_size is not None:
+        return _pool_grid(cam, grid_size)
+    return _render(image, cam.cpu().numpy(), resolution)
 
-    tensor = transform(image).unsqueeze(0).to(device)
 
-    with torch.no_grad():
-        logits = model(tensor)
-        pred_idx = int(torch.argmax(logits, dim=1).item())
+def _pool_grid(cam: torch.Tensor, grid_size: int) -> np.ndarray:
+    grid = F.adaptive_avg_pool2d(cam[None, None], grid_size)[0, 0]
+    return grid.cpu().numpy().astype(np.float16)
 
-    rgb = np.array(image).astype(np.float32) / 255.0
 
-    target_layers = _get_target_layers()[model_name]
-    cam = GradCAM(model=model, target_layers=target_layers)
-    grayscale_cam = cam(tensor, [ClassifierOutputTarget(pred_idx)])[0, :]
+def _render(image: Image.Image, cam: np.ndarray, resolution: str) -> np.ndarray:
+    with stage("gradcam_overlay"):
+        return _render_overlay(image, cam, resolution)
 
-    if grayscale_cam.shape != rgb.shape[:2]:
-        sy = rgb.shape[0] / grayscale_cam.shape[0]
-        sx = rgb.shape[1] / grayscale_cam.shape[1]
-        grayscale_cam = zoom(grayscale_cam, (sy, sx), order=1)
 
-    overlay = show_cam_on_image(rgb, grayscale_cam, use_rgb=True)
-    overlay = (overlay * 255).astype(np.uint8)
-    return overlay
\ No newline at end of file
+def _render_overlay(image: Image.Image, cam: np.ndarray, resolution: str) -> np.ndarray:
+    if resolution == "full":
+        rgb = np.asarray(image, dtype=np.uint8)
+        if cam.shape != rgb.shape[:2]:
+            cam = cv2.resize(cam, (rgb.shape[1], rgb.shape[0]), interpolation=cv2.INTER_LINEAR)
+    elif resolution == "model":
+        h, w = cam.shape
+        rgb = np.asarray(image.resize((w, h), Image.BILINEAR), dtype=np.uint8)
+    else:
+        raise ValueError(f"Unknown overlay resolution: {resolution}")
+    return render_cam_overlay(rgb, cam)
@@ -1,51 +1,119 @@
+import os
 from typing import Optional
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from captum.attr import GradientShap
+from torchvision.transforms.functional import gaussian_blur
 
-from models.loader import load_models, get_transform, TRANSFORM_SIZES, CLASS_NAMES
+from metrics import stage
+from models.loader import (
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    TRANSFORM_SIZES,
+    available_models,
+    get_transform,
+    load_explain_models,
+)
+
+
+BASELINES = ("imagenet-mean", "black", "blurred")
+DEFAULT_N_SAMPLES = 5
+MAX_N_SAMPLES = 200
+DEFAULT_INTERNAL_BATCH_SIZE = int(os.getenv("SHAP_INTERNAL_BATCH_SIZE", "8"))
+
+
+def _baseline(input_tensor: torch.Tensor, kind: str) -> torch.Tensor:
+    """Baseline in normalized input space."""
+    if kind == "imagenet-mean":
+        # all zeros after normalization: a flat image in the ImageNet mean
+        # colour, not the mean of the histology training data
+        return torch.zeros_like(input_tensor)
+    if kind == "black":
+        mean = torch.tensor(IMAGENET_MEAN, device=input_tensor.device).view(1, 3, 1, 1)
+        std = torch.tensor(IMAGENET_STD, device=input_tensor.device).view(1, 3, 1, 1)
+        return ((0.0 - mean) / std).expand_as(input_tensor).clone()
+    if kind == "blurred":
+        # normalization is affine per channel, so blurring commutes with it
+        return gaussian_blur(input_tensor, kernel_size=[31, 31], sigma=[10.0, 10.0])
+    raise ValueError(f"Unknown GradientShap baseline: {kind}")
 
 
 def generate_gradient_shap(
-    image: Image.Image, model_name: Optional[str] = None
+    image: Image.Image,
+    model_name: Optional[str] = None,
+    tensor: Optional[torch.Tensor] = None,
+    pred_idx: Optional[int] = None,
+    baseline: str = "imagenet-mean",
+    n_samples: int = DEFAULT_N_SAMPLES,
+    internal_batch_size: int = DEFAULT_INTERNAL_BATCH_SIZE,
+    grid_size: Optional[int] = None,
 ) -> np.ndarray:
     """
     Returns an HxW heatmap (float32, 0-1) representing GradientShap attributions
     for the top-predicted class of the chosen model.
+
+    A preprocessed ``tensor`` and known ``pred_idx`` skip the transform and
+    the extra forward pass.
+
+    ``n_samples`` noisy baseline interpolations are evaluated at most
+    ``internal_batch_size`` at a time, so peak memory is bounded by the batch
+    size rather than the sample count. With ``grid_size`` the map is
+    average-pooled to a ``grid_size x grid_size`` float16 grid instead.
     """
-    models = load_models()
+    names = available_models()
     if model_name is None or model_name.lower() == "ensemble":
-        model_name = next(iter(models.keys()))
+        model_name = names[0]
+    models = load_explain_models([model_name]) if model_name in names else {}
     if model_name not in models:
         raise ValueError(f"Model '{model_name}' not loaded for GradientShap.")
+    n_samples = max(1, min(n_samples, MAX_N_SAMPLES))
+    internal_batch_size = max(1, internal_batch_size)
 
     model = models[model_name]
     model.eval()
-    device = next(model.parameters()).device
 
-    size = TRANSFORM_SIZES[model_name]
-    transform = get_transform(size)
-    input_tensor = transform(image).unsqueeze(0).to(device)
+    if tensor is None:
+        device = next(model.parameters()).device
+        size = TRANSFORM_SIZES[model_name]
+        transform = get_transform(size)
+        tensor = transform(image).unsqueeze(0).to(device)
+    input_tensor = tensor
 
-    with torch.no_grad():
-        logits = model(input_tensor)
-        pred_idx = int(torch.argmax(logits, dim=1).item())
+    if pred_idx is None:
+        with torch.no_grad():
+            logits = model(input_tensor)
+            pred_idx = int(torch.argmax(logits, dim=1).item())
 
     gs = GradientShap(model)
-    rand_img_dist = torch.cat([input_tensor * 0, input_tensor * 1])
-    attributions = gs.attribute(input_tensor, rand_img_dist, target=pred_idx)
+    baselines = _baseline(input_tensor, baseline)
+
+    # GradientShap averages grad * (input - baseline) over samples, so chunked
+    # estimates combine exactly by a sample-weighted mean.
+    total = torch.zeros_like(input_tensor)
+    remaining = n_samples
+    with stage("shap_attribute", model=model_name):
+        while remaining > 0:
+            chunk = min(internal_batch_size, remaining)
+            attributions = gs.attribute(
+                input_tensor, baselines, n_samples=chunk, target=pred_idx
+            )
+            total += attributions.detach() * chunk
+            remaining -= chunk
+    attributions = total / n_samples
 
-    attr_np = attributions.squeeze().detach().cpu().numpy()
-    if attr_np.ndim == 3:
-        # CxHxW -> HxW by summing over channels
-        attr_np = np.sum(attr_np, axis=0)
+    # CxHxW -> HxW by summing over channels
+    attr = attributions[0].sum(dim=0)
+    if grid_size is not None:
+        attr = F.adaptive_avg_pool2d(attr[None, None], grid_size)[0, 0]
+    attr_np = attr.cpu().numpy().astype(np.float32)
 
     # normalize to 0-1
     attr_np -= attr_np.min()
     if attr_np.max() > 0:
         attr_np /= attr_np.max()
-    return attr_np.astype(np.float32)
-
-
+    if grid_size is not None:
+        return attr_np.astype(np.float16)
+    return attr_np
@@ -1,69 +1,184 @@
-from typing import Optional, List, Callable
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from lime import lime_image
-from skimage.segmentation import mark_boundaries
+from skimage.segmentation import mark_boundaries, quickshift, slic
 
-from models.loader import load_models, get_transform, TRANSFORM_SIZES
+from metrics import stage
+from models.loader import (
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    TRANSFORM_SIZES,
+    available_models,
+    load_explain_models,
+)
 
 
-def _make_classifier_fn(
-    model: torch.nn.Module, transform: Callable[[Image.Image], torch.Tensor], size: int
-):
+DEFAULT_SEGMENTER = os.getenv("LIME_SEGMENTER", "quickshift")
+DEFAULT_BATCH_SIZE = int(os.getenv("LIME_BATCH_SIZE", "32"))
+MAX_NUM_SAMPLES = 2000
+
+
+def _quickshift(image: np.ndarray) -> np.ndarray:
+    # same parameters LIME uses by default
+    return quickshift(image, kernel_size=4, max_dist=200, ratio=0.2)
+
+
+def _slic(image: np.ndarray) -> np.ndarray:
+    return slic(image, n_segments=64, compactness=10, start_label=0)
+
+
+def _grid(image: np.ndarray, cells: int = 8) -> np.ndarray:
+    h, w = image.shape[:2]
+    rows = np.minimum(np.arange(h) * cells // h, cells - 1)
+    cols = np.minimum(np.arange(w) * cells // w, cells - 1)
+    return (rows[:, None] * cells + cols[None, :]).astype(np.int64)
+
+
+SEGMENTERS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "quickshift": _quickshift,
+    "slic": _slic,
+    "grid": _grid,
+}
+
+
+_SEGMENT_CACHE_SIZE = 64
+_segment_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_segment_lock = threading.Lock()
+
+
+def _segments_for(image: np.ndarray, segmenter: str) -> np.ndarray:
+    """Segment ``image``, reusing the result for repeated explanations of it."""
+    digest = hashlib.sha1(image.tobytes()).hexdigest()
+    key = f"{segmenter}:{image.shape}:{digest}"
+    with _segment_lock:
+        segments = _segment_cache.get(key)
+        if segments is not None:
+            _segment_cache.move_to_end(key)
+            return segments
+
+    segments = SEGMENTERS[segmenter](image)
+
+    with _segment_lock:
+        _segment_cache[key] = segments
+        while len(_segment_cache) > _SEGMENT_CACHE_SIZE:
+            _segment_cache.popitem(last=False)
+    return segments
+
+
+def _make_classifier_fn(model: torch.nn.Module, size: int, batch_size: int, name: str = "-"):
     device = next(model.parameters()).device
+    mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
 
-    def classifier_fn(images: List[np.ndarray]) -> np.ndarray:
-        batch = torch.zeros((len(images), 3, size, size), device=device)
-        for i, img in enumerate(images):
-            pil_img = Image.fromarray(img.astype(np.uint8)).convert("RGB")
-            batch[i] = transform(pil_img)
-        with torch.no_grad():
-            logits = model(batch)
-            probs = torch.softmax(logits, dim=1).cpu().numpy()
-        return probs
+    def classifier_fn(images: np.ndarray) -> np.ndarray:
+        # NxHxWx3 uint8 -> normalized Nx3xSxS float, without a PIL round trip
+        # per perturbed sample; inference runs in bounded chunks.
+        outputs = []
+        for start in range(0, len(images), batch_size):
+            chunk = np.ascontiguousarray(images[start : start + batch_size], dtype=np.uint8)
+            batch = torch.from_numpy(chunk).to(device).permute(0, 3, 1, 2).float()
+            batch = batch.div_(255.0)
+            if batch.shape[-2:] != (size, size):
+                batch = F.interpolate(
+                    batch, size=(size, size), mode="bilinear", align_corners=False, antialias=True
+                )
+            batch = (batch - mean) / std
+            with stage("lime_forward", model=name), torch.no_grad():
+                logits = model(batch)
+                outputs.append(torch.softmax(logits, dim=1).cpu().numpy())
+        return np.concatenate(outputs, axis=0)
 
     return classifier_fn
 
 
 def generate_lime_overlay(
-    image: Image.Image, model_name: Optional[str] = None, num_samples: int = 300
+    image: Image.Image,
+    model_name: Optional[str] = None,
+    num_samples: int = 300,
+    pred_idx: Optional[int] = None,
+    segmenter: str = DEFAULT_SEGMENTER,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    resolution: str = "model",
 ) -> np.ndarray:
     """
     Returns an RGB uint8 image with LIME superpixel boundaries overlaid.
+
+    Perturbation and segmentation run at the model's input resolution, since
+    that is all the classifier sees. The overlay is drawn at that resolution
+    too unless ``resolution="full"``, in which case the superpixel mask is
+    scaled up to the original image. ``segmenter`` picks one of
+    ``SEGMENTERS`` and ``batch_size`` caps how many perturbed samples are
+    materialized and pushed through the model at once.
+
+    With a known ``pred_idx`` the explanation is fitted for that class
+    instead of whatever LIME's own perturbed batch ranks first.
     """
-    models = load_models()
+    names = available_models()
     if model_name is None or model_name.lower() == "ensemble":
-        model_name = next(iter(models.keys()))
+        model_name = names[0]
+    models = load_explain_models([model_name]) if model_name in names else {}
     if model_name not in models:
         raise ValueError(f"Model '{model_name}' not loaded for LIME.")
+    if resolution not in ("model", "full"):
+        raise ValueError(f"Unknown overlay resolution: {resolution}")
+    if segmenter not in SEGMENTERS:
+        raise ValueError(f"Unknown LIME segmenter: {segmenter}")
+    num_samples = max(1, min(num_samples, MAX_NUM_SAMPLES))
+    batch_size = max(1, batch_size)
 
     model = models[model_name]
     size = TRANSFORM_SIZES[model_name]
-    transform = get_transform(size)
 
-    rgb_uint = np.array(image).astype(np.uint8)
+    if image.size != (size, size):
+        work = np.array(image.resize((size, size), Image.BILINEAR)).astype(np.uint8)
+    else:
+        work = np.array(image).astype(np.uint8)
+
     explainer = lime_image.LimeImageExplainer()
-    classifier_fn = _make_classifier_fn(model, transform, size)
-
-    explanation = explainer.explain_instance(
-        rgb_uint,
-        classifier_fn,
-        top_labels=1,
-        hide_color=0,
-        num_samples=num_samples,
-    )
+    classifier_fn = _make_classifier_fn(model, size, batch_size, model_name)
+    with stage("lime_segment", model=model_name):
+        segments = _segments_for(work, segmenter)
+
+    if pred_idx is None:
+        label_kwargs = {"top_labels": 1}
+    else:
+        label_kwargs = {"labels": (pred_idx,), "top_labels": None}
 
-    top_label = explanation.top_labels[0]
-    temp, mask = explanation.get_image_and_mask(
+    # perturbation sampling, the lime_forward passes and the surrogate fit
+    with stage("lime_explain", model=model_name):
+        explanation = explainer.explain_instance(
+            work,
+            classifier_fn,
+            hide_color=0,
+            num_samples=num_samples,
+            batch_size=batch_size,
+            segmentation_fn=lambda _: segments,
+            **label_kwargs,
+        )
+
+    top_label = explanation.top_labels[0] if pred_idx is None else pred_idx
+    _, mask = explanation.get_image_and_mask(
         top_label,
         positive_only=False,
         num_features=10,
         hide_rest=False,
     )
-    lime_img = mark_boundaries(temp / 255.0, mask)
-    lime_img = (lime_img * 255).astype(np.uint8)
+    with stage("lime_overlay", model=model_name):
+        base = np.array(image).astype(np.uint8) if resolution == "full" else work
+        if mask.shape != base.shape[:2]:
+            mask = np.array(
+                Image.fromarray(mask.astype(np.int32)).resize(
+                    (base.shape[1], base.shape[0]), Image.NEAREST
+                )
+            )
+        lime_img = mark_boundaries(base / 255.0, mask)
+        lime_img = (lime_img * 255).astype(np.uint8)
     return lime_img
-
-
@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+from models.ensemble import run_prediction
+from models.cascade import representative
+from models.loader import (
+    CASCADE_ORDER,
+    CLASS_NAMES,
+    TRANSFORM_SIZES,
+    available_models,
+    preprocess_image,
+)
+
+
+@dataclass
+class ExplainContext:
+    """Everything explainers can share for one uploaded image."""
+
+    image: Image.Image
+    model_name: Optional[str]  # as requested; None => ensemble
+    explainer_model: str  # concrete model the explainers run on
+    tensors: Dict[int, torch.Tensor]
+    predicted_class: str
+    confidence: float
+    class_probabilities: Dict[str, float]
+    per_model_probabilities: Dict[str, Dict[str, float]]
+    pred_idx: int  # top class of ``explainer_model``
+    full_image: Optional[Image.Image] = None  # only kept for full-resolution overlays
+
+    @property
+    def overlay_image(self) -> Image.Image:
+        """Image overlays are drawn on: full resolution when it was kept."""
+        return self.full_image if self.full_image is not None else self.image
+
+    @property
+    def tensor(self) -> torch.Tensor:
+        return self.tensors[TRANSFORM_SIZES[self.explainer_model]]
+
+    @property
+    def class_idx(self) -> int:
+        """Index of the returned prediction (the ensemble's class in ensemble mode)."""
+        return CLASS_NAMES.index(self.predicted_class)
+
+
+def resolve_explainer_model(model_name: Optional[str]) -> str:
+    models = available_models()
+    if not models:
+        raise RuntimeError("No models loaded. Check MODEL_PATHS.")
+    if model_name is None or model_name.lower() == "ensemble":
+        # single-model explainers (LIME, SHAP) use the first model as the
+        # ensemble representative; Grad-CAM has a true ensemble mode
+        return models[0]
+    if model_name not in models:
+        raise ValueError(f"Model '{model_name}' is not loaded.")
+    return model_name
+
+
+def prepare_context(
+    image: Image.Image,
+    model_name: Optional[str],
+    full_image: Optional[Image.Image] = None,
+) -> ExplainContext:
+    """
+    Preprocess once and predict once; explainers reuse both.
+
+    ``image`` is the (possibly reduced) decode used for inference;
+    ``full_image`` is carried along for full-resolution overlays.
+    """
+    if model_name is not None and model_name.lower() == "ensemble":
+        model_name = None
+    explainer_model = resolve_explainer_model(model_name)
+
+    sizes = TRANSFORM_SIZES.values() if model_name is None else [TRANSFORM_SIZES[model_name]]
+    tensors = preprocess_image(image, sizes)
+    pred_class, conf, probs, per_model = run_prediction(
+        image, model_name=model_name, tensors=tensors
+    )
+
+    if model_name is None:
+        # in cascade mode only some models ran; explain with one of them
+        explainer_model = representative(list(per_model), explainer_model, CASCADE_ORDER)
+    explainer_probs = per_model[explainer_model]
+    pred_idx = int(np.argmax([explainer_probs[cls] for cls in CLASS_NAMES]))
+
+    return ExplainContext(
+        image=image,
+        model_name=model_name,
+        explainer_model=explainer_model,
+        tensors=tensors,
+        predicted_class=pred_class,
+        confidence=conf,
+        class_probabilities=probs,
+        per_model_probabilities=per_model,
+        pred_idx=pred_idx,
+        full_image=full_image,
+    )